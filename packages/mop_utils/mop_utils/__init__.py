@@ -1,3 +1,7 @@
-from .base_model_wrapper import BaseModelWrapper, MopInferenceInput, MopInferenceOutput
+from .base_model_wrapper import BaseModelWrapper, MopInferenceInput, MopInferenceOutput, MopBatchInferenceOutput
+from .registry import register_model_wrapper
 
-__version__ = "2.0"
+__all__ = ['BaseModelWrapper', 'MopInferenceInput', 'MopInferenceOutput', 'MopBatchInferenceOutput',
+           'register_model_wrapper']
+
+__version__ = "2.5"
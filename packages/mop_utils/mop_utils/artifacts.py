@@ -0,0 +1,254 @@
+"""
+Model artifacts: a local cache of the artifacts a model downloads in init(), e.g. NLTK corpora or files fetched from
+a URL, so that a new worker or replica finds them on disk instead of downloading them again, and read-only memory
+mapped arrays shared by the worker processes of a model.
+"""
+import os
+import shutil
+import struct
+import threading
+import urllib.request
+import zipfile
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Mapping, Optional, Union
+
+import numpy as np
+
+from .constant import ARTIFACT_CACHE_DIR_ENV
+
+try:
+    import fcntl
+except ImportError:  # Windows: no lock, concurrent workers may download the same artifact, renamed atomically anyway
+    fcntl = None
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'mop_utils')
+NLTK_DATA_DIR = "nltk_data"
+
+
+class ArtifactCache:
+    """
+    Directory of downloaded artifacts. An artifact is downloaded once, to a temporary path renamed to its final
+    name when complete, under a file lock so that concurrent workers do not download it twice.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None) -> None:
+        self.cache_dir = os.path.abspath(cache_dir or os.environ.get(ARTIFACT_CACHE_DIR_ENV) or DEFAULT_CACHE_DIR)
+
+    @classmethod
+    def from_settings(cls, settings: Dict) -> 'ArtifactCache':
+        """
+        Build the cache from the artifact_cache section of settings.yml, e.g.
+
+            artifact_cache:
+              dir: /mnt/cache/my_model
+
+        The MOP_ARTIFACT_CACHE_DIR environment variable, then ~/.cache/mop_utils, are used if it is not set.
+        """
+        return cls((settings.get('artifact_cache') or {}).get('dir'))
+
+    def path(self, name: str) -> str:
+        """
+        Path of an artifact in the cache, whether it is downloaded or not.
+        """
+        path = os.path.abspath(os.path.join(self.cache_dir, name))
+        if os.path.commonpath((path, self.cache_dir)) != self.cache_dir:
+            raise ValueError(f"The artifact name {name} is outside of the cache directory")
+        return path
+
+    def contains(self, name: str) -> bool:
+        return os.path.exists(self.path(name))
+
+    @contextmanager
+    def _lock(self, name: str) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        lock_path = self.path(name) + '.lock'
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        with open(lock_path, 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def fetch(self, name: str, download: Callable[[str], None]) -> str:
+        """
+        Path of an artifact, downloaded first if it is not in the cache.
+        @param name: Name of the artifact, a relative path in the cache
+        @type name: str
+        @param download: Function writing the artifact, a file or a directory, to the path it is given
+        @type download: Callable[[str], None]
+        @return: Path of the artifact
+        @rtype: str
+        """
+        path = self.path(name)
+        if os.path.exists(path):
+            return path
+        with self._lock(name):
+            if os.path.exists(path):
+                return path
+            tmp_path = f"{path}.tmp-{os.getpid()}"
+            _remove(tmp_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                download(tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                _remove(tmp_path)
+        return path
+
+    def fetch_url(self, name: str, url: str) -> str:
+        """
+        Path of a file downloaded from a URL, downloaded first if it is not in the cache.
+        """
+        return self.fetch(name, lambda path: urllib.request.urlretrieve(url, path))
+
+    def nltk_download(self, *packages: str) -> str:
+        """
+        Replacement of nltk.download(package) in init(): the packages are downloaded to the cache only once, and the
+        cache is added to the NLTK data path. It does not query the NLTK index once the packages are cached.
+
+            ArtifactCache.from_settings(settings).nltk_download('wordnet', 'omw-1.4')
+
+        @return: The NLTK data directory of the cache
+        @rtype: str
+        """
+        try:
+            import nltk
+        except ImportError as e:
+            raise ImportError("nltk is required to download NLTK data: pip install nltk") from e
+        data_dir = self.path(NLTK_DATA_DIR)
+        os.makedirs(data_dir, exist_ok=True)
+        if data_dir not in nltk.data.path:
+            nltk.data.path.insert(0, data_dir)
+
+        def download(package: str) -> Callable[[str], None]:
+            def write_marker(marker_path: str) -> None:
+                if not nltk.download(package, download_dir=data_dir, quiet=True, raise_on_error=True):
+                    raise ValueError(f"Failed to download the NLTK package {package}")
+                open(marker_path, 'w').close()
+            return write_marker
+
+        for package in packages:
+            # the marker tells that the package is complete without asking the NLTK index
+            self.fetch(os.path.join(NLTK_DATA_DIR, f".{package}.done"), download(package))
+        return data_dir
+
+
+def _remove(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+ArrayArtifact = Union[np.ndarray, Dict[str, np.ndarray]]
+
+_ZIP_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+_NPY_SUFFIX = '.npy'
+
+
+def save_arrays(path: str, arrays: Union[np.ndarray, Mapping[str, np.ndarray]]) -> None:
+    """
+    Save model weights in a format load_arrays() memory maps: an array to a .npy file, a dict of arrays to an
+    uncompressed .npz file.
+    @param path: Path of the .npy or .npz file
+    @type path: str
+    @param arrays: An array, or a dict of arrays by name
+    @type arrays: Union[np.ndarray, Mapping[str, np.ndarray]]
+    """
+    if isinstance(arrays, np.ndarray):
+        if not path.endswith(_NPY_SUFFIX):
+            raise ValueError(f"An array is saved to a .npy file. Current path: {path}")
+        np.save(path, arrays, allow_pickle=False)
+        return
+    if not path.endswith('.npz'):
+        raise ValueError(f"A dict of arrays is saved to a .npz file. Current path: {path}")
+    # np.savez stores the arrays uncompressed, so that they can be mapped in place
+    with open(path, 'wb') as f:
+        np.savez(f, **{name: np.asarray(array) for name, array in arrays.items()})
+
+
+def _map_npz_member(path: str, f, info: zipfile.ZipInfo) -> Optional[np.ndarray]:
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+    f.seek(info.header_offset)
+    header = _ZIP_LOCAL_HEADER.unpack(f.read(_ZIP_LOCAL_HEADER.size))
+    name_length, extra_length = header[-2], header[-1]
+    f.seek(info.header_offset + _ZIP_LOCAL_HEADER.size + name_length + extra_length)
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    elif version == (2, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    else:
+        return None
+    if dtype.hasobject or not shape or 0 in shape:
+        return None
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape, order='F' if fortran_order else 'C', offset=f.tell())
+
+
+def load_arrays(path: str, mmap: bool = True) -> ArrayArtifact:
+    """
+    Load arrays saved by save_arrays(), or by np.save() and np.savez(), read-only. Memory mapped arrays are not
+    copied into the process: their pages are read from the page cache on demand, and shared by all the processes
+    mapping the same file. Members of compressed .npz files and object arrays cannot be mapped and are loaded in
+    memory.
+    @param path: Path of a .npy or .npz file
+    @type path: str
+    @param mmap: Whether to memory map the arrays
+    @type mmap: bool
+    @return: The array of a .npy file, or the arrays of a .npz file by name
+    @rtype: Union[np.ndarray, Dict[str, np.ndarray]]
+    """
+    if not path.endswith('.npz'):
+        array = np.load(path, mmap_mode='r' if mmap else None, allow_pickle=False)
+        array.setflags(write=False)
+        return array
+
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-len(_NPY_SUFFIX)] if info.filename.endswith(_NPY_SUFFIX) else info.filename
+            array = _map_npz_member(path, f, info) if mmap else None
+            if array is None:
+                with archive.open(info) as member:
+                    array = np.lib.format.read_array(member, allow_pickle=False)
+            array.setflags(write=False)
+            arrays[name] = array
+    return arrays
+
+
+_shared_arrays: Dict[str, ArrayArtifact] = {}
+_shared_arrays_lock = threading.Lock()
+
+
+def load_shared_arrays(path: str) -> ArrayArtifact:
+    """
+    load_arrays() once per path. Called in init(), the arrays are mapped once per process; loaded in the master
+    process before the workers are forked, e.g. by mop_init() of the local server or a Gunicorn app with preload,
+    the workers inherit the mapping and get the same arrays back without opening the file again.
+    @param path: Path of a .npy or .npz file
+    @type path: str
+    @return: The array of a .npy file, or the arrays of a .npz file by name
+    @rtype: Union[np.ndarray, Dict[str, np.ndarray]]
+    """
+    key = os.path.realpath(path)
+    with _shared_arrays_lock:
+        arrays = _shared_arrays.get(key)
+        if arrays is None:
+            arrays = _shared_arrays[key] = load_arrays(key)
+        return arrays
+
+
+def shared_arrays_stats() -> Dict:
+    """
+    Files and bytes of the arrays loaded with load_shared_arrays().
+    """
+    with _shared_arrays_lock:
+        files = {}
+        for path, arrays in _shared_arrays.items():
+            values = arrays.values() if isinstance(arrays, dict) else (arrays,)
+            files[path] = sum(array.nbytes for array in values)
+    return {'files': files, 'bytes': sum(files.values())}
@@ -1,9 +1,18 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Optional, Any
-from .util import AcsTextResponse, AcsImageResponse, ImageAnalysisInput, TextAnalysisInput, MopInferenceOutputValidator
+from concurrent.futures import Executor, Future
+from typing import List, Dict, Optional, Any, Sequence, Tuple
+
+import numpy as np
+
+from .image import ImageInfo, decode_base64, decode_image_array, read_image_info, read_image_info_from_base64
+from .util import AcsTextResponse, AcsImageResponse, ImageAnalysisInput, TextAnalysisInput, \
+    MopInferenceOutputValidator, MopBatchInferenceOutputValidator
 
 
 class MopInferenceInput:
+    __slots__ = ('__text__', '__image__', '__width__', '__height__', '__images__',
+                 '__decoded__', '__image_options__', '__preloading__')
+
     def __init__(self, text: Optional[str] = None, image: Optional[str] = None,
                  width: Optional[int] = None,
                  height: Optional[int] = None,
@@ -13,6 +22,9 @@ class MopInferenceInput:
         self.__width__ = width
         self.__height__ = height
         self.__images__ = images
+        self.__decoded__ = {}
+        self.__image_options__ = (None, None)
+        self.__preloading__ = None
 
     def from_dict(self, input_dict: Dict) -> Any:
         self.__text__ = input_dict.get('text', None)
@@ -20,12 +32,120 @@ class MopInferenceInput:
         self.__width__ = input_dict.get('width', None)
         self.__height__ = input_dict.get('height', None)
         self.__images__ = input_dict.get('images', None)
+        self.__decoded__ = {}
+        self.__image_options__ = (None, None)
+        self.__preloading__ = None
         if self.__text__ is None and self.__image__ is None and self.__images__ is None:
             raise ValueError('Either text or image must be provided')
         return self
 
+    @classmethod
+    def create(cls, input_dict: Dict) -> 'MopInferenceInput':
+        """
+        Build a MopInferenceInput from a request dict in one call. Same as MopInferenceInput().from_dict(input_dict).
+        """
+        text = input_dict.get('text')
+        image = input_dict.get('image')
+        images = input_dict.get('images')
+        if text is None and image is None and images is None:
+            raise ValueError('Either text or image must be provided')
+        return cls(text, image, input_dict.get('width'), input_dict.get('height'), images)
+
+    def to_dict(self) -> Dict:
+        return {'text': self.__text__, 'image': self.__image__, 'width': self.__width__, 'height': self.__height__,
+                'images': self.__images__}
+
     def __str__(self) -> str:
-        return str(vars(self))
+        return str(self.to_dict())
+
+    def _image_base64(self, index: Optional[int]) -> str:
+        image_base64 = self.__image__ if index is None else (self.__images__ or [])[index]
+        if not image_base64:
+            raise ValueError(f"No image to decode. Current index: {index}")
+        return image_base64
+
+    def get_image_bytes(self, index: Optional[int] = None) -> memoryview:
+        """
+        Decode the base64 image once, with or without a 'data:image/...;base64,' prefix, and cache its bytes.
+        @param index: None for 'image', or the index of the image in 'images'
+        @type index: int
+        @return: A read-only view of the image bytes
+        @rtype: memoryview
+        """
+        key = ('bytes', index)
+        buffer = self.__decoded__.get(key)
+        if buffer is None:
+            buffer = self.__decoded__[key] = memoryview(decode_base64(self._image_base64(index)))
+        return buffer
+
+    def get_image_info(self, index: Optional[int] = None) -> Optional[ImageInfo]:
+        """
+        Read the format, width and height of the image from its header only, without decoding the pixels.
+        @param index: None for 'image', or the index of the image in 'images'
+        @type index: int
+        @return: The image info, or None if the format is not recognized
+        @rtype: ImageInfo
+        """
+        key = ('info', index)
+        if key not in self.__decoded__:
+            buffer = self.__decoded__.get(('bytes', index))
+            self.__decoded__[key] = read_image_info(buffer) if buffer is not None \
+                else read_image_info_from_base64(self._image_base64(index))
+        return self.__decoded__[key]
+
+    def get_image_array(self, index: Optional[int] = None, mode: Optional[str] = None,
+                        size: Optional[Tuple[int, int]] = None) -> np.ndarray:
+        """
+        Decode the pixels of the image on demand with Pillow, and cache them.
+        If neither mode nor size is given, the ones of the image preprocessing stage are used, if any.
+        @param index: None for 'image', or the index of the image in 'images'
+        @type index: int
+        @param mode: Optional Pillow mode to convert the image to, e.g. 'RGB'
+        @type mode: str
+        @param size: Optional (width, height) to resize the image to
+        @type size: Tuple[int, int]
+        @return: The pixels, shaped (height, width) or (height, width, channels)
+        @rtype: np.ndarray
+        """
+        if mode is None and size is None:
+            mode, size = self.__image_options__
+        key = ('array', index, mode, tuple(size) if size is not None else None)
+        array = self.__decoded__.get(key)
+        if array is None:
+            array = self.__decoded__[key] = decode_image_array(self.get_image_bytes(index), mode, size)
+        return array
+
+    def has_images(self) -> bool:
+        return bool(self.__image__) or bool(self.__images__)
+
+    def preload_images(self, mode: Optional[str] = None, size: Optional[Tuple[int, int]] = None) -> None:
+        """
+        Decode the pixels of 'image' and of every item of 'images' into the cache.
+        The given mode and size become the defaults of get_image_array().
+        """
+        self.__image_options__ = (mode, size)
+        if self.__image__:
+            self.get_image_array(None, mode, size)
+        for index in range(len(self.__images__ or [])):
+            self.get_image_array(index, mode, size)
+
+    def preload_images_async(self, executor: Executor, mode: Optional[str] = None,
+                             size: Optional[Tuple[int, int]] = None) -> Future:
+        """
+        Run preload_images() on the given executor. Call wait_images() before reading the images.
+        """
+        self.__preloading__ = executor.submit(self.preload_images, mode, size)
+        return self.__preloading__
+
+    def is_preloading(self) -> bool:
+        return self.__preloading__ is not None
+
+    def wait_images(self) -> None:
+        """
+        Wait for preload_images_async() to finish, and raise its error if any.
+        """
+        if self.__preloading__ is not None:
+            self.__preloading__.result()
 
     def __repr__(self) -> str:
         return self.__str__()
@@ -45,6 +165,7 @@ class MopInferenceInput:
     @image.setter
     def image(self, image: str) -> None:
         self.__image__ = image
+        self.__decoded__ = {}
 
     @property
     def width(self) -> int:
@@ -69,6 +190,7 @@ class MopInferenceInput:
     @images.setter
     def images(self, images: str) -> None:
         self.__images__ = images
+        self.__decoded__ = {}
 
 
 class MopInferenceOutput:
@@ -190,6 +312,82 @@ class MopInferenceOutput:
         return {'confidence_scores': self.confidence_scores, 'predicted_labels': self.predicted_labels}
 
 
+class MopBatchInferenceOutput:
+
+    def __init__(self, confidence_scores: Dict[str, Any], predicted_labels: Dict[str, Any],
+                 label_names: Dict[str, Sequence[str]]) -> None:
+        """
+        Initialize MopBatchInferenceOutput, the columnar counterpart of MopInferenceOutput for a whole batch.
+
+        For each taxonomy, 'confidence_scores' and 'predicted_labels' hold one array shaped (batch, labels),
+        and 'label_names' holds the label names of the columns, shared by every item of the batch.
+        The whole batch is validated once, and the per-item dicts are only built when an item's output is read.
+
+        For example, a batch of two items with the 'hate' taxonomy can be defined as follows:
+        MopBatchInferenceOutput(
+            confidence_scores={"hate": np.array([[0.8, 0.2], [0.3, 0.7]])},
+            predicted_labels={"hate": np.array([[1, 0], [0, 1]])},
+            label_names={"hate": ["sev-0", "sev-1"]}
+        )
+        """
+        self.label_names = {taxonomy: tuple(labels) for taxonomy, labels in label_names.items()}
+        self.confidence_scores = {taxonomy: np.asarray(scores) for taxonomy, scores in confidence_scores.items()}
+        self.predicted_labels = {taxonomy: np.asarray(labels) for taxonomy, labels in predicted_labels.items()}
+        self.batch_size = MopBatchInferenceOutputValidator(self).validate()
+
+    def __len__(self) -> int:
+        return self.batch_size
+
+    def __getitem__(self, index: int) -> 'MopBatchOutputItem':
+        if not -self.batch_size <= index < self.batch_size:
+            raise IndexError(f"MopBatchInferenceOutput: index {index} out of range for batch size {self.batch_size}")
+        return MopBatchOutputItem(self, index % self.batch_size)
+
+    def __str__(self) -> str:
+        return str(vars(self))
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+    def items(self) -> List['MopBatchOutputItem']:
+        """
+        Split the batch into per-item views without building any dict.
+        """
+        return [MopBatchOutputItem(self, index) for index in range(self.batch_size)]
+
+    def item_output(self, index: int) -> Dict:
+        """
+        Build the MopInferenceOutput.output dict of a single item.
+        """
+        confidence_scores = {}
+        predicted_labels = {}
+        for taxonomy, labels in self.label_names.items():
+            confidence_scores[taxonomy] = dict(zip(labels, self.confidence_scores[taxonomy][index].tolist()))
+            predicted_labels[taxonomy] = dict(zip(labels, self.predicted_labels[taxonomy][index].tolist()))
+        return {'confidence_scores': confidence_scores, 'predicted_labels': predicted_labels}
+
+
+class MopBatchOutputItem:
+    """
+    Lazy view of one item of a MopBatchInferenceOutput.
+    """
+    __slots__ = ('batch_output', 'index')
+
+    def __init__(self, batch_output: MopBatchInferenceOutput, index: int) -> None:
+        self.batch_output = batch_output
+        self.index = index
+
+    def __str__(self) -> str:
+        return str(self.output)
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+    @property
+    def output(self) -> Dict:
+        return self.batch_output.item_output(self.index)
+
+
 class BaseModelWrapper(ABC):
     def __init__(self) -> None:
         pass
@@ -214,6 +412,58 @@ class BaseModelWrapper(ABC):
     def convert_model_output_to_mop_output(self, customized_output: Dict, **kwargs) -> MopInferenceOutput:
         raise NotImplementedError("convert_model_output_to_mop_output() method is not implemented")
    
+    def convert_model_output_batch_to_mop_output(self, customized_outputs: List[Dict],
+                                                 **kwargs) -> Optional[MopBatchInferenceOutput]:
+        """
+        Optional implementation: Convert the model outputs of a whole batch to one columnar MOP output.
+        If it returns None, convert_model_output_to_mop_output() is called on every item instead.
+        @param customized_outputs: Model inference outputs returned by inference_batch()
+        @type customized_outputs: List[Dict]
+        @return: Columnar MOP inference output of the batch, or None
+        @rtype: MopBatchInferenceOutput
+        """
+        pass
+
+    def get_batch_bucket_key(self, item: Any) -> int:
+        """
+        Optional implementation: Cheap size key of a request item, used to group items of similar size in the same
+        dynamic batch when bucket_boundaries are configured. The default key is the total length of the str values
+        of the item, e.g. the text length plus the base64 length of its images, or the text or data length of an ACS
+        request.
+        @param item: Request item, a MOP input dict, a MopInferenceInput when the image preprocessing stage is
+        enabled, the raw model input dict or an ACS request
+        @type item: Any
+        @return: Size key of the item
+        @rtype: int
+        """
+        if isinstance(item, TextAnalysisInput):
+            return len(item.text or '')
+        if isinstance(item, ImageAnalysisInput):
+            return len(item.data or '')
+        if isinstance(item, MopInferenceInput):
+            values = (item.text, item.image, item.images)
+        elif isinstance(item, dict):
+            values = item.values()
+        else:
+            return 0
+        size = 0
+        for value in values:
+            if isinstance(value, str):
+                size += len(value)
+            elif isinstance(value, list):
+                size += sum(len(v) for v in value if isinstance(v, str))
+        return size
+
+    def get_warmup_inputs(self) -> Optional[List[Dict]]:
+        """
+        Optional implementation: MOP inputs, e.g. [{'text': ...}], that mop_init() runs through the model at each
+        warmup batch size, via inference() and inference_batch(), before the model serves. It is called after init().
+        The warmup section of settings.yml configures the batch sizes, and sample dataset or synthetic inputs.
+        @return: Warmup inputs, or None to use the warmup settings
+        @rtype: List[Dict]
+        """
+        return None
+
     def convert_acs_text_request_to_model_inference_input(self, req: TextAnalysisInput) -> object:
         """
         Optional implementation: Convert ACS text request to model inference input.
@@ -235,6 +485,28 @@ class BaseModelWrapper(ABC):
         @rtype: AcsTextResponse
         """
         pass
+
+    def convert_acs_text_request_batch_to_model_inference_input(self, reqs: List[TextAnalysisInput]) -> List[object]:
+        """
+        Optional implementation: Convert a batch of ACS text requests to model inference inputs.
+        The default calls convert_acs_text_request_to_model_inference_input() on every request.
+        @param reqs: ACS text requests
+        @type reqs: List[TextAnalysisInput]
+        @return: Model inference inputs, one per request
+        @rtype: List[object]
+        """
+        return [self.convert_acs_text_request_to_model_inference_input(req) for req in reqs]
+
+    def convert_model_inference_output_batch_to_acs_text_response(self, outs: List[object]) -> List[AcsTextResponse]:
+        """
+        Optional implementation: Convert the model outputs of a batch to ACS text responses.
+        The default calls convert_model_inference_output_to_acs_text_response() on every output.
+        @param outs: Model inference outputs returned by inference_batch()
+        @type outs: List[object]
+        @return: ACS text responses, one per output
+        @rtype: List[AcsTextResponse]
+        """
+        return [self.convert_model_inference_output_to_acs_text_response(out) for out in outs]
     
     def convert_acs_image_request_to_model_inference_input(self, req: ImageAnalysisInput) -> object:
         """
@@ -257,4 +529,26 @@ class BaseModelWrapper(ABC):
         @rtype: AcsImageResponse
         """
         pass
+
+    def convert_acs_image_request_batch_to_model_inference_input(self, reqs: List[ImageAnalysisInput]) -> List[object]:
+        """
+        Optional implementation: Convert a batch of ACS image requests to model inference inputs.
+        The default calls convert_acs_image_request_to_model_inference_input() on every request.
+        @param reqs: ACS image requests
+        @type reqs: List[ImageAnalysisInput]
+        @return: Model inference inputs, one per request
+        @rtype: List[object]
+        """
+        return [self.convert_acs_image_request_to_model_inference_input(req) for req in reqs]
+
+    def convert_model_inference_output_batch_to_acs_image_response(self, outs: List[object]) -> List[AcsImageResponse]:
+        """
+        Optional implementation: Convert the model outputs of a batch to ACS image responses.
+        The default calls convert_model_inference_output_to_acs_image_response() on every output.
+        @param outs: Model inference outputs returned by inference_batch()
+        @type outs: List[object]
+        @return: ACS image responses, one per output
+        @rtype: List[AcsImageResponse]
+        """
+        return [self.convert_model_inference_output_to_acs_image_response(out) for out in outs]
  
\ No newline at end of file
@@ -0,0 +1,137 @@
+"""
+Adaptive batch sizing for the dynamic batch model.
+"""
+import inspect
+from collections import deque
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class AdaptiveBatchController:
+    """
+    AIMD (additive-increase, multiplicative-decrease) controller of the batch size and flush interval.
+
+    It is fed with every batch run by the dynamic batch model. Every `window` batches, it compares the latency
+    added by batching, i.e. the p95 batch duration plus the flush interval, with the target:
+    - Over the target, the batch size and the flush interval are both cut by `decrease_factor`.
+    - Under the target, the batch size grows by `batch_size_step` when batches were full, since more items
+      were waiting; otherwise the flush interval grows by `interval_step` to collect bigger batches, as long as
+      the interval plus the p95 batch duration stays within the target.
+
+    The end-to-end p95 item latency is reported but not controlled on: under a backlog it is dominated by queue
+    wait, which shrinking batches would only make worse.
+    """
+
+    def __init__(self, target_p95_latency: float, min_batch_size: int = 1, max_batch_size: int = 64,
+                 min_batch_interval: float = 0.001, max_batch_interval: float = 0.5, window: int = 20,
+                 batch_size_step: int = 1, interval_step: float = 0.005, decrease_factor: float = 0.5,
+                 history_size: int = 100) -> None:
+        if target_p95_latency <= 0:
+            raise ValueError(f"The target p95 latency should be positive. Current value: {target_p95_latency}")
+        if not 1 <= min_batch_size <= max_batch_size:
+            raise ValueError(f"Require 1 <= min_batch_size ({min_batch_size}) <= max_batch_size ({max_batch_size})")
+        if not 0 < min_batch_interval <= max_batch_interval:
+            raise ValueError(f"Require 0 < min_batch_interval ({min_batch_interval}) <= "
+                             f"max_batch_interval ({max_batch_interval})")
+        if not 0 < decrease_factor < 1:
+            raise ValueError(f"The decrease factor should be between 0 and 1. Current value: {decrease_factor}")
+
+        self.target_p95_latency = target_p95_latency
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.min_batch_interval = min_batch_interval
+        self.max_batch_interval = max_batch_interval
+        self.window = window
+        self.batch_size_step = batch_size_step
+        self.interval_step = interval_step
+        self.decrease_factor = decrease_factor
+
+        self._lock = Lock()
+        self._item_latencies: List[float] = []
+        self._batch_durations: List[float] = []
+        self._batch_sizes: List[int] = []
+        self._duration_by_batch_size: Dict[int, float] = {}
+        self._decisions = deque(maxlen=history_size)
+        self._last_p95: Optional[float] = None
+        self._throughput: Optional[float] = None
+
+    @classmethod
+    def from_dict(cls, args: Dict) -> Optional['AdaptiveBatchController']:
+        """
+        Build the controller from the 'adaptive' section of dynamic_batch_args. Unknown keys, like 'enable', are
+        ignored.
+        @return: None if the section sets 'enable' to false.
+        """
+        if not args.get('enable', True):
+            return None
+        names = set(inspect.signature(cls.__init__).parameters) - {'self'}
+        return cls(**{key: value for key, value in args.items() if key in names and value is not None})
+
+    def observe(self, batch_size: int, batch_duration: float, item_latencies: List[float],
+                current_batch_size: int, current_batch_interval: float) -> Optional[Tuple[int, float]]:
+        """
+        Record one batch run.
+        @return: The new (max_batch_size, max_batch_interval) when the controller decides to change them, else None
+        @rtype: Tuple[int, float]
+        """
+        with self._lock:
+            previous = self._duration_by_batch_size.get(batch_size)
+            self._duration_by_batch_size[batch_size] = batch_duration if previous is None \
+                else 0.8 * previous + 0.2 * batch_duration
+            self._item_latencies.extend(item_latencies)
+            self._batch_durations.append(batch_duration)
+            self._batch_sizes.append(batch_size)
+            if len(self._batch_sizes) < self.window:
+                return None
+
+            p95 = float(np.percentile(self._item_latencies, 95))
+            p95_duration = float(np.percentile(self._batch_durations, 95))
+            full_ratio = float(np.mean(np.asarray(self._batch_sizes) >= current_batch_size))
+            self._throughput = sum(self._batch_sizes) / sum(self._batch_durations)
+            self._last_p95 = p95
+            self._item_latencies = []
+            self._batch_durations = []
+            self._batch_sizes = []
+
+            new_batch_size = current_batch_size
+            new_batch_interval = current_batch_interval
+            if p95_duration + current_batch_interval > self.target_p95_latency:
+                reason = 'decrease'
+                new_batch_size = max(self.min_batch_size, int(current_batch_size * self.decrease_factor))
+                new_batch_interval = max(self.min_batch_interval, current_batch_interval * self.decrease_factor)
+            elif full_ratio >= 0.5:
+                reason = 'increase_batch_size'
+                new_batch_size = min(self.max_batch_size, current_batch_size + self.batch_size_step)
+            else:
+                reason = 'increase_interval'
+                headroom = self.target_p95_latency - p95_duration
+                new_batch_interval = max(self.min_batch_interval,
+                                         min(self.max_batch_interval, current_batch_interval + self.interval_step,
+                                             headroom))
+
+            if new_batch_size == current_batch_size and new_batch_interval == current_batch_interval:
+                return None
+            self._decisions.append({
+                'reason': reason,
+                'p95_latency': p95,
+                'p95_batch_duration': p95_duration,
+                'full_batch_ratio': full_ratio,
+                'max_batch_size': new_batch_size,
+                'max_batch_interval': new_batch_interval,
+            })
+            return new_batch_size, new_batch_interval
+
+    def stats(self) -> Dict:
+        """
+        Snapshot of the controller: targets, last measurements and recent decisions.
+        """
+        with self._lock:
+            return {
+                'target_p95_latency': self.target_p95_latency,
+                'last_p95_latency': self._last_p95,
+                'throughput': self._throughput,
+                'batch_duration_by_batch_size': dict(sorted(self._duration_by_batch_size.items())),
+                'decisions': list(self._decisions),
+            }
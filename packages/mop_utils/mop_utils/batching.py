@@ -0,0 +1,622 @@
+"""
+Dynamic batching on top of pyraisdk's DynamicBatchModel.
+"""
+import asyncio
+import bisect
+import queue
+import time
+import traceback
+from dataclasses import asdict, dataclass, fields, replace
+from threading import Condition, Event, Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from pyraisdk import rlog
+
+from .batch_controller import AdaptiveBatchController
+from .metrics import StageMetrics
+from pyraisdk.dynbatch import BaseModel, DynamicBatchModel, PredictCancelledError, PredictTimeoutError
+from pyraisdk.dynbatch.batch import EVENT_KEY_PREFIX, ItemFuture, ItemMessage, RequestCorrelation, \
+    get_request_correlation
+
+SHED_POLICY_REJECT = "reject"
+SHED_POLICY_DROP_OLDEST = "drop_oldest"
+DEFAULT_REQUEST_TIMEOUT = 60.0
+
+
+@dataclass(frozen=True)
+class BatchConfig:
+    """
+    Dynamic batching config of one batch model.
+
+    max_batch_size: Max size of each processing batch.
+    idle_batch_size: If there's no more data in queue, a new batch is launched when its size reaches this value.
+    max_batch_interval: Max interval in seconds to wait for items before launching a batch.
+    request_timeout: Default timeout in seconds of a request, None to wait without timeout.
+    max_queue_depth: Max number of queued items, None for an unbounded queue.
+    shed_policy: How requests are shed when the queue is full, 'reject' or 'drop_oldest'.
+    bucket_boundaries: Ascending size key boundaries. When set, queued items are grouped into buckets of similar
+        size and every batch is made of one bucket, e.g. (256, 1024, 4096) makes 4 buckets.
+    """
+    max_batch_size: int
+    idle_batch_size: int
+    max_batch_interval: float
+    request_timeout: Optional[float] = DEFAULT_REQUEST_TIMEOUT
+    max_queue_depth: Optional[int] = None
+    shed_policy: str = SHED_POLICY_REJECT
+    bucket_boundaries: Tuple[int, ...] = ()
+
+    def __post_init__(self):
+        object.__setattr__(self, 'bucket_boundaries', tuple(sorted(self.bucket_boundaries)))
+        if not self.max_batch_size or self.max_batch_size <= 0:
+            raise ValueError(f"Invalid max_batch_size value {self.max_batch_size}")
+        if not self.idle_batch_size or self.idle_batch_size <= 0:
+            raise ValueError(f"Invalid idle_batch_size value {self.idle_batch_size}")
+        if not self.max_batch_interval or self.max_batch_interval <= 0:
+            raise ValueError(f"Invalid max_batch_interval value {self.max_batch_interval}")
+        if self.idle_batch_size > self.max_batch_size:
+            raise ValueError(f"Require idle_batch_size ({self.idle_batch_size}) <= "
+                             f"max_batch_size ({self.max_batch_size})")
+        if self.shed_policy not in (SHED_POLICY_REJECT, SHED_POLICY_DROP_OLDEST):
+            raise ValueError(f"The shed policy should be {SHED_POLICY_REJECT} or {SHED_POLICY_DROP_OLDEST}. "
+                             f"Current value: {self.shed_policy}")
+        if self.max_queue_depth is not None and self.max_queue_depth <= 0:
+            raise ValueError(f"The max queue depth should be a positive int. Current value: {self.max_queue_depth}")
+
+    @classmethod
+    def from_dict(cls, args: Dict) -> 'BatchConfig':
+        """
+        Build the config from the dynamic_batch_args of mop_init. Unknown keys, like 'enable', are ignored.
+        """
+        names = {field.name for field in fields(cls)}
+        return cls(**{key: value for key, value in args.items() if key in names and value is not None})
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+class OverloadedError(Exception):
+    """
+    Raised when the dynamic batch queue is full. The web layer should map it to HTTP 429.
+    """
+    pass
+
+
+class AsyncItemFuture(ItemFuture):
+    """
+    The future of a queued item that also resolves an asyncio future on the event loop of the request, so that the
+    request awaits its result instead of blocking a thread. The batch worker threads set the result as usual.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, cancellation_token: Optional[Event] = None):
+        super().__init__(cancellation_token)
+        self.loop = loop
+        self.aio_future: asyncio.Future = loop.create_future()
+
+    def set_result(self, result: Any):
+        super().set_result(result)
+        self._notify_loop()
+
+    def set_excepted(self, e: Exception):
+        super().set_excepted(e)
+        self._notify_loop()
+
+    def set_cancelled(self):
+        super().set_cancelled()
+        self._notify_loop()
+
+    def _notify_loop(self) -> None:
+        try:
+            self.loop.call_soon_threadsafe(self._resolve)
+        except RuntimeError:
+            # the event loop is closed, nobody awaits the result anymore
+            pass
+
+    def _resolve(self) -> None:
+        """
+        Copy the outcome of the item to the asyncio future. Runs on the event loop.
+        """
+        if self.aio_future.done():
+            return
+        with self._condition:
+            done, cancelled, exception, result = self._flag_done, self._flag_cancelled, self._exception, self._result
+        if cancelled:
+            self.aio_future.cancel()
+        elif done and exception is not None:
+            self.aio_future.set_exception(exception)
+        elif done:
+            self.aio_future.set_result(result)
+
+
+class MopDynamicBatchModel(DynamicBatchModel):
+    """
+    DynamicBatchModel configured by an explicit BatchConfig instead of process-global environment variables,
+    with a default request timeout and a bounded queue.
+
+    When the queue holds max_queue_depth items, new requests are shed according to the shed policy:
+    - reject: the new request fails fast with OverloadedError.
+    - drop_oldest: the oldest queued items fail with OverloadedError to make room for the new request.
+
+    With a SharedBatchScheduler, the batches are run by the worker threads of the scheduler instead of a worker thread
+    of the model. Bucket boundaries are not supported then.
+    """
+
+    # the monotonic counters of stats()
+    COUNTERS = ('rejected', 'dropped', 'timeouts')
+
+    def __init__(self, model: BaseModel, config: BatchConfig,
+                 controller: Optional[AdaptiveBatchController] = None,
+                 bucket_key: Optional[Callable[[Any], int]] = None, metrics: Optional[StageMetrics] = None,
+                 scheduler: Optional['SharedBatchScheduler'] = None):
+        # DynamicBatchModel.__init__() reads its config from environment variables, so it is not called.
+        if scheduler is not None and config.bucket_boundaries:
+            raise ValueError("Bucket boundaries are not supported with a shared batch scheduler")
+        self.config = config
+        self.controller = controller
+        self.bucket_key = bucket_key
+        self.metrics = metrics
+        self.model = model
+        self.alive = True
+        self.q: queue.Queue[ItemMessage] = queue.Queue()
+        self._admission_lock = Lock()
+        self._counters = dict.fromkeys(self.COUNTERS, 0)
+        self.scheduler = scheduler
+        # items taken from the queue by the scheduler, waiting for their batch to be ready
+        self._pending: List[ItemMessage] = []
+        self._pending_deadline = 0.0
+        # items taken from the queue by the bucketed worker loop, waiting in their bucket
+        self._bucketed = 0
+        if scheduler is None:
+            self.worker = Thread(target=self._worker_run, daemon=True)
+            self.worker.start()
+        else:
+            self.worker = None
+            scheduler.add(self)
+
+    # The worker loop of DynamicBatchModel reads these attributes on every iteration,
+    # so a config swapped by update_config() is picked up by the next batch.
+    @property
+    def max_batch_size(self) -> int:
+        return self.config.max_batch_size
+
+    @property
+    def idle_batch_size(self) -> int:
+        return self.config.idle_batch_size
+
+    @property
+    def max_batch_interval(self) -> float:
+        return self.config.max_batch_interval
+
+    @property
+    def request_timeout(self) -> Optional[float]:
+        return self.config.request_timeout
+
+    @property
+    def max_queue_depth(self) -> Optional[int]:
+        return self.config.max_queue_depth
+
+    @property
+    def shed_policy(self) -> str:
+        return self.config.shed_policy
+
+    def update_config(self, **changes) -> BatchConfig:
+        """
+        Update the config in place, e.g. update_config(max_batch_size=32, max_batch_interval=0.05), without
+        restarting the worker. idle_batch_size is lowered to max_batch_size if needed.
+        @return: The new config
+        @rtype: BatchConfig
+        """
+        with self._admission_lock:
+            max_batch_size = changes.get('max_batch_size', self.config.max_batch_size)
+            if 'idle_batch_size' not in changes and self.config.idle_batch_size > max_batch_size:
+                changes['idle_batch_size'] = max_batch_size
+            self.config = replace(self.config, **changes)
+        return self.config
+
+    @property
+    def queue_depth(self) -> int:
+        return self.q.qsize() + len(self._pending) + self._bucketed
+
+    def close(self):
+        """
+        Stop the model. The queued items that have not started running fail with OverloadedError, so that their
+        requests can be retried.
+        """
+        if self.scheduler is not None:
+            self.scheduler.remove(self)
+        with self._admission_lock:
+            self.alive = False
+            held, self._pending = self._pending, []
+            held.extend(self._drain(self.q.qsize()))
+            if self.worker is not None and self.config.bucket_boundaries and self.bucket_key is not None:
+                # wake the bucketed worker loop up, so that it fails its bucketed items now
+                self.q.put_nowait(None)
+        self._fail(held, "The dynamic batch model is closed")
+
+    def _drain(self, count: int) -> List[ItemMessage]:
+        """
+        Take up to count items from the queue without blocking.
+        """
+        msgs = []
+        for _ in range(count):
+            try:
+                msgs.append(self.q.get_nowait())
+            except queue.Empty:
+                break
+        return msgs
+
+    @staticmethod
+    def _fail(msgs: List[ItemMessage], message: str) -> None:
+        for msg in msgs:
+            msg.future.set_excepted(OverloadedError(message))
+
+    def take_batch(self, now: float) -> Tuple[Optional[List[ItemMessage]], Optional[float]]:
+        """
+        Called by a SharedBatchScheduler: take the next batch if it is ready, under the same conditions as
+        DynamicBatchModel:
+            1. [batch size] >= self.max_batch_size
+            2. queue is empty && [batch size] >= self.idle_batch_size
+            3. [now] - [first item time] >= self.max_batch_interval
+        @param now: The current time.perf_counter()
+        @type now: float
+        @return: The batch, or None and the time the pending items are due, or None and None if there are none
+        @rtype: Tuple[Optional[List[ItemMessage]], Optional[float]]
+        """
+        # the admission lock guards the pending items, which drop_oldest shedding and close() also take
+        with self._admission_lock:
+            while len(self._pending) < self.max_batch_size:
+                try:
+                    msg = self.q.get_nowait()
+                except queue.Empty:
+                    break
+                if self._accept(msg):
+                    if not self._pending:
+                        self._pending_deadline = msg.create_ts + self.max_batch_interval
+                    self._pending.append(msg)
+            if not self._pending:
+                return None, None
+            if len(self._pending) >= self.max_batch_size or now >= self._pending_deadline or \
+                    (self.q.empty() and len(self._pending) >= self.idle_batch_size):
+                batch, self._pending = self._pending, []
+                return batch, None
+            return None, self._pending_deadline
+
+    def stats(self) -> Dict:
+        """
+        Snapshot of the queue depth, the batch config and the shedding and timeout counters.
+        """
+        stats = {
+            'queue_depth': self.queue_depth,
+            **self.config.to_dict(),
+            **self._counters,
+        }
+        if self.controller is not None:
+            stats['adaptive'] = self.controller.stats()
+        return stats
+
+    def _worker_inner(self):
+        """
+        Without bucket boundaries, batches are formed in arrival order by DynamicBatchModel. With them, each bucket
+        is batched on its own, under the same conditions as DynamicBatchModel applied per bucket:
+            1. [bucket size] >= self.max_batch_size
+            2. queue is empty && [bucket size] >= self.idle_batch_size
+            3. [now] - [first item time of the bucket] >= self.max_batch_interval
+        """
+        if not self.config.bucket_boundaries or self.bucket_key is None:
+            super()._worker_inner()
+            return
+
+        buckets: Dict[int, List[ItemMessage]] = {}
+        deadlines: Dict[int, float] = {}
+        while self.alive:
+            try:
+                msg = self.q.get_nowait()
+            except queue.Empty:
+                # idle: run the buckets that are big enough, then wait for items until the nearest deadline
+                for bucket in [b for b, bucket_batch in buckets.items() if len(bucket_batch) >= self.idle_batch_size]:
+                    self._run_bucket(buckets, deadlines, bucket)
+                timeout = min(deadlines.values()) - time.perf_counter() if deadlines else self.max_batch_interval
+                msg = None
+                if timeout > 0:
+                    try:
+                        msg = self.q.get(block=True, timeout=timeout)
+                    except queue.Empty:
+                        pass
+
+            if msg is not None and self._accept(msg):
+                try:
+                    bucket = bisect.bisect_left(self.config.bucket_boundaries, self.bucket_key(msg.item))
+                except Exception as e:
+                    msg.future.set_excepted(e)
+                else:
+                    bucket_batch = buckets.setdefault(bucket, [])
+                    if not bucket_batch:
+                        deadlines[bucket] = msg.create_ts + self.max_batch_interval
+                    bucket_batch.append(msg)
+                    self._bucketed += 1
+                    if len(bucket_batch) >= self.max_batch_size:
+                        self._run_bucket(buckets, deadlines, bucket)
+
+            now = time.perf_counter()
+            for bucket in sorted((b for b, deadline in deadlines.items() if deadline <= now), key=deadlines.get):
+                self._run_bucket(buckets, deadlines, bucket)
+
+        # closed: the bucketed items will not run
+        self._bucketed = 0
+        self._fail([msg for bucket_batch in buckets.values() for msg in bucket_batch],
+                   "The dynamic batch model is closed")
+
+    @staticmethod
+    def _accept(msg: ItemMessage) -> bool:
+        if msg.future.is_external_ct_set():
+            msg.future.set_cancelled()
+            return False
+        return not msg.future.is_cancelled()
+
+    def _run_bucket(self, buckets: Dict[int, List[ItemMessage]], deadlines: Dict[int, float], bucket: int):
+        deadlines.pop(bucket, None)
+        batch = buckets.pop(bucket)
+        self._bucketed -= len(batch)
+        self._worker_run_batch(batch)
+
+    def _worker_run_batch(self, batch: List[ItemMessage]):
+        if self.controller is None and self.metrics is None:
+            super()._worker_run_batch(batch)
+            return
+
+        ts_start = time.perf_counter()
+        if self.metrics is not None:
+            self.metrics.observe_queue_waits([ts_start - msg.create_ts for msg in batch])
+        super()._worker_run_batch(batch)
+        # a failed batch sets its exception on every future; its duration says nothing about the batch size
+        if self.controller is None or batch[0].future._exception is not None:
+            return
+        ts_end = time.perf_counter()
+        decision = self.controller.observe(len(batch), ts_end - ts_start, [ts_end - msg.create_ts for msg in batch],
+                                           self.max_batch_size, self.max_batch_interval)
+        if decision is not None:
+            self.update_config(max_batch_size=decision[0], max_batch_interval=decision[1])
+
+    def _shed(self, size: int) -> None:
+        """
+        Make room for size new items, or raise OverloadedError. Must be called with the admission lock held.
+        """
+        if self.max_queue_depth is None:
+            return
+        if size > self.max_queue_depth:
+            self._counters['rejected'] += 1
+            raise OverloadedError(f"The request size {size} exceeds the max queue depth {self.max_queue_depth}")
+
+        depth = self.queue_depth
+        overflow = depth + size - self.max_queue_depth
+        if overflow <= 0:
+            return
+        # the items in the buckets of the worker loop cannot be dropped
+        if self.shed_policy == SHED_POLICY_REJECT or overflow > len(self._pending) + self.q.qsize():
+            self._counters['rejected'] += 1
+            raise OverloadedError(f"The dynamic batch queue is full. Queue depth: {depth}")
+
+        # the oldest items are the pending ones of the scheduler, then the queued ones
+        dropped, self._pending = self._pending[:overflow], self._pending[overflow:]
+        if self._pending:
+            self._pending_deadline = self._pending[0].create_ts + self.max_batch_interval
+        dropped.extend(self._drain(overflow - len(dropped)))
+        self._fail(dropped, "Dropped from the full dynamic batch queue")
+        self._counters['dropped'] += len(dropped)
+
+    def predict(
+        self,
+        items: List[Any],
+        timeout: Optional[float] = None,
+        raise_timeout: bool = True,
+        cancellation_token: Optional[Event] = None,
+        req_corr: Optional[RequestCorrelation] = None,
+        prepare: Optional[Callable[[Any], Any]] = None,
+    ) -> List[Any]:
+        """
+        Predict with dynamic batching. Same as DynamicBatchModel.predict(), except that the timeout defaults to
+        request_timeout, that the request is shed with OverloadedError when the queue is full, and that the items
+        are passed through prepare, if set, once the request is admitted.
+        """
+        if req_corr is None:
+            req_corr = get_request_correlation()
+        if timeout is None:
+            timeout = self.request_timeout
+
+        ts_start = time.perf_counter()
+        try:
+            futurelist = self._submit(items, ts_start, lambda: ItemFuture(cancellation_token), prepare)
+
+            rs = []
+            for future in futurelist:
+                time_left = None if timeout is None else max(timeout - (time.perf_counter() - ts_start), 0)
+                try:
+                    result = future.get_result(timeout=time_left)
+                except PredictTimeoutError:
+                    future.set_cancelled()
+                    with self._admission_lock:
+                        self._counters['timeouts'] += 1
+                    if raise_timeout:
+                        raise
+                    result = None
+                rs.append(result)
+
+            rlog.event(f'{EVENT_KEY_PREFIX}_PredictDuration', 'success', time.perf_counter() - ts_start,
+                       corr_id=req_corr.CorrelationId, elem=req_corr.Element)
+            return rs
+
+        except Exception as ex:
+            rlog.event(f'{EVENT_KEY_PREFIX}_PredictDuration', 'error', time.perf_counter() - ts_start,
+                       corr_id=req_corr.CorrelationId, elem=req_corr.Element)
+            rlog.errorcf(req_corr.CorrelationId, req_corr.Element, ex, f'{EVENT_KEY_PREFIX}: error in predict')
+            raise
+
+    def _submit(self, items: List[Any], ts_start: float, create_future: Callable[[], ItemFuture],
+                prepare: Optional[Callable[[Any], Any]] = None) -> List[ItemFuture]:
+        """
+        Queue the items of a request, or shed the request, and wake up the shared batch workers. The items are
+        prepared only once the request is admitted, so that a shed request costs no preparation.
+        """
+        futurelist = []
+        with self._admission_lock:
+            if not self.alive:
+                raise OverloadedError("The dynamic batch model is closed")
+            self._shed(len(items))
+            if prepare is not None:
+                items = [prepare(item) for item in items]
+            for item in items:
+                future = create_future()
+                self.q.put_nowait(ItemMessage(future, item, ts_start))
+                futurelist.append(future)
+        if self.scheduler is not None:
+            self.scheduler.notify()
+        return futurelist
+
+    async def predict_async(
+        self,
+        items: List[Any],
+        timeout: Optional[float] = None,
+        raise_timeout: bool = True,
+        cancellation_token: Optional[Event] = None,
+        req_corr: Optional[RequestCorrelation] = None,
+        prepare: Optional[Callable[[Any], Any]] = None,
+    ) -> List[Any]:
+        """
+        Same as predict(), awaited on the running event loop instead of blocking the calling thread while the items
+        wait for their batch. Cancelling the awaiting task cancels the items that have not started running.
+        """
+        if req_corr is None:
+            req_corr = get_request_correlation()
+        if timeout is None:
+            timeout = self.request_timeout
+        loop = asyncio.get_running_loop()
+
+        ts_start = time.perf_counter()
+        futurelist: List[AsyncItemFuture] = []
+        try:
+            futurelist = self._submit(items, ts_start, lambda: AsyncItemFuture(loop, cancellation_token), prepare)
+            if futurelist:
+                _, pending = await asyncio.wait([future.aio_future for future in futurelist], timeout=timeout)
+            else:
+                pending = set()
+            if pending:
+                for future in futurelist:
+                    if future.aio_future in pending:
+                        future.set_cancelled()
+                with self._admission_lock:
+                    self._counters['timeouts'] += len(pending)
+                if raise_timeout:
+                    raise PredictTimeoutError('predict timeout')
+
+            rs = []
+            error = None
+            for future in futurelist:
+                aio_future = future.aio_future
+                if aio_future in pending:
+                    rs.append(None)
+                elif aio_future.cancelled():
+                    error = error or PredictCancelledError('predict cancelled')
+                elif aio_future.exception() is not None:
+                    # every exception is retrieved, the first one is raised
+                    error = error or aio_future.exception()
+                else:
+                    rs.append(aio_future.result())
+            if error is not None:
+                raise error
+
+            rlog.event(f'{EVENT_KEY_PREFIX}_PredictDuration', 'success', time.perf_counter() - ts_start,
+                       corr_id=req_corr.CorrelationId, elem=req_corr.Element)
+            return rs
+
+        except asyncio.CancelledError:
+            for future in futurelist:
+                future.set_cancelled()
+            raise
+
+        except Exception as ex:
+            rlog.event(f'{EVENT_KEY_PREFIX}_PredictDuration', 'error', time.perf_counter() - ts_start,
+                       corr_id=req_corr.CorrelationId, elem=req_corr.Element)
+            rlog.errorcf(req_corr.CorrelationId, req_corr.Element, ex, f'{EVENT_KEY_PREFIX}: error in predict')
+            raise
+
+
+class SharedBatchScheduler:
+    """
+    Worker threads shared by the dynamic batch models of several models, so that idle models cost no thread.
+    The models are served round robin, one batch at a time, and a model runs at most one batch at a time, so a busy
+    model does not starve the others.
+    """
+
+    def __init__(self, workers: int = 1) -> None:
+        if workers <= 0:
+            raise ValueError(f"The number of batch workers should be positive. Current value: {workers}")
+        self.alive = True
+        self._condition = Condition()
+        self._models: List[MopDynamicBatchModel] = []
+        self._busy: Set[int] = set()
+        self._next = 0
+        self.workers = [Thread(target=self._worker_run, daemon=True, name=f'mop-batch-scheduler-{i}')
+                        for i in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def add(self, model: MopDynamicBatchModel) -> None:
+        with self._condition:
+            self._models.append(model)
+            self._condition.notify_all()
+
+    def remove(self, model: MopDynamicBatchModel) -> None:
+        with self._condition:
+            if model in self._models:
+                self._models.remove(model)
+
+    def notify(self) -> None:
+        """
+        Wake a worker up: new items were queued.
+        """
+        with self._condition:
+            self._condition.notify()
+
+    def close(self) -> None:
+        with self._condition:
+            self.alive = False
+            self._condition.notify_all()
+
+    def _next_batch(self) -> Tuple[Optional[MopDynamicBatchModel], Optional[List[ItemMessage]], Optional[float]]:
+        """
+        The next ready batch, starting from the model after the last served one. Called with the condition held.
+        """
+        now = time.perf_counter()
+        deadline = None
+        count = len(self._models)
+        for offset in range(count):
+            index = (self._next + offset) % count
+            model = self._models[index]
+            if id(model) in self._busy or not model.alive:
+                continue
+            batch, model_deadline = model.take_batch(now)
+            if batch:
+                self._next = index + 1
+                self._busy.add(id(model))
+                return model, batch, None
+            if model_deadline is not None:
+                deadline = model_deadline if deadline is None else min(deadline, model_deadline)
+        return None, None, deadline
+
+    def _worker_run(self) -> None:
+        while self.alive:
+            with self._condition:
+                model, batch, deadline = self._next_batch()
+                if model is None:
+                    self._condition.wait(None if deadline is None else max(deadline - time.perf_counter(), 0))
+                    continue
+            try:
+                model._worker_run_batch(batch)
+            except Exception as e:
+                # unexpected error: the batch fails, the worker goes on
+                traceback.print_exc()
+                for msg in batch:
+                    msg.future.set_excepted(e)
+            finally:
+                with self._condition:
+                    self._busy.discard(id(model))
+                    self._condition.notify_all()
@@ -0,0 +1,217 @@
+"""
+Micro-benchmarks of the per-request overhead of mop_utils around the model, with a no-op model wrapper.
+
+    python -m mop_utils.benchmark --output baseline.json
+    python -m mop_utils.benchmark --compare baseline.json
+
+Every stage of a request is timed separately, for text, image and image+text payloads:
+    from_dict           MopInferenceInput().from_dict() of the request dict
+    convert_input       convert_mop_input_to_model_input() of the wrapper
+    output              MopInferenceOutput construction and validation, 4 taxonomies of 4 labels
+    build_response      to_native() of the MOP output, as build_response() of inference_wrapper does
+    build_response_bytes  dumps() of the MOP output, as build_response_bytes() of inference_wrapper does
+    batch_round_trip    a single item request through the queue and worker thread of the dynamic batch model
+
+The results are saved as JSON. With --compare, the best time per call of every stage is compared to a saved
+baseline, and the exit code is 1 if any stage is slower than the threshold allows.
+"""
+import argparse
+import base64
+import json
+import platform
+import random
+import sys
+import timeit
+from typing import Any, Callable, Dict, List, Optional
+
+from pyraisdk.dynbatch import BaseModel
+
+from . import __version__
+from .base_model_wrapper import BaseModelWrapper, MopInferenceInput, MopInferenceOutput
+from .batching import BatchConfig, MopDynamicBatchModel
+from .serialization import dumps, to_native
+from .warmup import SAMPLE_PNG_BASE64
+
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.2
+
+_SAMPLE_TEXT = ("The white man has no future in Canada , that is for sure , because the country is being flooded "
+                "with non-white immigrants .")
+_TAXONOMIES = ('hate', 'sexual', 'violence', 'self_harm')
+_LABELS = ('severity_0', 'severity_2', 'severity_4', 'severity_6')
+
+
+def _image_base64(size: int) -> str:
+    """
+    A base64 image payload of about size bytes once decoded: a PNG header followed by random bytes.
+    """
+    header = base64.b64decode(SAMPLE_PNG_BASE64)[:33]
+    body = random.Random(size).getrandbits(8 * max(size - len(header), 0)).to_bytes(max(size - len(header), 0),
+                                                                                     'little')
+    return base64.b64encode(header + body).decode()
+
+
+def build_payloads() -> Dict[str, Dict]:
+    """
+    The request dicts of the benchmark scenarios, sized after the sample models and datasets.
+    """
+    image_large = _image_base64(225 * 1024)
+    return {
+        'text': {'text': _SAMPLE_TEXT},
+        'text_long': {'text': ' '.join([_SAMPLE_TEXT] * 40)},
+        'image_small': {'image': SAMPLE_PNG_BASE64, 'width': 23, 'height': 13},
+        'image_large': {'image': image_large, 'width': 596, 'height': 612},
+        'image_text': {'text': f"{_SAMPLE_TEXT} ##{{image_0}} ##{{image_1}}",
+                       'images': [_image_base64(68 * 1024), _image_base64(68 * 1024)]},
+    }
+
+
+def _raw_output(score: float = 0.4) -> Dict:
+    predicted_label = {label: int(i % 2 == 0) for i, label in enumerate(_LABELS)}
+    confidence_score = {label: score if i % 2 == 0 else 1 - score for i, label in enumerate(_LABELS)}
+    return {'predicted_labels': {taxonomy: dict(predicted_label) for taxonomy in _TAXONOMIES},
+            'confidence_scores': {taxonomy: dict(confidence_score) for taxonomy in _TAXONOMIES}}
+
+
+class NoopModelWrapper(BaseModelWrapper):
+    """
+    A model wrapper that does no work, so only the overhead of mop_utils is measured.
+    """
+
+    def init(self, model_root: str, **kwargs):
+        pass
+
+    def inference(self, item: Dict, **kwargs) -> Dict:
+        return item
+
+    def inference_batch(self, items: List[Dict], **kwargs) -> List[Dict]:
+        return items
+
+    def convert_mop_input_to_model_input(self, mop_input: MopInferenceInput, **kwargs) -> Dict:
+        return {'text': mop_input.text, 'image': mop_input.image, 'images': mop_input.images}
+
+    def convert_model_output_to_mop_output(self, customized_output: Dict, **kwargs) -> MopInferenceOutput:
+        return MopInferenceOutput(_raw_output())
+
+
+class _NoopModel(BaseModel):
+    def predict(self, items: List[Any]) -> List[Any]:
+        return items
+
+
+def _time(func: Callable[[], Any], repeat: int) -> Dict:
+    timer = timeit.Timer(func)
+    loops, _ = timer.autorange()
+    times = sorted(t / loops * 1e6 for t in timer.repeat(repeat, loops))
+    return {'best_us': times[0], 'median_us': times[len(times) // 2], 'loops': loops}
+
+
+def run_benchmarks(scenarios: Optional[List[str]] = None, repeat: int = DEFAULT_REPEAT) -> Dict:
+    """
+    Run the stages of every scenario.
+    @param scenarios: Names of the scenarios to run, all if None
+    @type scenarios: List[str]
+    @param repeat: Number of timed repetitions of each stage
+    @type repeat: int
+    @return: Benchmark results, {'meta': {...}, 'results': {scenario: {stage: timings}}}
+    @rtype: Dict
+    """
+    payloads = build_payloads()
+    if scenarios is not None:
+        unknown = set(scenarios) - set(payloads)
+        if unknown:
+            raise ValueError(f"Unknown scenarios {sorted(unknown)}. Available: {sorted(payloads)}")
+        payloads = {name: payloads[name] for name in scenarios}
+
+    wrapper = NoopModelWrapper()
+    batch_model = MopDynamicBatchModel(_NoopModel(), BatchConfig(max_batch_size=1, idle_batch_size=1,
+                                                                 max_batch_interval=0.001))
+    raw_output = _raw_output()
+    mop_output = MopInferenceOutput(raw_output).output
+    results = {}
+    try:
+        for name, payload in payloads.items():
+            mop_input = MopInferenceInput().from_dict(payload)
+            stages = {
+                'from_dict': lambda: MopInferenceInput().from_dict(payload),
+                'convert_input': lambda: wrapper.convert_mop_input_to_model_input(mop_input),
+                'output': lambda: MopInferenceOutput(raw_output),
+                'build_response': lambda: to_native(mop_output),
+                'build_response_bytes': lambda: dumps(mop_output),
+                'batch_round_trip': lambda: batch_model.predict([payload]),
+            }
+            results[name] = {stage: _time(func, repeat) for stage, func in stages.items()}
+    finally:
+        batch_model.close()
+
+    return {
+        'meta': {
+            'mop_utils': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(results: Dict, baseline: Dict, threshold: float = DEFAULT_THRESHOLD) -> List[Dict]:
+    """
+    Compare the best time per call of every stage to a baseline.
+    @param results: Results of run_benchmarks()
+    @type results: Dict
+    @param baseline: Saved results of run_benchmarks()
+    @type baseline: Dict
+    @param threshold: Relative slowdown above which a stage is a regression, e.g. 0.2 for 20%
+    @type threshold: float
+    @return: One row per stage found in both: scenario, stage, baseline_us, current_us, ratio and regression
+    @rtype: List[Dict]
+    """
+    rows = []
+    for scenario, stages in results['results'].items():
+        for stage, timing in stages.items():
+            base_timing = baseline['results'].get(scenario, {}).get(stage)
+            if base_timing is None:
+                continue
+            ratio = timing['best_us'] / base_timing['best_us'] if base_timing['best_us'] else float('inf')
+            rows.append({'scenario': scenario, 'stage': stage, 'baseline_us': base_timing['best_us'],
+                         'current_us': timing['best_us'], 'ratio': ratio, 'regression': ratio > 1 + threshold})
+    return rows
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the per-request overhead of mop_utils.")
+    parser.add_argument('--scenarios', help="Comma separated scenarios, e.g. text,image_large. All by default")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="Timed repetitions of each stage")
+    parser.add_argument('--output', help="Save the results as JSON, e.g. as a baseline")
+    parser.add_argument('--compare', help="Baseline JSON to compare the results to")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="Relative slowdown that counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.scenarios.split(',') if args.scenarios else None, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if not args.compare:
+        print(f"{'scenario':<12} {'stage':<22} {'best_us':>10} {'median_us':>10}")
+        for scenario, stages in results['results'].items():
+            for stage, timing in stages.items():
+                print(f"{scenario:<12} {stage:<22} {timing['best_us']:>10.2f} {timing['median_us']:>10.2f}")
+        return
+
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    rows = compare(results, baseline, args.threshold)
+    print(f"{'scenario':<12} {'stage':<22} {'baseline_us':>12} {'current_us':>12} {'ratio':>7}")
+    for row in rows:
+        flag = '  REGRESSION' if row['regression'] else ''
+        print(f"{row['scenario']:<12} {row['stage']:<22} {row['baseline_us']:>12.2f} {row['current_us']:>12.2f} "
+              f"{row['ratio']:>7.2f}{flag}")
+    if any(row['regression'] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
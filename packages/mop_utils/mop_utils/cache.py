@@ -0,0 +1,246 @@
+"""
+Content-addressed cache of inference results.
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Hashable, List, Optional
+
+from .base_model_wrapper import MopInferenceInput
+from .serialization import dumps, to_native
+
+MISSING = object()
+
+
+def _encode(value: Any, out: List[bytes]) -> None:
+    """
+    Append the canonical encoding of a JSON-like value: every value is tagged with its type, and strings and
+    containers with their length, so that different values, e.g. None and 'None', 1 and True or 5 and '5', never
+    share an encoding.
+    """
+    if value is None:
+        out.append(b'N')
+    elif value is True:
+        out.append(b'T')
+    elif value is False:
+        out.append(b'F')
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        out.append(b's%d:' % len(data))
+        out.append(data)
+    elif isinstance(value, int):
+        out.append(b'i%d;' % value)
+    elif isinstance(value, float):
+        out.append(b'f' + repr(value).encode('ascii') + b';')
+    elif isinstance(value, (bytes, bytearray)):
+        out.append(b'b%d:' % len(value))
+        out.append(bytes(value))
+    elif isinstance(value, (list, tuple)):
+        out.append(b'l%d:' % len(value))
+        for element in value:
+            _encode(element, out)
+    elif isinstance(value, dict):
+        entries = []
+        for key, element in value.items():
+            key_parts = []
+            _encode(key, key_parts)
+            entries.append((b''.join(key_parts), element))
+        entries.sort(key=lambda entry: entry[0])
+        out.append(b'd%d:' % len(entries))
+        for key_data, element in entries:
+            out.append(key_data)
+            _encode(element, out)
+    else:
+        raise TypeError(f"Cannot encode a {type(value).__name__} in a cache key")
+
+
+def canonical_bytes(value: Any) -> bytes:
+    """
+    Canonical, type-tagged encoding of a JSON-like value. Raises TypeError for other values.
+    """
+    out: List[bytes] = []
+    _encode(value, out)
+    return b''.join(out)
+
+
+def _hash_parts(parts: tuple) -> bytes:
+    return hashlib.blake2b(canonical_bytes(parts), digest_size=16).digest()
+
+
+def _mop_input_fields(item: Any) -> tuple:
+    if isinstance(item, MopInferenceInput):
+        return item.text, item.image, item.width, item.height, item.images
+    return item.get('text'), item.get('image'), item.get('width'), item.get('height'), item.get('images')
+
+
+def input_key(item: Any, triggered_by_mop: bool) -> Optional[bytes]:
+    """
+    Hash a request item. A MOP-triggered item is normalized to the MopInferenceInput fields first, so that
+    unrelated keys do not change its key; a raw item is hashed from its canonical encoding.
+    @return: The key, or None if the item cannot be hashed
+    @rtype: bytes
+    """
+    try:
+        if triggered_by_mop and isinstance(item, (dict, MopInferenceInput)):
+            text, image, width, height, images = _mop_input_fields(item)
+            return _hash_parts(('mop', text, image, width, height, list(images or ())))
+        if not isinstance(item, dict):
+            return None
+        return _hash_parts(('raw', item))
+    except TypeError:
+        return None
+
+
+def dedup_key(item: Any, triggered_by_mop: bool) -> Optional[Hashable]:
+    """
+    Cheap in-process identity key of a request item, used to collapse identical items of a batch.
+    Unlike input_key(), it relies on Python's cached str hashes instead of a digest. Equal keys are not enough to
+    collapse two items, since 1, True and 1.0 are equal keys: same_item() tells whether they are identical.
+    The key is not hashed here, so it may be unhashable, e.g. a raw item with nested values: see nested_dedup_key().
+    @return: The key, or None if the item cannot be keyed
+    @rtype: Hashable
+    """
+    if item.__class__ is dict:
+        if triggered_by_mop:
+            images = item.get('images')
+            return (item.get('text'), item.get('image'), item.get('width'), item.get('height'),
+                    tuple(images) if images else None)
+        # the keys keep their order: the same request sent with its keys in another order is not collapsed
+        return tuple(item.items())
+    if triggered_by_mop and isinstance(item, MopInferenceInput):
+        images = item.images
+        return item.text, item.image, item.width, item.height, tuple(images) if images else None
+    if isinstance(item, dict):
+        return dedup_key(dict(item), triggered_by_mop)
+    return None
+
+
+def nested_dedup_key(item: Any) -> Optional[bytes]:
+    """
+    Key of an item whose dedup_key() is unhashable: its canonical encoding, or None if it cannot be encoded.
+    """
+    try:
+        return canonical_bytes(to_native(item))
+    except TypeError:
+        return None
+
+
+def _identical(a: Any, b: Any) -> bool:
+    if a.__class__ is not b.__class__:
+        return False
+    if a.__class__ is dict:
+        return len(a) == len(b) and all(key in b and _identical(value, b[key]) for key, value in a.items())
+    if a.__class__ is list or a.__class__ is tuple:
+        return len(a) == len(b) and all(_identical(x, y) for x, y in zip(a, b))
+    try:
+        return bool(a == b)
+    except (TypeError, ValueError):
+        # e.g. arrays, whose == is element-wise
+        return False
+
+
+def same_item(a: Any, b: Any, triggered_by_mop: bool) -> bool:
+    """
+    Whether two items with the same dedup_key() are identical, their values having the same types too.
+    """
+    if triggered_by_mop and isinstance(a, (dict, MopInferenceInput)) and isinstance(b, (dict, MopInferenceInput)):
+        return _identical(_mop_input_fields(a), _mop_input_fields(b))
+    return _identical(a, b)
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache of inference results, bounded by entry count and by the JSON size of the results,
+    with an optional TTL in seconds. Results are stored as a native copy and every hit returns a copy of its own.
+
+    It is enabled in settings.yml:
+    result_cache:
+      enable: true
+      max_entries: 10000
+      max_bytes: 67108864
+      ttl: 600
+    """
+    # the monotonic counters of stats()
+    COUNTERS = ('hits', 'misses', 'evictions', 'expirations')
+
+    def __init__(self, max_entries: int = 10000, max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None) -> None:
+        if max_entries <= 0:
+            raise ValueError(f"The max entries of the result cache should be positive. Current value: {max_entries}")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+        self._counters = dict.fromkeys(self.COUNTERS, 0)
+
+    @classmethod
+    def from_settings(cls, settings: Dict) -> Optional['ResultCache']:
+        """
+        Build the cache from the 'result_cache' section of settings.yml.
+        @return: None if the cache is not enabled
+        """
+        cache_settings = settings.get('result_cache') or {}
+        if not cache_settings.get('enable', False):
+            return None
+        return cls(max_entries=cache_settings.get('max_entries', 10000),
+                   max_bytes=cache_settings.get('max_bytes'),
+                   ttl=cache_settings.get('ttl'))
+
+    def get(self, key: Optional[bytes]) -> Any:
+        """
+        @return: The cached result, or MISSING
+        """
+        if key is None:
+            return MISSING
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters['misses'] += 1
+                return MISSING
+            result, size, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self._counters['expirations'] += 1
+                self._counters['misses'] += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+        # every hit gets its own copy, so that a caller mutating its response does not change the cached result
+        return to_native(result)
+
+    def put(self, key: Optional[bytes], result: Any) -> None:
+        if key is None:
+            return
+        # to_native() copies the result, so the caller keeps its own
+        result = to_native(result)
+        size = 0
+        if self.max_bytes is not None:
+            size = len(dumps(result))
+            if size > self.max_bytes:
+                return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, size, expires_at)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or \
+                    (self.max_bytes is not None and self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self._counters['evictions'] += 1
+
+    def _remove(self, key: bytes) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, **self._counters}
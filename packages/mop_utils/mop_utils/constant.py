@@ -1,2 +1,11 @@
 CM_MODEL_WRAPPER_NAME = "inference"
+DEFAULT_MODEL_NAME = "default"
 
+SETTINGS_FILE_NAME = "settings.yml"
+
+RUN_MODE_RAW = "raw"
+RUN_MODE_MOP = "mop"
+RUN_MODE_ACS_TEXT = "acs_text"
+RUN_MODE_ACS_IMAGE = "acs_image"
+
+ARTIFACT_CACHE_DIR_ENV = "MOP_ARTIFACT_CACHE_DIR"
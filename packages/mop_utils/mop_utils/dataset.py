@@ -0,0 +1,115 @@
+"""
+Reading MOP evaluation datasets, the tab delimited files described in doc/DatasetContributorGuide.md.
+"""
+import csv
+import json
+import sys
+from typing import Dict, Iterator, List, Optional, Sequence
+
+COLUMN_TEXT = "text"
+COLUMN_BASE64_IMAGE = "base64_image"
+COLUMN_FILE_NAME = "file_name"
+COLUMN_IMAGE_WIDTH = "image_width_pixels"
+COLUMN_IMAGE_HEIGHT = "image_height_pixels"
+IMAGE_COLUMN_PREFIX = "image_"
+MAX_IMAGE_COLUMNS = 20
+
+IMAGE_COLUMNS = tuple(f"{IMAGE_COLUMN_PREFIX}{i}" for i in range(MAX_IMAGE_COLUMNS))
+DATA_COLUMNS = frozenset((COLUMN_TEXT, COLUMN_BASE64_IMAGE, COLUMN_FILE_NAME, COLUMN_IMAGE_WIDTH,
+                          COLUMN_IMAGE_HEIGHT) + IMAGE_COLUMNS)
+# the columns a MOP input is made of
+INPUT_COLUMNS = frozenset((COLUMN_TEXT, COLUMN_BASE64_IMAGE) + IMAGE_COLUMNS)
+
+DEFAULT_DELIMITER = "\t"
+
+
+def _raise_field_size_limit() -> None:
+    # base64 images are far larger than the default field size limit of 128KB
+    limit = sys.maxsize
+    while True:
+        try:
+            csv.field_size_limit(limit)
+            return
+        except OverflowError:
+            limit //= 2
+
+
+def read_dataset(path: str, delimiter: str = DEFAULT_DELIMITER) -> Iterator[Dict[str, str]]:
+    """
+    Stream the rows of a dataset file as dicts keyed by column name.
+    @param path: Path of the dataset file
+    @type path: str
+    @param delimiter: Column delimiter, tab by default
+    @type delimiter: str
+    @return: Iterator of the rows
+    @rtype: Iterator[Dict[str, str]]
+    """
+    _raise_field_size_limit()
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f, delimiter=delimiter):
+            yield row
+
+
+def read_records(path: str, delimiter: str = DEFAULT_DELIMITER) -> Iterator[Dict]:
+    """
+    Stream the rows of a dataset file: a JSON object per line if path ends with .jsonl, delimited columns otherwise.
+    JSONL rows use the same column names as the delimited files.
+    """
+    if not path.lower().endswith('.jsonl'):
+        yield from read_dataset(path, delimiter)
+        return
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def label_columns(columns: Sequence[str]) -> List[str]:
+    """
+    The label columns of a dataset, i.e. all the columns that are not data columns.
+    """
+    return [column for column in columns if column not in DATA_COLUMNS]
+
+
+def _optional_int(value: Optional[str]) -> Optional[int]:
+    return int(value) if value not in (None, '') else None
+
+
+def check_data_columns(columns: Sequence[str], path: Optional[str] = None) -> None:
+    """
+    Raise ValueError if none of the columns is a text, base64_image or image_N column: the dataset cannot be mapped
+    to MOP inputs, usually because the file is not delimited by the expected delimiter.
+    """
+    if not any(column in INPUT_COLUMNS for column in columns):
+        source = f"The dataset {path}" if path else "The dataset"
+        raise ValueError(f"{source} has no {COLUMN_TEXT}, {COLUMN_BASE64_IMAGE} or {IMAGE_COLUMN_PREFIX}N column. "
+                         f"Columns: {list(columns)[:10]}. Check the column delimiter: MOP datasets are tab "
+                         f"delimited.")
+
+
+def row_to_mop_input(row: Dict[str, str]) -> Dict:
+    """
+    Map a dataset row to a MOP input dict, the request format of mop_run() and MopInferenceInput.create():
+    text to 'text', base64_image to 'image', image_width_pixels and image_height_pixels to 'width' and 'height',
+    and image_0 to image_19 to 'images'.
+    @param row: Dataset row
+    @type row: Dict[str, str]
+    @return: MOP input dict
+    @rtype: Dict
+    @raise ValueError: If the row has no text, base64_image or image_N column
+    """
+    mop_input = {}
+    if row.get(COLUMN_TEXT) is not None:
+        mop_input['text'] = row[COLUMN_TEXT]
+    if row.get(COLUMN_BASE64_IMAGE):
+        mop_input['image'] = row[COLUMN_BASE64_IMAGE]
+        mop_input['width'] = _optional_int(row.get(COLUMN_IMAGE_WIDTH))
+        mop_input['height'] = _optional_int(row.get(COLUMN_IMAGE_HEIGHT))
+    images = [row.get(column) or None for column in IMAGE_COLUMNS if column in row]
+    while images and images[-1] is None:
+        images.pop()
+    if images:
+        mop_input['images'] = images
+    if not mop_input:
+        check_data_columns(list(row))
+    return mop_input
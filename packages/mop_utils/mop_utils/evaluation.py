@@ -0,0 +1,338 @@
+"""
+Local evaluation of scored outputs against a labeled dataset, with the metrics of MOP.
+
+    python -m mop_utils.evaluation --dataset ./dataset.csv --predictions scores.jsonl --label-column hate \\
+        --label-type ordinal --curves --report evaluation.json
+
+The predictions are the output of mop_utils.score: a JSONL file or a directory of Parquet files.
+
+Categorical tasks: the dataset labels are label names of the task (a binary 0/1 dataset maps to the 2 labels of the
+task in order), and the predicted label is the one whose predicted_labels value is 1. The report has the precision,
+recall, F1 and support of every label of the dataset, the accuracy, and the macro, micro and weighted averages.
+
+Ordinal tasks: the dataset is binary, and the N labels of the task are split into the N-1 cumulative partitions
+labels[:k] vs labels[k:]. A sample is predicted positive for partition k if predicted_labels of labels[k] is 1, and
+its score is the cumulative confidence score of labels[k]. Every partition is reported, and the best is the one with
+the highest F1 score.
+
+All metrics are computed with NumPy over the whole dataset.
+"""
+import argparse
+import glob
+import json
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .dataset import DEFAULT_DELIMITER, read_dataset
+from .util import LABEL_TYPE_CATEGORICAL, LABEL_TYPE_ORDINAL
+
+DEFAULT_THRESHOLD_COUNT = 101
+DEFAULT_MAX_CURVE_POINTS = 1000
+
+
+def _safe_divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    return np.divide(numerator, denominator, out=np.zeros(np.broadcast(numerator, denominator).shape),
+                     where=denominator != 0)
+
+
+def _f1(precision: np.ndarray, recall: np.ndarray) -> np.ndarray:
+    return _safe_divide(2 * precision * recall, precision + recall)
+
+
+def classification_report(y_true: np.ndarray, y_pred: np.ndarray, labels: Sequence[str]) -> Dict:
+    """
+    Precision, recall, F1 and support of every label, accuracy, macro, micro and weighted averages, and the
+    confusion matrix of single label predictions. The averages cover the labels that occur in y_true.
+    @param y_true: True label index of every sample
+    @type y_true: np.ndarray
+    @param y_pred: Predicted label index of every sample
+    @type y_pred: np.ndarray
+    @param labels: Label names, by index
+    @type labels: Sequence[str]
+    @return: Classification report
+    @rtype: Dict
+    """
+    n_labels = len(labels)
+    confusion = np.bincount(y_true * n_labels + y_pred, minlength=n_labels * n_labels).reshape(n_labels, n_labels)
+    tp = np.diag(confusion)
+    support = confusion.sum(axis=1)
+    predicted = confusion.sum(axis=0)
+    precision = _safe_divide(tp, predicted)
+    recall = _safe_divide(tp, support)
+    f1 = _f1(precision, recall)
+
+    present = support > 0
+    total = support.sum()
+    micro_precision = _safe_divide(tp[present].sum(), predicted[present].sum())
+    micro_recall = _safe_divide(tp[present].sum(), support[present].sum())
+    weights = _safe_divide(support[present], total)
+    return {
+        'labels': {label: {'precision': float(precision[i]), 'recall': float(recall[i]), 'f1': float(f1[i]),
+                           'support': int(support[i])}
+                   for i, label in enumerate(labels) if present[i]},
+        'accuracy': float(_safe_divide(tp.sum(), total)),
+        'macro': {'precision': float(precision[present].mean()) if present.any() else 0.0,
+                  'recall': float(recall[present].mean()) if present.any() else 0.0,
+                  'f1': float(f1[present].mean()) if present.any() else 0.0},
+        'micro': {'precision': float(micro_precision), 'recall': float(micro_recall),
+                  'f1': float(_f1(micro_precision, micro_recall))},
+        'weighted': {'precision': float((precision[present] * weights).sum()),
+                     'recall': float((recall[present] * weights).sum()),
+                     'f1': float((f1[present] * weights).sum())},
+        'support': int(total),
+        'confusion_matrix': {'labels': list(labels), 'matrix': confusion.tolist()},
+    }
+
+
+def threshold_sweep(y_true: np.ndarray, scores: np.ndarray, thresholds: Optional[np.ndarray] = None) -> Dict:
+    """
+    Precision, recall and F1 of the positive class when samples with score >= threshold are predicted positive,
+    for every threshold.
+    @param y_true: Whether every sample is positive
+    @type y_true: np.ndarray
+    @param scores: Positive score of every sample
+    @type scores: np.ndarray
+    @param thresholds: Thresholds, 0 to 1 by 0.01 by default
+    @type thresholds: np.ndarray
+    @return: thresholds, precision, recall and f1 lists, and the threshold with the best F1
+    @rtype: Dict
+    """
+    if thresholds is None:
+        thresholds = np.linspace(0, 1, DEFAULT_THRESHOLD_COUNT)
+    order = np.argsort(scores, kind='stable')
+    sorted_scores = scores[order]
+    # positives among the samples of the lowest scores, for any count of them
+    true_below = np.concatenate(([0], np.cumsum(y_true[order])))
+    n = len(scores)
+    below = np.searchsorted(sorted_scores, thresholds, side='left')
+    predicted_positive = n - below
+    tp = true_below[-1] - true_below[below]
+    precision = _safe_divide(tp, predicted_positive)
+    recall = _safe_divide(tp, true_below[-1])
+    f1 = _f1(precision, recall)
+    best = int(np.argmax(f1))
+    return {
+        'thresholds': thresholds.tolist(),
+        'precision': precision.tolist(),
+        'recall': recall.tolist(),
+        'f1': f1.tolist(),
+        'best': {'threshold': float(thresholds[best]), 'precision': float(precision[best]),
+                 'recall': float(recall[best]), 'f1': float(f1[best])},
+    }
+
+
+def precision_recall_curve(y_true: np.ndarray, scores: np.ndarray,
+                           max_points: Optional[int] = DEFAULT_MAX_CURVE_POINTS) -> Dict:
+    """
+    Precision and recall at every distinct score used as a threshold, and the average precision.
+    @param y_true: Whether every sample is positive
+    @type y_true: np.ndarray
+    @param scores: Positive score of every sample
+    @type scores: np.ndarray
+    @param max_points: Points of the returned curve, evenly picked among the thresholds. All of them if None. The
+    average precision is computed on all the thresholds anyway
+    @type max_points: int
+    @return: thresholds, precision and recall lists in decreasing threshold order, and average_precision
+    @rtype: Dict
+    """
+    order = np.argsort(-scores, kind='stable')
+    sorted_scores = scores[order]
+    tps_all = np.cumsum(y_true[order])
+    # the last sample of every run of equal scores
+    last = np.concatenate((np.flatnonzero(np.diff(sorted_scores)), [len(scores) - 1])) if len(scores) else \
+        np.array([], dtype=np.int64)
+    tps = tps_all[last]
+    fps = last + 1 - tps
+    precision = _safe_divide(tps, tps + fps)
+    recall = _safe_divide(tps, tps_all[-1] if len(scores) else 0)
+    average_precision = float(np.sum(np.diff(np.concatenate(([0.0], recall))) * precision))
+    if max_points is not None and len(last) > max_points:
+        points = np.unique(np.linspace(0, len(last) - 1, max_points).round().astype(np.int64))
+        last, precision, recall = last[points], precision[points], recall[points]
+    return {
+        'thresholds': sorted_scores[last].tolist(),
+        'precision': precision.tolist(),
+        'recall': recall.tolist(),
+        'average_precision': average_precision,
+    }
+
+
+def _binary_report(y_true: np.ndarray, y_pred: np.ndarray, scores: np.ndarray, thresholds: Optional[np.ndarray],
+                   curves: bool) -> Dict:
+    report = classification_report(y_true.astype(np.int64), y_pred.astype(np.int64), ('0', '1'))
+    positive = report['labels'].get('1', {'precision': 0.0, 'recall': 0.0, 'f1': 0.0, 'support': 0})
+    report.update({'precision': positive['precision'], 'recall': positive['recall'], 'f1': positive['f1']})
+    if curves:
+        report['threshold_sweep'] = threshold_sweep(y_true, scores, thresholds)
+        report['pr_curve'] = precision_recall_curve(y_true, scores)
+    return report
+
+
+def _label_indexes(y_true: np.ndarray, labels: Sequence[str]) -> np.ndarray:
+    values, inverse = np.unique(y_true, return_inverse=True)
+    label_index = {label: i for i, label in enumerate(labels)}
+    if len(labels) == 2 and set(values) <= {'0', '1'} and not set(labels) >= set(values):
+        # a binary dataset of a 2 label categorical task: 0 and 1 are its labels in order
+        label_index = {'0': 0, '1': 1}
+    unknown = [value for value in values if value not in label_index]
+    if unknown:
+        raise ValueError(f"The dataset labels {unknown} are not labels of the task. Task labels: {list(labels)}")
+    return np.array([label_index[value] for value in values], dtype=np.int64)[inverse]
+
+
+def evaluate(y_true: Sequence, predicted_labels: np.ndarray, confidence_scores: np.ndarray, labels: Sequence[str],
+             label_type: str = LABEL_TYPE_CATEGORICAL, thresholds: Optional[np.ndarray] = None,
+             curves: bool = False) -> Dict:
+    """
+    Evaluate the outputs of one taxonomy against the dataset labels.
+    @param y_true: Dataset label of every sample, a label name or 0/1
+    @type y_true: Sequence
+    @param predicted_labels: predicted_labels of every sample, shape (samples, labels)
+    @type predicted_labels: np.ndarray
+    @param confidence_scores: confidence_scores of every sample, shape (samples, labels)
+    @type confidence_scores: np.ndarray
+    @param labels: Label names of the taxonomy, in the order of the task, ascending for ordinal tasks
+    @type labels: Sequence[str]
+    @param label_type: 'categorical' or 'ordinal'
+    @type label_type: str
+    @param thresholds: Thresholds of the threshold sweeps
+    @type thresholds: np.ndarray
+    @param curves: Whether to add threshold sweeps and PR curves
+    @type curves: bool
+    @return: Evaluation report
+    @rtype: Dict
+    """
+    y_true = np.asarray(y_true).astype(str)
+    predicted_labels = np.asarray(predicted_labels)
+    confidence_scores = np.asarray(confidence_scores, dtype=np.float64)
+    if predicted_labels.shape != (len(y_true), len(labels)) or confidence_scores.shape != predicted_labels.shape:
+        raise ValueError(f"Expected outputs of shape {(len(y_true), len(labels))}. Current shapes: "
+                         f"{predicted_labels.shape} and {confidence_scores.shape}")
+
+    if label_type == LABEL_TYPE_CATEGORICAL:
+        true_indexes = _label_indexes(y_true, labels)
+        report = {'label_type': label_type,
+                  **classification_report(true_indexes, np.argmax(predicted_labels, axis=1), labels)}
+        if curves:
+            report['curves'] = {}
+            for i, label in enumerate(labels):
+                positive = true_indexes == i
+                if positive.any():
+                    report['curves'][label] = {
+                        'threshold_sweep': threshold_sweep(positive, confidence_scores[:, i], thresholds),
+                        'pr_curve': precision_recall_curve(positive, confidence_scores[:, i]),
+                    }
+        return report
+
+    if label_type == LABEL_TYPE_ORDINAL:
+        if not set(np.unique(y_true)) <= {'0', '1'}:
+            raise ValueError("An ordinal task is evaluated on a binary dataset of 0 and 1 labels")
+        positive = y_true == '1'
+        partitions = []
+        for k in range(1, len(labels)):
+            partitions.append({
+                'negative': list(labels[:k]),
+                'positive': list(labels[k:]),
+                **_binary_report(positive, predicted_labels[:, k] == 1, confidence_scores[:, k], thresholds, curves),
+            })
+        best = max(range(len(partitions)), key=lambda i: partitions[i]['f1']) if partitions else None
+        return {'label_type': label_type, 'best_partition': best, 'partitions': partitions}
+
+    raise ValueError(f"The label type should be {LABEL_TYPE_CATEGORICAL} or {LABEL_TYPE_ORDINAL}. "
+                     f"Current value: {label_type}")
+
+
+def load_predictions(path: str, taxonomy: str,
+                     labels: Optional[Sequence[str]] = None) -> Tuple[np.ndarray, List[str], np.ndarray, np.ndarray]:
+    """
+    Load the outputs of one taxonomy from the results of mop_utils.score, skipping the failed rows.
+    @param path: JSONL file, or directory of Parquet files
+    @type path: str
+    @param taxonomy: Taxonomy name, e.g. hate
+    @type taxonomy: str
+    @param labels: Label names in task order, the order of the outputs by default
+    @type labels: Sequence[str]
+    @return: Dataset row of every output, label names, predicted_labels and confidence_scores arrays
+    @rtype: Tuple[np.ndarray, List[str], np.ndarray, np.ndarray]
+    """
+    if os.path.isdir(path):
+        try:
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError("pyarrow is required to read Parquet: pip install mop_utils[parquet]") from e
+        table = pyarrow.parquet.read_table(sorted(glob.glob(os.path.join(path, 'part-*.parquet'))))
+        prefix = f"output.predicted_labels.{taxonomy}."
+        if labels is None:
+            labels = [name[len(prefix):] for name in table.column_names if name.startswith(prefix)]
+        if 'error' in table.column_names:
+            table = table.filter(table.column('error').is_null())
+        rows = table.column('row').to_numpy()
+        predicted = np.column_stack([table.column(f"{prefix}{label}").to_numpy() for label in labels])
+        scores = np.column_stack([table.column(f"output.confidence_scores.{taxonomy}.{label}").to_numpy()
+                                  for label in labels])
+        return rows, list(labels), predicted, scores
+
+    rows, predicted, scores = [], [], []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            result = json.loads(line)
+            output = result.get('output')
+            if output is None:
+                continue
+            if labels is None:
+                labels = list(output['predicted_labels'][taxonomy])
+            rows.append(result['row'])
+            predicted.append([output['predicted_labels'][taxonomy][label] for label in labels])
+            scores.append([output['confidence_scores'][taxonomy][label] for label in labels])
+    return (np.array(rows, dtype=np.int64), list(labels or []), np.array(predicted).reshape(len(rows), -1),
+            np.array(scores, dtype=np.float64).reshape(len(rows), -1))
+
+
+def load_dataset_labels(path: str, label_column: str, delimiter: str = DEFAULT_DELIMITER) -> np.ndarray:
+    """
+    The values of a label column of a dataset file, by row.
+    """
+    values = []
+    for row in read_dataset(path, delimiter):
+        if label_column not in row:
+            raise ValueError(f"No label column {label_column} in the dataset {path}")
+        values.append(row[label_column].strip())
+    return np.array(values, dtype=str)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Evaluate scored outputs against a labeled dataset.")
+    parser.add_argument('--dataset', required=True, help="Labeled dataset file")
+    parser.add_argument('--delimiter', default=DEFAULT_DELIMITER, help="Column delimiter of the dataset")
+    parser.add_argument('--predictions', required=True, help="Output of mop_utils.score, JSONL or Parquet directory")
+    parser.add_argument('--label-column', required=True, help="Label column of the dataset")
+    parser.add_argument('--taxonomy', help="Taxonomy of the outputs, the label column name by default")
+    parser.add_argument('--label-type', choices=(LABEL_TYPE_CATEGORICAL, LABEL_TYPE_ORDINAL),
+                        default=LABEL_TYPE_CATEGORICAL)
+    parser.add_argument('--labels', help="Comma separated label names in task order, the output order by default")
+    parser.add_argument('--thresholds', type=int, default=DEFAULT_THRESHOLD_COUNT,
+                        help="Number of thresholds between 0 and 1 of the threshold sweeps")
+    parser.add_argument('--curves', action='store_true', help="Add threshold sweeps and PR curves")
+    parser.add_argument('--report', help="Report JSON path. Printed if not set")
+    args = parser.parse_args(argv)
+
+    rows, labels, predicted, scores = load_predictions(args.predictions, args.taxonomy or args.label_column,
+                                                       args.labels.split(',') if args.labels else None)
+    y_true = load_dataset_labels(args.dataset, args.label_column, args.delimiter)
+    report = evaluate(y_true[rows], predicted, scores, labels, args.label_type,
+                      np.linspace(0, 1, args.thresholds), args.curves)
+    report['evaluated_rows'] = int(len(rows))
+    report['failed_rows'] = int(len(y_true) - len(rows))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
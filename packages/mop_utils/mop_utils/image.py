@@ -0,0 +1,139 @@
+"""
+Image payload helpers: base64 decoding, header-only format and size detection, and pixel decoding.
+"""
+import binascii
+import io
+import struct
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# Number of base64 chars decoded to look for the image header before decoding the whole payload.
+HEADER_PREFIX_CHARS = 4096
+
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+class ImageInfo(NamedTuple):
+    format: str
+    width: int
+    height: int
+
+
+def strip_data_uri(image_base64: str) -> str:
+    """
+    Remove the 'data:image/...;base64,' prefix of a base64 image, if any.
+    """
+    if image_base64.startswith('data:'):
+        return image_base64[image_base64.index(',') + 1:]
+    return image_base64
+
+
+def decode_base64(image_base64: str) -> bytes:
+    """
+    Decode a base64 image, with or without a data URI prefix.
+    """
+    try:
+        return binascii.a2b_base64(strip_data_uri(image_base64))
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"Invalid base64 image: {e}") from e
+
+
+def read_image_info(buffer: bytes) -> Optional[ImageInfo]:
+    """
+    Read the format and size of a PNG, JPEG, GIF, BMP or WEBP image from its header, without decoding pixels.
+    @param buffer: The image bytes, or a prefix of them
+    @type buffer: bytes
+    @return: The image info, or None if the format is unknown or the header is not in the buffer
+    @rtype: ImageInfo
+    """
+    data = bytes(buffer[:32])
+    if data.startswith(b'\x89PNG\r\n\x1a\n') and len(data) >= 24:
+        width, height = struct.unpack('>II', data[16:24])
+        return ImageInfo('PNG', width, height)
+    if data[:6] in (b'GIF87a', b'GIF89a') and len(data) >= 10:
+        width, height = struct.unpack('<HH', data[6:10])
+        return ImageInfo('GIF', width, height)
+    if data.startswith(b'BM') and len(data) >= 26:
+        width, height = struct.unpack('<ii', data[18:26])
+        return ImageInfo('BMP', width, abs(height))
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return _read_webp_info(data)
+    if data.startswith(b'\xff\xd8'):
+        return _read_jpeg_info(buffer)
+    return None
+
+
+def _read_webp_info(data: bytes) -> Optional[ImageInfo]:
+    chunk = data[12:16]
+    if chunk == b'VP8 ' and len(data) >= 30:
+        width, height = struct.unpack('<HH', data[26:30])
+        return ImageInfo('WEBP', width & 0x3FFF, height & 0x3FFF)
+    if chunk == b'VP8L' and len(data) >= 25:
+        bits = int.from_bytes(data[21:25], 'little')
+        return ImageInfo('WEBP', (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+    if chunk == b'VP8X' and len(data) >= 30:
+        return ImageInfo('WEBP', int.from_bytes(data[24:27], 'little') + 1, int.from_bytes(data[27:30], 'little') + 1)
+    return None
+
+
+def _read_jpeg_info(buffer: bytes) -> Optional[ImageInfo]:
+    # walk the JPEG segments up to the start of frame, which holds the size
+    offset = 2
+    size = len(buffer)
+    while offset + 4 <= size:
+        if buffer[offset] != 0xFF:
+            return None
+        marker = buffer[offset + 1]
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            if offset + 9 > size:
+                return None
+            height, width = struct.unpack('>HH', bytes(buffer[offset + 5:offset + 9]))
+            return ImageInfo('JPEG', width, height)
+        segment_length = struct.unpack('>H', bytes(buffer[offset + 2:offset + 4]))[0]
+        offset += 2 + segment_length
+    return None
+
+
+def read_image_info_from_base64(image_base64: str) -> Optional[ImageInfo]:
+    """
+    Read the format and size of a base64 image by decoding only its first chars, unless the header is further.
+    """
+    image_base64 = strip_data_uri(image_base64)
+    if len(image_base64) > HEADER_PREFIX_CHARS:
+        try:
+            info = read_image_info(decode_base64(image_base64[:HEADER_PREFIX_CHARS]))
+        except ValueError:
+            info = None
+        if info is not None:
+            return info
+    return read_image_info(decode_base64(image_base64))
+
+
+def decode_image_array(buffer: bytes, mode: Optional[str] = None,
+                       size: Optional[Tuple[int, int]] = None) -> np.ndarray:
+    """
+    Decode the pixels of an image with Pillow.
+    @param buffer: The image bytes
+    @type buffer: bytes
+    @param mode: Optional Pillow mode to convert the image to, e.g. 'RGB'
+    @type mode: str
+    @param size: Optional (width, height) to resize the image to
+    @type size: Tuple[int, int]
+    @return: The pixels, shaped (height, width) or (height, width, channels)
+    @rtype: np.ndarray
+    """
+    try:
+        from PIL import Image
+    except ImportError as e:
+        raise ImportError("Pillow is required to decode image pixels: pip install Pillow") from e
+
+    with Image.open(io.BytesIO(buffer)) as image:
+        if mode is not None and image.mode != mode:
+            image = image.convert(mode)
+        if size is not None and image.size != tuple(size):
+            image = image.resize(tuple(size))
+        return np.asarray(image)
@@ -1,159 +1,268 @@
 import importlib
-import json
 import os
 from typing import Any, Dict, List, Optional
 
-import numpy as np
-from mop_utils.base_model_wrapper import BaseModelWrapper, MopInferenceInput
-from mop_utils.constant import CM_MODEL_WRAPPER_NAME
-from pyraisdk.dynbatch import BaseModel, DynamicBatchModel
+from mop_utils.base_model_wrapper import BaseModelWrapper
+from mop_utils.batching import BatchConfig, MopDynamicBatchModel, OverloadedError
+from mop_utils.constant import CM_MODEL_WRAPPER_NAME, DEFAULT_MODEL_NAME
+from mop_utils.metrics import STAGE_SERIALIZE
+from mop_utils.model_registry import ModelRegistry
+from mop_utils.registry import find_model_wrapper
+from mop_utils.runtime import MOPInferenceWrapper, ModelRuntime, WrapModel, run_in_thread
+from mop_utils.serialization import NumpyJsonEncoder, dumps, to_native
+from mop_utils.settings import load_settings
+from mop_utils.startup import STARTUP_DISCOVERY, STARTUP_IMPORT, STARTUP_INSTANTIATE, StartupProfile
+
+__all__ = [
+    # served model
+    'ModelWrapper', 'base_model_wrapper', 'inference_wrapper', 'runtime', 'model_registry', 'settings',
+    'startup_profile',
+    # API
+    'mop_init', 'mop_init_async', 'warmup_model', 'warmup_model_async', 'is_ready', 'enable_dynamic_batch',
+    'load_model', 'mop_run', 'mop_run_acs', 'mop_run_async', 'mop_run_acs_async', 'build_response',
+    'build_response_bytes', 'get_model_wrapper', 'update_batch_config', 'get_batch_stats', 'get_dedup_stats',
+    'get_cache_stats', 'get_warmup_timings', 'get_startup_profile', 'get_metrics', 'get_metrics_text',
+    # defined here by the previous versions, or raised by mop_run
+    'MOPInferenceWrapper', 'WrapModel', 'NumpyJsonEncoder', 'OverloadedError',
+]
+
+startup_profile = StartupProfile()
+
+with startup_profile.phase(STARTUP_IMPORT):
+    inference_module = importlib.import_module(CM_MODEL_WRAPPER_NAME)
+src_dir = os.path.dirname(os.path.abspath(inference_module.__file__))
+settings = load_settings(src_dir)
+
+with startup_profile.phase(STARTUP_DISCOVERY):
+    ModelWrapper = find_model_wrapper(inference_module, settings)
+
+with startup_profile.phase(STARTUP_INSTANTIATE):
+    base_model_wrapper: BaseModelWrapper = ModelWrapper()
+runtime: ModelRuntime = ModelRuntime(settings.get('model_name', DEFAULT_MODEL_NAME), base_model_wrapper, settings,
+                                     src_dir, startup_profile)
+inference_wrapper: MOPInferenceWrapper = runtime.inference_wrapper
+# the other models served by this process, by name
+model_registry: ModelRegistry = ModelRegistry.from_settings(settings, src_dir)
+
+
+def __getattr__(name: str) -> Any:
+    # the dynamic batch model, its batch size and the readiness belong to the runtime of the model
+    if name in ('batch_model', 'batch_size', 'ready'):
+        return getattr(runtime, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-inference_module = importlib.import_module(CM_MODEL_WRAPPER_NAME)
 
-wrappers = []
-for i in inference_module.__dict__.keys():
-    if hasattr(inference_module.__dict__.get(i), '__bases__'):
-        if BaseModelWrapper in inference_module.__dict__.get(i).__bases__[0].__bases__:
-            wrappers.append(getattr(inference_module, i))
-        if BaseModelWrapper in inference_module.__dict__.get(i).__bases__:
-            wrappers.append(getattr(inference_module, i))
+"""
+This is init function.
 
-ModelWrapper = [i for i in wrappers if i.__module__ == CM_MODEL_WRAPPER_NAME][0]
+Parameters:
+    model_root - root where the model file exists
+    dynamic_batch_args - dynamic batch settings: max_batch_size, idle_batch_size and max_batch_interval, and optionally
+        request_timeout (seconds, default 60), max_queue_depth (default unbounded) and
+        shed_policy ('reject' or 'drop_oldest', default 'reject'). An optional 'adaptive' dict, e.g.
+        {'target_p95_latency': 0.2, 'max_batch_size': 64}, tunes the batch size and interval online, and optional
+        bucket_boundaries, e.g. [256, 1024, 4096], batch items of similar get_batch_bucket_key() together
+    warmup - whether to warm the model up as configured in the warmup section of settings.yml, see warmup_model()
 
+Returns:
+    None
+"""
 
-class MOPInferenceWrapper:
-    def __init__(self, base_model_wrapper: BaseModelWrapper) -> None:
-        self.model_wrapper = base_model_wrapper
 
-    def init(self, model_root: str) -> None:
-        self.model_wrapper.init(model_root)
+def mop_init(model_root, dynamic_batch_args: None, warmup: bool = True):
+    runtime.init(model_root, dynamic_batch_args, warmup)
+    model_registry.init(warmup)
 
-    def run(self, item: Dict, triggered_by_mop) -> Dict:
-        if not triggered_by_mop:
-            model_output = self.model_wrapper.inference(item)
-            return [model_output]
-        else:
-            mop_input = MopInferenceInput().from_dict(item)
-            model_input = self.model_wrapper.convert_mop_input_to_model_input(mop_input)
-            model_output = self.model_wrapper.inference(model_input)
-            mop_output = self.model_wrapper.convert_model_output_to_mop_output(model_output)
 
-            return mop_output.output
+async def mop_init_async(model_root, dynamic_batch_args: None, warmup: bool = True):
+    """
+    mop_init() for an asyncio server: the model is initialized and warmed up on a thread of the default executor, so
+    that the event loop keeps serving, e.g. health checks answering is_ready(), meanwhile.
+    """
+    await run_in_thread(mop_init, model_root, dynamic_batch_args, warmup)
 
-    def run_batch(self, items: List[dict], triggered_by_mop: bool, batch_size: Optional[int] = None) -> List[dict]:
-        if not triggered_by_mop:
-            model_outputs = self.model_wrapper.inference_batch(items)
-            return model_outputs
-        else:
-            model_inputs = [
-                self.model_wrapper.convert_mop_input_to_model_input(MopInferenceInput().from_dict(item)) for item
-                in
-                items]
 
-            model_outputs = self.model_wrapper.inference_batch(model_inputs)
+def warmup_model(dynamic_batch_args: Optional[Dict] = None) -> List[Dict]:
+    """
+    Warm the model up as configured in the warmup section of settings.yml. mop_init() calls it unless warmup=False,
+    e.g. for a server that warms up with the dynamic batch args of its workers.
+    """
+    return runtime.warmup(dynamic_batch_args)
 
-            mop_outputs = [self.model_wrapper.convert_model_output_to_mop_output(model_output).output for
-                           model_output in model_outputs]
-            return mop_outputs
 
+async def warmup_model_async(dynamic_batch_args: Optional[Dict] = None) -> List[Dict]:
+    """
+    warmup_model() on a thread of the default executor.
+    """
+    return await runtime.warmup_async(dynamic_batch_args)
 
-batch_model: Optional[DynamicBatchModel] = None
-base_model_wrapper: BaseModelWrapper = ModelWrapper()
-inference_wrapper: MOPInferenceWrapper = MOPInferenceWrapper(base_model_wrapper)
-batch_size: Optional[int] = None
-triggered_by_mop: bool = False
 
+def is_ready() -> bool:
+    """
+    Whether mop_init() is done, warmup included, for the model and the models of the model registry.
+    """
+    return runtime.ready and model_registry.ready
 
-class WrapModel(BaseModel):
-    def predict(self, items: List[Any]) -> List[Any]:
-        return inference_wrapper.run_batch(items, triggered_by_mop=triggered_by_mop, batch_size=batch_size)
 
+def enable_dynamic_batch(dynamic_batch_args: Dict) -> MopDynamicBatchModel:
+    """
+    Create the dynamic batch model, replacing the current one, without initializing the model again.
+    A worker process forked after mop_init() calls it to start its own batch worker thread, since threads do not
+    survive a fork.
+    """
+    return runtime.enable_dynamic_batch(dynamic_batch_args)
 
-class NumpyJsonEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, np.integer):
-            return int(obj)
-        if isinstance(obj, np.floating):
-            return float(obj)
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        if isinstance(obj, np.bool_):
-            return bool(obj)
-        return json.JSONEncoder.default(self, obj)
+
+def load_model(name: str, src_dir: str, model_root: str, dynamic_batch_args: Optional[Dict] = None,
+               warmup: bool = True) -> ModelRuntime:
+    """
+    Serve another model in this process under a name, for mop_run(..., model_name=name). See ModelRegistry.load().
+    """
+    return model_registry.load(name, src_dir, model_root, dynamic_batch_args, warmup)
 
 
 """
-This is init function.
+This is run function.
 
 Parameters:
-    model_root - root where the model file exists
-
+    raw_data - row input data to do inference
+    is_mop_triggered - whether the function is triggered by mop
+    model_name - name of the model of the model registry to run, the model of the inference module if None
+    **kwargs - dynamic parameter 
+    
 Returns:
-    None
+    inference result
+    
 """
 
 
-def mop_init(model_root, dynamic_batch_args: None):
-    global batch_model
-    global batch_size
-    inference_wrapper.init(model_root)
-
-    # assign environment variable
-    if dynamic_batch_args is not None:
-        os.environ["PYRAISDK_MAX_BATCH_SIZE"] = str(dynamic_batch_args.get('max_batch_size'))
-        os.environ["PYRAISDK_IDLE_BATCH_SIZE"] = str(dynamic_batch_args.get('idle_batch_size'))
-        os.environ["PYRAISDK_MAX_BATCH_INTERVAL"] = str(dynamic_batch_args.get('max_batch_interval'))
-
-        batch_model = DynamicBatchModel(WrapModel())
-        batch_size = dynamic_batch_args.get('max_batch_size')
+def mop_run(raw_data: any, is_mop_triggered: bool = False, model_name: Optional[str] = None, **kwargs) -> any:
+    if model_name is not None and model_name != runtime.name:
+        return model_registry.run(model_name, raw_data, is_mop_triggered)
+    return runtime.run(raw_data, is_mop_triggered)
 
 
 """
-This is run function.
+This is the ACS run function.
 
 Parameters:
-    raw_data - row input data to do inference
-    triggered_by_mop - whether the function is triggered by mop
-    **kwargs - dynamic parameter 
-    
+    reqs - an ACS request or a list of ACS requests, TextAnalysisInput or ImageAnalysisInput
+    model_name - name of the model of the model registry to run, the model of the inference module if None
+    **kwargs - dynamic parameter
+
 Returns:
-    inference result
-    
+    ACS response, AcsTextResponse or AcsImageResponse, or a list of ACS responses for a list of requests
+
 """
 
 
-def mop_run(raw_data: any, is_mop_triggered: bool = False, **kwargs) -> any:
-    global triggered_by_mop
-    triggered_by_mop = is_mop_triggered
-    if batch_model is not None:
-        raw_data = raw_data if isinstance(raw_data, list) else [raw_data]
-        inference_result = batch_model.predict(raw_data, timeout=60)
-        return inference_result
-    if isinstance(raw_data, dict):
-        inference_result = inference_wrapper.run(raw_data, triggered_by_mop)
-        return inference_result
-    if isinstance(raw_data, list):
-        inference_result = inference_wrapper.run_batch(raw_data, triggered_by_mop=triggered_by_mop)
-        return inference_result
-    raise Exception("Invalid input data format")
+def mop_run_acs(reqs: Any, model_name: Optional[str] = None, **kwargs) -> Any:
+    if model_name is not None and model_name != runtime.name:
+        return model_registry.run_acs(model_name, reqs)
+    return runtime.run_acs(reqs)
+
+
+async def mop_run_async(raw_data: any, is_mop_triggered: bool = False, model_name: Optional[str] = None,
+                        **kwargs) -> any:
+    """
+    The asyncio counterpart of mop_run(), with the same arguments and result. With dynamic batching, the items are
+    queued to the dynamic batch model and the request awaits their results on the event loop, so a few threads keep
+    thousands of requests in flight. Without it, mop_run() runs on a thread of the default executor.
+    """
+    if model_name is not None and model_name != runtime.name:
+        return await model_registry.run_async(model_name, raw_data, is_mop_triggered)
+    return await runtime.run_async(raw_data, is_mop_triggered)
+
+
+async def mop_run_acs_async(reqs: Any, model_name: Optional[str] = None, **kwargs) -> Any:
+    """
+    The asyncio counterpart of mop_run_acs().
+    """
+    if model_name is not None and model_name != runtime.name:
+        return await model_registry.run_acs_async(model_name, reqs)
+    return await runtime.run_acs_async(reqs)
 
 
 def build_response(inference_result: any) -> any:
-    if isinstance(inference_result, dict):
-        output_str = json.dumps(inference_result, cls=NumpyJsonEncoder)
-        return json.loads(output_str)
-    if isinstance(inference_result, list):
-        res = [item.__dict__ if hasattr(inference_result, '__dict__') else item for item in inference_result]
-        output_str = json.dumps(res, cls=NumpyJsonEncoder)
-        return json.loads(output_str)
-    if hasattr(inference_result, '__dict__'):
-        output_str = json.dumps(inference_result.__dict__, cls=NumpyJsonEncoder)
-        return json.loads(output_str)
-    return inference_result
+    """
+    Convert an inference result to native Python types for the web layer to serialize.
+    """
+    with inference_wrapper.metrics.stage(STAGE_SERIALIZE):
+        return to_native(inference_result)
+
+
+def build_response_bytes(inference_result: any) -> bytes:
+    """
+    Serialize an inference result directly to JSON bytes, for web layers that can send bytes as is.
+    """
+    with inference_wrapper.metrics.stage(STAGE_SERIALIZE):
+        return dumps(inference_result)
+
 
 def get_model_wrapper():
     return inference_wrapper
 
+
+def update_batch_config(**changes) -> BatchConfig:
+    """
+    Update the dynamic batch config in place, e.g. update_batch_config(max_batch_size=32, max_batch_interval=0.05),
+    without reloading the model.
+    """
+    return runtime.update_batch_config(**changes)
+
+
+def get_batch_stats() -> Optional[Dict]:
+    """
+    Queue depth and shedding counters of the dynamic batch model, or None if dynamic batching is disabled.
+    """
+    return runtime.batch_stats()
+
+
+def get_dedup_stats() -> Dict:
+    """
+    In-batch deduplication counters and ratio of run_batch.
+    """
+    return inference_wrapper.dedup_stats()
+
+
+def get_cache_stats() -> Optional[Dict]:
+    """
+    Hit, miss and eviction counters of the result cache, or None if the cache is disabled in settings.yml.
+    """
+    return runtime.cache_stats()
+
+
+def get_warmup_timings() -> List[Dict]:
+    """
+    Timings of the warmup run by mop_init() at each batch size, through inference() and inference_batch(): the first
+    run, and the mean and per item durations of the later runs, in seconds.
+    """
+    return inference_wrapper.warmup_timings
+
+
+def get_startup_profile() -> Dict:
+    """
+    Durations of the startup phases: importing the inference module, finding and instantiating the model wrapper,
+    init() and the first inference.
+    """
+    return startup_profile.to_dict()
+
+
+def get_metrics() -> Dict:
+    """
+    All the runtime stats in one snapshot: the stage metrics, the batch, dedup and cache stats, the startup profile
+    and warmup timings, and the same for each model of the model registry.
+    """
+    return {**runtime.get_metrics(), 'models': model_registry.get_metrics()}
+
+
+def get_metrics_text() -> str:
+    """
+    The stage metrics and the numeric batch, dedup and cache stats in the Prometheus text exposition format.
+    """
+    return runtime.get_metrics_text()
+
+
 if __name__ == "__main__":
     model_root = "D:\code\carnegie-mop\sample\model"
     # mop_init(model_root, None)
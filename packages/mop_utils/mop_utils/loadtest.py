@@ -0,0 +1,419 @@
+"""
+Local load test reproducing the perRPS and perConcurrency load tests of MOP, against mop_run() in-process or
+against the local server of mop_utils.server.
+
+    python -m mop_utils.loadtest --dataset ./dataset.csv --url http://127.0.0.1:8080/score --mode rps
+    python -m mop_utils.loadtest --dataset ./dataset.csv --src-dir ./model/src --model-root ./model --mode concurrency
+
+perRPS: for each target RPS (1, 10, 20, ...), the target RPS requests of each second are sent after a random delay
+between 0 and 1 second. perConcurrency: for each concurrency count (1, 10, 20, ...), the clients send requests
+back to back. Each step runs for step_duration seconds (5 minutes by default) and the sweep stops after the first
+step with more than 1% failed requests.
+
+Every step reports the actual (successful) RPS, the average, p50, p90, p95 and p99 latency of the successful
+requests, the successful, user failed (4xx) and system failed requests, and the CPU and memory use of the server.
+In-process, the CPU use includes the load generator itself.
+"""
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from .dataset import DEFAULT_DELIMITER, check_data_columns, read_dataset, row_to_mop_input
+from .server import error_status
+
+MODE_RPS = "rps"
+MODE_CONCURRENCY = "concurrency"
+
+OUTCOME_SUCCESS = "success"
+OUTCOME_USER_FAILURE = "user_failure"
+OUTCOME_SYSTEM_FAILURE = "system_failure"
+
+DEFAULT_STEP_DURATION = 300.0
+DEFAULT_MAX_FAILURE_RATE = 0.01
+DEFAULT_LEVEL_STEP = 10
+DEFAULT_REQUEST_TIMEOUT = 60.0
+
+_PERCENTILES = (50, 90, 95, 99)
+
+
+def sweep_levels(max_level: int, step: int = DEFAULT_LEVEL_STEP) -> List[int]:
+    """
+    The target RPS or concurrency counts of a sweep: 1, then every step up to max_level, e.g. 1, 10, 20, 30.
+    """
+    return [1] + list(range(step, max_level + 1, step))
+
+
+def _outcome(status: int) -> str:
+    if status == 200:
+        return OUTCOME_SUCCESS
+    return OUTCOME_USER_FAILURE if 400 <= status < 500 else OUTCOME_SYSTEM_FAILURE
+
+
+class InProcessTarget:
+    """
+    Sends requests to mop_run() of an initialized inference_wrapper module, on a thread pool of the given size,
+    like the threads of a server worker. Failures are classified by the HTTP status the server would answer with.
+    """
+
+    def __init__(self, inference_wrapper, payloads: List[Dict], threads: int, mop_triggered: bool = True) -> None:
+        self.inference_wrapper = inference_wrapper
+        self.payloads = payloads
+        self.mop_triggered = mop_triggered
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix='mop-loadtest')
+
+    def _run(self, payload: Dict) -> bytes:
+        result = self.inference_wrapper.mop_run(payload, self.mop_triggered)
+        return self.inference_wrapper.build_response_bytes(result)
+
+    async def send(self, index: int) -> str:
+        payload = self.payloads[index % len(self.payloads)]
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._run, payload)
+        except Exception as ex:
+            return _outcome(error_status(ex, payload, self.mop_triggered))
+        return OUTCOME_SUCCESS
+
+    async def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+class HttpTarget:
+    """
+    Sends requests to the /score endpoint of a server over pooled keep-alive connections.
+    """
+
+    def __init__(self, url: str, payloads: List[Dict], timeout: float = DEFAULT_REQUEST_TIMEOUT) -> None:
+        url_parts = urlsplit(url)
+        if url_parts.scheme != 'http':
+            raise ValueError(f"Only http URLs are supported. Current value: {url}")
+        self.host = url_parts.hostname
+        self.port = url_parts.port or 80
+        self.timeout = timeout
+        target = url_parts.path + (f"?{url_parts.query}" if url_parts.query else '')
+        head = f"POST {target} HTTP/1.1\r\nHost: {url_parts.netloc}\r\nContent-Type: application/json\r\n"
+        self._requests = []
+        for payload in payloads:
+            body = json.dumps(payload).encode()
+            self._requests.append(f"{head}Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body)
+        self._idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+
+    @staticmethod
+    async def _request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                       request: bytes) -> Tuple[int, bool]:
+        writer.write(request)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        await reader.readexactly(int(headers.get('content-length') or 0))
+        return status, headers.get('connection', '').lower() != 'close'
+
+    async def send(self, index: int) -> str:
+        writer = None
+        try:
+            if self._idle:
+                reader, writer = self._idle.pop()
+            else:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            status, keep_alive = await asyncio.wait_for(
+                self._request(reader, writer, self._requests[index % len(self._requests)]), self.timeout)
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            if writer is not None:
+                writer.close()
+            return OUTCOME_SYSTEM_FAILURE
+
+        if keep_alive:
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+        return _outcome(status)
+
+    async def close(self) -> None:
+        for _, writer in self._idle:
+            writer.close()
+        self._idle.clear()
+
+
+class ResourceSampler:
+    """
+    CPU and memory use of a process and its child processes, e.g. the forked workers of the local server.
+    Read from /proc on Linux. Elsewhere only the CPU time of the current process is available.
+    """
+
+    def __init__(self, pid: Optional[int] = None) -> None:
+        self.pid = pid or os.getpid()
+        self._has_proc = os.path.exists(f"/proc/{self.pid}/stat")
+        self._clock_ticks = os.sysconf('SC_CLK_TCK') if self._has_proc else None
+        self._page_size = os.sysconf('SC_PAGE_SIZE') if self._has_proc else None
+        try:
+            self.total_memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+        except (AttributeError, ValueError, OSError):
+            self.total_memory = None
+
+    def _pids(self) -> List[int]:
+        pids = [self.pid]
+        try:
+            with open(f"/proc/{self.pid}/task/{self.pid}/children") as f:
+                pids.extend(int(pid) for pid in f.read().split())
+        except OSError:
+            pass
+        return pids
+
+    def cpu_seconds(self) -> Optional[float]:
+        if not self._has_proc:
+            return time.process_time() if self.pid == os.getpid() else None
+        ticks = 0
+        for pid in self._pids():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    # the command name may contain spaces, so the fields are counted from its closing parenthesis
+                    stat_fields = f.read().rsplit(')', 1)[1].split()
+                ticks += int(stat_fields[11]) + int(stat_fields[12])
+            except (OSError, IndexError, ValueError):
+                pass
+        return ticks / self._clock_ticks
+
+    def memory_bytes(self) -> Optional[int]:
+        if not self._has_proc:
+            return None
+        pages = 0
+        for pid in self._pids():
+            try:
+                with open(f"/proc/{pid}/statm") as f:
+                    pages += int(f.read().split()[1])
+            except (OSError, IndexError, ValueError):
+                pass
+        return pages * self._page_size
+
+
+class _StepRecorder:
+    def __init__(self) -> None:
+        self.outcomes = {OUTCOME_SUCCESS: 0, OUTCOME_USER_FAILURE: 0, OUTCOME_SYSTEM_FAILURE: 0}
+        self.latencies: List[float] = []
+
+    async def send(self, target, index: int) -> None:
+        start = time.perf_counter()
+        outcome = await target.send(index)
+        self.outcomes[outcome] += 1
+        if outcome == OUTCOME_SUCCESS:
+            self.latencies.append(time.perf_counter() - start)
+
+
+async def _run_rps_step(target, recorder: _StepRecorder, rps: int, duration: float,
+                        indexes: Iterable[int]) -> None:
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async def delayed_send(index: int) -> None:
+        await asyncio.sleep(random.random())
+        await recorder.send(target, index)
+
+    tasks = []
+    second = 0
+    while second < duration:
+        await asyncio.sleep(max(start + second - loop.time(), 0))
+        tasks.extend(asyncio.ensure_future(delayed_send(next(indexes))) for _ in range(rps))
+        second += 1
+    await asyncio.gather(*tasks)
+
+
+async def _run_concurrency_step(target, recorder: _StepRecorder, concurrency: int, duration: float,
+                                indexes: Iterable[int]) -> None:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+
+    async def client() -> None:
+        while loop.time() < deadline:
+            await recorder.send(target, next(indexes))
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+
+
+async def run_step(target, mode: str, level: int, duration: float = DEFAULT_STEP_DURATION,
+                   sampler: Optional[ResourceSampler] = None, indexes: Optional[Iterable[int]] = None) -> Dict:
+    """
+    Run one step of a sweep and summarize it.
+    @param target: InProcessTarget or HttpTarget
+    @type target: object
+    @param mode: 'rps' or 'concurrency'
+    @type mode: str
+    @param level: Target RPS or concurrency count
+    @type level: int
+    @param duration: Duration of the step in seconds
+    @type duration: float
+    @param sampler: Resource sampler of the server, None to skip the CPU and memory metrics
+    @type sampler: ResourceSampler
+    @param indexes: Iterator of the payload indexes to send, shared by the steps of a sweep
+    @type indexes: Iterable[int]
+    @return: Step metrics
+    @rtype: Dict
+    """
+    if mode not in (MODE_RPS, MODE_CONCURRENCY):
+        raise ValueError(f"The mode should be {MODE_RPS} or {MODE_CONCURRENCY}. Current value: {mode}")
+    indexes = indexes if indexes is not None else itertools.count()
+    recorder = _StepRecorder()
+    memory_samples = []
+
+    async def sample_memory() -> None:
+        while True:
+            memory_samples.append(sampler.memory_bytes())
+            await asyncio.sleep(1)
+
+    memory_task = asyncio.ensure_future(sample_memory()) if sampler is not None else None
+    cpu_start = sampler.cpu_seconds() if sampler is not None else None
+    start = time.perf_counter()
+    if mode == MODE_RPS:
+        await _run_rps_step(target, recorder, level, duration, indexes)
+    else:
+        await _run_concurrency_step(target, recorder, level, duration, indexes)
+    elapsed = time.perf_counter() - start
+    cpu_end = sampler.cpu_seconds() if sampler is not None else None
+    if memory_task is not None:
+        memory_task.cancel()
+
+    successes = recorder.outcomes[OUTCOME_SUCCESS]
+    requests = sum(recorder.outcomes.values())
+    step = {
+        'mode': mode,
+        'level': level,
+        'duration': elapsed,
+        'requests': requests,
+        'successes': successes,
+        'user_failures': recorder.outcomes[OUTCOME_USER_FAILURE],
+        'system_failures': recorder.outcomes[OUTCOME_SYSTEM_FAILURE],
+        'failure_rate': (requests - successes) / requests if requests else 0.0,
+        'actual_rps': successes / elapsed if elapsed else 0.0,
+    }
+    latencies = np.array(recorder.latencies) * 1000
+    step['latency_avg_ms'] = float(latencies.mean()) if latencies.size else None
+    for percentile, value in zip(_PERCENTILES, np.percentile(latencies, _PERCENTILES) if latencies.size
+                                 else [None] * len(_PERCENTILES)):
+        step[f'latency_p{percentile}_ms'] = float(value) if value is not None else None
+
+    step['cpu_percent'] = None
+    if cpu_start is not None and cpu_end is not None:
+        step['cpu_percent'] = (cpu_end - cpu_start) / (elapsed * (os.cpu_count() or 1)) * 100
+    memory_samples = [m for m in memory_samples if m is not None]
+    step['memory_bytes'] = max(memory_samples) if memory_samples else None
+    step['memory_percent'] = None
+    if step['memory_bytes'] is not None and sampler.total_memory:
+        step['memory_percent'] = step['memory_bytes'] / sampler.total_memory * 100
+    return step
+
+
+async def run_sweep(target, mode: str, levels: List[int], step_duration: float = DEFAULT_STEP_DURATION,
+                    max_failure_rate: float = DEFAULT_MAX_FAILURE_RATE,
+                    sampler: Optional[ResourceSampler] = None, verbose: bool = False) -> List[Dict]:
+    """
+    Run the steps of a perRPS or perConcurrency sweep, stopping after the first step whose failure rate is above
+    max_failure_rate.
+    """
+    indexes = itertools.count()
+    steps = []
+    for level in levels:
+        step = await run_step(target, mode, level, step_duration, sampler, indexes)
+        steps.append(step)
+        if verbose:
+            print(f"{mode}={level}: actual_rps={step['actual_rps']:.2f} p50={step['latency_p50_ms']} "
+                  f"p99={step['latency_p99_ms']} failure_rate={step['failure_rate']:.4f}", file=sys.stderr)
+        if step['failure_rate'] > max_failure_rate:
+            break
+    return steps
+
+
+def write_report(path: str, steps: List[Dict], config: Optional[Dict] = None) -> None:
+    """
+    Write the steps of a sweep as CSV, one row per step, if path ends with .csv, or as JSON otherwise.
+    """
+    if path.lower().endswith('.csv'):
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(steps[0].keys()) if steps else [])
+            writer.writeheader()
+            writer.writerows(steps)
+    else:
+        with open(path, 'w') as f:
+            json.dump({'config': config or {}, 'steps': steps}, f, indent=2)
+
+
+def load_payloads(path: str, delimiter: str = DEFAULT_DELIMITER, limit: Optional[int] = None) -> List[Dict]:
+    """
+    The MOP input dicts of the rows of a dataset file, replayed in order by the load test.
+    """
+    rows = list(itertools.islice(read_dataset(path, delimiter), limit))
+    if not rows:
+        raise ValueError(f"No rows in the dataset {path}")
+    check_data_columns(list(rows[0]), path)
+    return [row_to_mop_input(row) for row in rows]
+
+
+async def _main(args: argparse.Namespace) -> List[Dict]:
+    payloads = load_payloads(args.dataset, args.delimiter, args.limit)
+    if args.url:
+        target = HttpTarget(args.url, payloads, args.timeout)
+        sampler = ResourceSampler(args.server_pid) if args.server_pid else None
+    else:
+        from .server import ServerConfig, load_inference_wrapper
+        inference_wrapper = load_inference_wrapper(args.src_dir)
+        server_config = ServerConfig.from_settings(inference_wrapper.inference_wrapper.settings)
+        inference_wrapper.mop_init(args.model_root, server_config.dynamic_batch)
+        target = InProcessTarget(inference_wrapper, payloads, args.threads or server_config.threads, not args.raw)
+        sampler = ResourceSampler()
+
+    levels = [int(level) for level in args.levels.split(',')] if args.levels else sweep_levels(args.max_level)
+    try:
+        return await run_sweep(target, args.mode, levels, args.step_duration, args.max_failure_rate, sampler,
+                               verbose=True)
+    finally:
+        await target.close()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Run a MOP perRPS or perConcurrency load test locally.")
+    parser.add_argument('--dataset', required=True, help="Dataset file whose rows are replayed as requests")
+    parser.add_argument('--delimiter', default=DEFAULT_DELIMITER, help="Column delimiter of the dataset")
+    parser.add_argument('--limit', type=int, help="Max number of dataset rows to replay")
+    parser.add_argument('--mode', choices=(MODE_RPS, MODE_CONCURRENCY), default=MODE_RPS)
+    parser.add_argument('--levels', help="Comma separated target RPS or concurrency counts, e.g. 1,10,20")
+    parser.add_argument('--max-level', type=int, default=100,
+                        help="Highest target RPS or concurrency count of the default 1, 10, 20, ... sweep")
+    parser.add_argument('--step-duration', type=float, default=DEFAULT_STEP_DURATION,
+                        help="Duration of each step in seconds")
+    parser.add_argument('--max-failure-rate', type=float, default=DEFAULT_MAX_FAILURE_RATE,
+                        help="The sweep stops after a step with a higher failure rate")
+    parser.add_argument('--url', help="URL of the /score endpoint of a local server. In-process if not set")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_REQUEST_TIMEOUT, help="HTTP request timeout")
+    parser.add_argument('--server-pid', type=int, help="PID of the server, to report its CPU and memory use")
+    parser.add_argument('--src-dir', help="In-process: directory of the inference module of the model")
+    parser.add_argument('--model-root', help="In-process: root where the model files exist")
+    parser.add_argument('--threads', type=int, help="In-process: overrides server.threads of settings.yml")
+    parser.add_argument('--raw', action='store_true', help="In-process: run the rows as raw model inputs")
+    parser.add_argument('--report', help="Report path, CSV if it ends with .csv, JSON otherwise")
+    args = parser.parse_args(argv)
+    if not args.url and not args.model_root:
+        parser.error("Either --url or --model-root is required")
+
+    steps = asyncio.run(_main(args))
+    if args.report:
+        write_report(args.report, steps, vars(args))
+    else:
+        print(json.dumps(steps, indent=2))
+
+
+if __name__ == "__main__":
+    main()
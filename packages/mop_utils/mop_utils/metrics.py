@@ -0,0 +1,326 @@
+"""
+Per-stage timing instrumentation of inference requests, with a snapshot API and the Prometheus text format.
+"""
+import bisect
+import itertools
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+STAGE_REQUEST = "request"
+STAGE_CONVERT_INPUT = "convert_input"
+STAGE_INFERENCE = "inference"
+STAGE_CONVERT_OUTPUT = "convert_output"
+STAGE_SERIALIZE = "serialize"
+
+DEFAULT_LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                           1.0, 2.5, 5.0, 10.0)
+DEFAULT_BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+DEFAULT_MAX_TRACES = 100
+
+_PROMETHEUS_PREFIX = "mop"
+
+
+class Histogram:
+    """
+    Histogram with fixed bucket upper bounds, like a Prometheus histogram. Not thread safe on its own.
+    """
+    __slots__ = ('boundaries', 'counts', 'sum', 'count')
+
+    def __init__(self, boundaries: Sequence[float]) -> None:
+        self.boundaries = tuple(boundaries)
+        self.counts = [0] * (len(self.boundaries) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.boundaries, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimate a quantile by linear interpolation inside its bucket, like histogram_quantile() of Prometheus.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                if i == len(self.boundaries):
+                    return self.boundaries[-1] if self.boundaries else None
+                lower = self.boundaries[i - 1] if i > 0 else 0.0
+                return lower + (self.boundaries[i] - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return None
+
+    def snapshot(self) -> Dict:
+        cumulative = list(itertools.accumulate(self.counts))
+        buckets = {str(boundary): cumulative[i] for i, boundary in enumerate(self.boundaries)}
+        buckets['+Inf'] = self.count
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': buckets,
+        }
+
+
+class Trace:
+    """
+    Timeline of one sampled request: the stages it went through, with their offsets from the request start.
+    """
+    __slots__ = ('trace_id', 'attributes', 'start', 'duration', 'spans')
+
+    def __init__(self, trace_id: int, attributes: Dict) -> None:
+        self.trace_id = trace_id
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.duration = None
+        self.spans: List[Tuple[str, float, float]] = []
+
+    def to_dict(self) -> Dict:
+        return {
+            'trace_id': self.trace_id,
+            'attributes': self.attributes,
+            'duration': self.duration,
+            'spans': [{'stage': stage, 'offset': offset, 'duration': duration}
+                      for stage, offset, duration in self.spans],
+        }
+
+
+# The traces the stages of the current thread or task are recorded in. The dynamic batch worker sets the traces of
+# all the sampled items of a batch.
+_active_traces: ContextVar[Tuple[Trace, ...]] = ContextVar('active_traces', default=())
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _StageTimer:
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics: 'StageMetrics', stage: str) -> None:
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.record_stage(self.stage, time.perf_counter() - self.start, self.start,
+                                  exc_type.__name__ if exc_type is not None else None)
+        return False
+
+
+class StageMetrics:
+    """
+    Stage duration histograms, error counters by stage, and batch size and queue wait histograms.
+    Per-request traces are sampled at trace_sample_rate. While disabled, stage() returns a shared no-op context
+    manager and nothing is recorded.
+    """
+
+    def __init__(self, enabled: bool = False, trace_sample_rate: float = 0.0, max_traces: int = DEFAULT_MAX_TRACES,
+                 latency_buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+                 batch_size_buckets: Sequence[float] = DEFAULT_BATCH_SIZE_BUCKETS) -> None:
+        if not 0 <= trace_sample_rate <= 1:
+            raise ValueError(f"The trace sample rate should be between 0 and 1. Current value: {trace_sample_rate}")
+        self.enabled = enabled
+        self.trace_sample_rate = trace_sample_rate
+        self.latency_buckets = tuple(latency_buckets)
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Histogram] = {}
+        self._errors: Dict[Tuple[str, str], int] = {}
+        self._batch_size = Histogram(batch_size_buckets)
+        self._queue_wait = Histogram(self.latency_buckets)
+        self._traces = deque(maxlen=max_traces)
+        self._trace_ids = itertools.count(1)
+
+    @classmethod
+    def from_settings(cls, settings: Dict) -> 'StageMetrics':
+        """
+        Build the metrics from the metrics section of settings.yml, e.g.
+
+            metrics:
+              enable: true
+              trace_sample_rate: 0.01
+              max_traces: 100
+        """
+        metrics_settings = settings.get('metrics') or {}
+        return cls(enabled=bool(metrics_settings.get('enable', False)),
+                   trace_sample_rate=metrics_settings.get('trace_sample_rate', 0.0),
+                   max_traces=metrics_settings.get('max_traces', DEFAULT_MAX_TRACES))
+
+    def stage(self, stage: str):
+        """
+        Context manager timing a stage. An exception raised inside counts as an error of the stage.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self, stage)
+
+    def record_stage(self, stage: str, duration: float, start: Optional[float] = None,
+                     error: Optional[str] = None) -> None:
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram(self.latency_buckets)
+            histogram.observe(duration)
+            if error is not None:
+                self._errors[(stage, error)] = self._errors.get((stage, error), 0) + 1
+        for trace in _active_traces.get():
+            trace.spans.append((stage, (start or time.perf_counter() - duration) - trace.start, duration))
+
+    def observe_batch_size(self, size: int) -> None:
+        if self.enabled:
+            with self._lock:
+                self._batch_size.observe(size)
+
+    def observe_queue_waits(self, waits: Sequence[float]) -> None:
+        if self.enabled:
+            with self._lock:
+                for wait in waits:
+                    self._queue_wait.observe(wait)
+
+    def start_trace(self, **attributes) -> Optional[Trace]:
+        """
+        Start a trace for a request if it is sampled. Call finish_trace() once the request is done.
+        """
+        if not self.enabled or not self.trace_sample_rate or random.random() >= self.trace_sample_rate:
+            return None
+        return Trace(next(self._trace_ids), attributes)
+
+    def finish_trace(self, trace: Optional[Trace]) -> None:
+        if trace is not None:
+            trace.duration = time.perf_counter() - trace.start
+            with self._lock:
+                self._traces.append(trace)
+
+    @contextmanager
+    def tracing(self, *traces: Optional[Trace]) -> Iterator[None]:
+        """
+        Record the stages run inside the block in the given traces, the None ones being skipped.
+        """
+        traces = tuple(trace for trace in traces if trace is not None)
+        if not traces:
+            yield
+            return
+        token = _active_traces.set(_active_traces.get() + traces)
+        try:
+            yield
+        finally:
+            _active_traces.reset(token)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages.clear()
+            self._errors.clear()
+            self._batch_size = Histogram(self._batch_size.boundaries)
+            self._queue_wait = Histogram(self._queue_wait.boundaries)
+            self._traces.clear()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            errors = {}
+            for (stage, error), count in self._errors.items():
+                errors.setdefault(stage, {})[error] = count
+            return {
+                'enabled': self.enabled,
+                'stages': {stage: histogram.snapshot() for stage, histogram in self._stages.items()},
+                'errors': errors,
+                'batch_size': self._batch_size.snapshot(),
+                'queue_wait': self._queue_wait.snapshot(),
+                'traces': [trace.to_dict() for trace in self._traces],
+            }
+
+    def to_prometheus(self, gauges: Optional[Dict[str, float]] = None,
+                      counters: Optional[Dict[str, float]] = None) -> str:
+        """
+        The metrics in the Prometheus text exposition format, with optional extra gauges, e.g. queue depth, and
+        counters, e.g. rejected requests. The counters are exported with the _total suffix.
+        """
+        lines = []
+        with self._lock:
+            lines.append(f"# HELP {_PROMETHEUS_PREFIX}_stage_duration_seconds Duration of each stage of a request.")
+            lines.append(f"# TYPE {_PROMETHEUS_PREFIX}_stage_duration_seconds histogram")
+            for stage, histogram in self._stages.items():
+                lines.extend(_histogram_lines(f"{_PROMETHEUS_PREFIX}_stage_duration_seconds", histogram,
+                                              f'stage="{stage}"'))
+            lines.append(f"# HELP {_PROMETHEUS_PREFIX}_stage_errors_total Errors raised by each stage.")
+            lines.append(f"# TYPE {_PROMETHEUS_PREFIX}_stage_errors_total counter")
+            for (stage, error), count in self._errors.items():
+                lines.append(f'{_PROMETHEUS_PREFIX}_stage_errors_total{{stage="{stage}",error="{error}"}} {count}')
+            lines.append(f"# HELP {_PROMETHEUS_PREFIX}_batch_size Number of items of each inference batch.")
+            lines.append(f"# TYPE {_PROMETHEUS_PREFIX}_batch_size histogram")
+            lines.extend(_histogram_lines(f"{_PROMETHEUS_PREFIX}_batch_size", self._batch_size))
+            lines.append(f"# HELP {_PROMETHEUS_PREFIX}_queue_wait_seconds Wait of each item in the batch queue.")
+            lines.append(f"# TYPE {_PROMETHEUS_PREFIX}_queue_wait_seconds histogram")
+            lines.extend(_histogram_lines(f"{_PROMETHEUS_PREFIX}_queue_wait_seconds", self._queue_wait))
+        lines.extend(prometheus_lines(_PROMETHEUS_PREFIX, gauges, counters))
+        return '\n'.join(lines) + '\n'
+
+
+def prometheus_lines(prefix: str, gauges: Optional[Dict[str, float]] = None,
+                     counters: Optional[Dict[str, float]] = None) -> List[str]:
+    """
+    The Prometheus text lines of gauges and counters named prefix_name, and prefix_name_total for the counters.
+    """
+    lines = []
+    for name, value in (gauges or {}).items():
+        lines.append(f"# TYPE {prefix}_{name} gauge")
+        lines.append(f"{prefix}_{name} {value}")
+    for name, value in (counters or {}).items():
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total {value}")
+    return lines
+
+
+def _histogram_lines(name: str, histogram: Histogram, labels: str = '') -> List[str]:
+    separator = ',' if labels else ''
+    lines = []
+    cumulative = 0
+    for boundary, count in zip(histogram.boundaries, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels}{separator}le="{boundary}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels}{separator}le="+Inf"}} {histogram.count}')
+    label_set = f"{{{labels}}}" if labels else ''
+    lines.append(f"{name}_sum{label_set} {histogram.sum}")
+    lines.append(f"{name}_count{label_set} {histogram.count}")
+    return lines
+
+
+def numeric_metrics(prefix: str, stats: Optional[Dict],
+                    counter_keys: Sequence[str] = ()) -> Tuple[Dict[str, float], Dict[str, float]]:
+    """
+    Flatten the numeric values of a stats dict, e.g. get_batch_stats(), to gauges and counters named prefix_key.
+    The top-level values of counter_keys are monotonic counters, the others are gauges.
+    @return: The gauges and the counters
+    @rtype: Tuple[Dict[str, float], Dict[str, float]]
+    """
+    gauges = {}
+    counters = {}
+    for key, value in (stats or {}).items():
+        if isinstance(value, dict):
+            gauges.update(numeric_metrics(f"{prefix}_{key}", value)[0])
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            (counters if key in counter_keys else gauges)[f"{prefix}_{key}"] = value
+    return gauges, counters
@@ -0,0 +1,165 @@
+"""
+Several models served by one process, keyed by model name, e.g. separate hate, violence and self-harm classifiers.
+
+Each model has its own model wrapper, settings.yml, dynamic batch config and metrics. The dynamic batch models of all
+the models share the worker threads of one SharedBatchScheduler, served round robin, so an idle model costs no thread.
+"""
+import os
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+from .batching import SharedBatchScheduler
+from .runtime import ModelRuntime
+
+DEFAULT_BATCH_WORKERS = 1
+
+
+class ModelRegistry:
+    """
+    Models by name. Models are loaded explicitly with load(), or from the model_registry section of settings.yml:
+
+        model_registry:
+          batch_workers: 2          # optional, worker threads shared by the dynamic batch models
+          models:
+            violence:
+              src_dir: ../../violence/src         # relative to the folder of settings.yml
+              model_root: ../../violence/model
+              dynamic_batch:                      # optional, dynamic batch args of the model
+                max_batch_size: 16
+                idle_batch_size: 1
+                max_batch_interval: 0.01
+    """
+
+    def __init__(self, batch_workers: int = DEFAULT_BATCH_WORKERS, models: Optional[Dict[str, Dict]] = None,
+                 base_dir: Optional[str] = None) -> None:
+        if batch_workers <= 0:
+            raise ValueError(f"The number of batch workers should be positive. Current value: {batch_workers}")
+        self.batch_workers = batch_workers
+        self.base_dir = base_dir
+        self._model_configs = dict(models or {})
+        for name, config in self._model_configs.items():
+            if not config.get('src_dir') or not config.get('model_root'):
+                raise ValueError(f"The model {name} of the model registry needs a src_dir and a model_root")
+        self._lock = Lock()
+        self._runtimes: Dict[str, ModelRuntime] = {}
+        self._scheduler: Optional[SharedBatchScheduler] = None
+
+    @classmethod
+    def from_settings(cls, settings: Dict, base_dir: Optional[str] = None) -> 'ModelRegistry':
+        registry_settings = settings.get('model_registry') or {}
+        return cls(batch_workers=registry_settings.get('batch_workers', DEFAULT_BATCH_WORKERS),
+                   models=registry_settings.get('models'),
+                   base_dir=base_dir)
+
+    def _path(self, path: str) -> str:
+        return path if self.base_dir is None or os.path.isabs(path) else os.path.join(self.base_dir, path)
+
+    def _get_scheduler(self) -> SharedBatchScheduler:
+        if self._scheduler is None:
+            self._scheduler = SharedBatchScheduler(self.batch_workers)
+        return self._scheduler
+
+    def load(self, name: str, src_dir: str, model_root: str, dynamic_batch_args: Optional[Dict] = None,
+             warmup: bool = True) -> ModelRuntime:
+        """
+        Load, initialize and warm up a model, and serve it under a name.
+        @param name: Model name, the model_name of mop_run()
+        @type name: str
+        @param src_dir: The /src folder of the model, with inference.py and settings.yml
+        @type src_dir: str
+        @param model_root: Root where the model files exist, passed to init() of the model wrapper
+        @type model_root: str
+        @param dynamic_batch_args: Dynamic batch args of the model, see mop_init(). No dynamic batching if None
+        @type dynamic_batch_args: Dict
+        @param warmup: Whether to warm the model up as configured in its settings.yml
+        @type warmup: bool
+        @return: The runtime of the model
+        @rtype: ModelRuntime
+        """
+        with self._lock:
+            if name in self._runtimes:
+                raise ValueError(f"The model {name} is already loaded")
+        runtime = ModelRuntime.load(name, self._path(src_dir))
+        with self._lock:
+            scheduler = self._get_scheduler() if dynamic_batch_args is not None else None
+        runtime.init(self._path(model_root), dynamic_batch_args, warmup, scheduler)
+        with self._lock:
+            if name in self._runtimes:
+                runtime.close()
+                raise ValueError(f"The model {name} is already loaded")
+            self._runtimes[name] = runtime
+        return runtime
+
+    def init(self, warmup: bool = True) -> None:
+        """
+        Load the models of the settings that are not loaded yet.
+        """
+        for name, config in self._model_configs.items():
+            if name not in self._runtimes:
+                self.load(name, config['src_dir'], config['model_root'], config.get('dynamic_batch'), warmup)
+
+    def enable_dynamic_batch(self) -> None:
+        """
+        Create the shared worker threads and the dynamic batch models again, without initializing the models again.
+        A worker process forked after the models are loaded calls it, since threads do not survive a fork.
+        """
+        with self._lock:
+            previous = self._scheduler
+            if previous is None:
+                return
+            self._scheduler = SharedBatchScheduler(self.batch_workers)
+            for runtime in self._runtimes.values():
+                if runtime.dynamic_batch_args is not None:
+                    runtime.enable_dynamic_batch(runtime.dynamic_batch_args, self._scheduler)
+        previous.close()
+
+    def get(self, name: str) -> ModelRuntime:
+        runtime = self._runtimes.get(name)
+        if runtime is None:
+            raise ValueError(f"Unknown model {name}. Models: {self.names()}")
+        return runtime
+
+    def names(self) -> List[str]:
+        return list(self._runtimes)
+
+    @property
+    def ready(self) -> bool:
+        """
+        Whether all the models of the settings are loaded and ready.
+        """
+        return all(name in self._runtimes for name in self._model_configs) and \
+            all(runtime.ready for runtime in self._runtimes.values())
+
+    def run(self, name: str, raw_data: Any, is_mop_triggered: bool = False) -> Any:
+        return self.get(name).run(raw_data, is_mop_triggered)
+
+    def run_acs(self, name: str, reqs: Any) -> Any:
+        return self.get(name).run_acs(reqs)
+
+    async def run_async(self, name: str, raw_data: Any, is_mop_triggered: bool = False) -> Any:
+        return await self.get(name).run_async(raw_data, is_mop_triggered)
+
+    async def run_acs_async(self, name: str, reqs: Any) -> Any:
+        return await self.get(name).run_acs_async(reqs)
+
+    def remove(self, name: str) -> None:
+        with self._lock:
+            runtime = self._runtimes.pop(name, None)
+        if runtime is not None:
+            runtime.close()
+
+    def close(self) -> None:
+        with self._lock:
+            runtimes = list(self._runtimes.values())
+            self._runtimes.clear()
+            scheduler, self._scheduler = self._scheduler, None
+        for runtime in runtimes:
+            runtime.close()
+        if scheduler is not None:
+            scheduler.close()
+
+    def get_metrics(self) -> Dict[str, Dict]:
+        """
+        The metrics of each model, see get_metrics() of mop_utils.inference_wrapper.
+        """
+        return {name: runtime.get_metrics() for name, runtime in list(self._runtimes.items())}
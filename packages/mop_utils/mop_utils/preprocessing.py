@@ -0,0 +1,89 @@
+"""
+Parallel image preprocessing stage for image and image+text batches.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from .base_model_wrapper import MopInferenceInput
+
+
+class ImagePreprocessor:
+    """
+    Decodes (and optionally converts and resizes) the images of MOP inputs on a thread pool, so that
+    convert_mop_input_to_model_input() reads ready-to-use arrays with MopInferenceInput.get_image_array().
+    Pillow and NumPy release the GIL for most of the decoding, so threads run it in parallel.
+
+    Inputs submitted when a request is queued are decoded while the previous batch runs inference.
+
+    The thread pool is created on first use in every process: a worker process forked after the pool ran, e.g. by
+    a warmup with images, gets a pool of its own instead of the parent's, whose threads did not survive the fork.
+
+    It is enabled in settings.yml:
+    image_preprocessing:
+      workers: 4
+      mode: RGB          # optional
+      size: [224, 224]   # optional (width, height)
+    """
+
+    def __init__(self, workers: int = 4, mode: Optional[str] = None,
+                 size: Optional[Tuple[int, int]] = None) -> None:
+        if workers <= 0:
+            raise ValueError(f"The number of image preprocessing workers should be positive. Current value: {workers}")
+        self.mode = mode
+        self.size = tuple(size) if size is not None else None
+        self.workers = workers
+        self._lock = Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid: Optional[int] = None
+
+    @classmethod
+    def from_settings(cls, settings: Dict) -> Optional['ImagePreprocessor']:
+        """
+        Build the stage from the 'image_preprocessing' section of settings.yml.
+        @return: None if the stage is not enabled
+        """
+        preprocessing_settings = settings.get('image_preprocessing')
+        if not preprocessing_settings:
+            return None
+        return cls(workers=preprocessing_settings.get('workers', 4),
+                   mode=preprocessing_settings.get('mode'),
+                   size=preprocessing_settings.get('size'))
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    # the executor of the parent process is abandoned, not shut down: its threads do not exist here
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix='mop-image-preprocessing')
+                    self._pid = pid
+        return self._executor
+
+    def submit(self, mop_input: MopInferenceInput) -> MopInferenceInput:
+        """
+        Start decoding the images of a MOP input in the background.
+        """
+        if mop_input.has_images():
+            mop_input.preload_images_async(self.executor, self.mode, self.size)
+        return mop_input
+
+    def prepare(self, mop_inputs: List[MopInferenceInput]) -> None:
+        """
+        Decode the images of a batch in parallel, skipping the inputs already submitted, and wait for them.
+        """
+        for mop_input in mop_inputs:
+            if not mop_input.is_preloading():
+                self.submit(mop_input)
+        for mop_input in mop_inputs:
+            mop_input.wait_images()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False)
+            self._executor = None
+            self._pid = None
@@ -0,0 +1,79 @@
+"""
+Discovery of the model wrapper class of an inference module.
+
+A contributor names the class explicitly, in order of precedence:
+    settings.yml        model_wrapper: ModelWrapper, or module:ClassName for a class of another module
+    decorator           @register_model_wrapper on the class
+
+Inference modules doing neither are scanned for a BaseModelWrapper subclass, as before.
+"""
+import importlib
+import inspect
+from types import ModuleType
+from typing import Dict, List, Type
+
+from .base_model_wrapper import BaseModelWrapper
+
+_registered_wrappers: Dict[str, List[Type[BaseModelWrapper]]] = {}
+
+
+def register_model_wrapper(cls: Type[BaseModelWrapper]) -> Type[BaseModelWrapper]:
+    """
+    Class decorator marking the model wrapper of an inference module, so that it is found without scanning the
+    module.
+
+        @register_model_wrapper
+        class ModelWrapper(BaseModelWrapper):
+            ...
+    """
+    if not (isinstance(cls, type) and issubclass(cls, BaseModelWrapper)):
+        raise TypeError(f"Expected a subclass of BaseModelWrapper, got {cls!r}")
+    wrappers = _registered_wrappers.setdefault(cls.__module__, [])
+    if cls not in wrappers:
+        wrappers.append(cls)
+    return cls
+
+
+def _load_entry_point(module: ModuleType, entry_point: str) -> Type[BaseModelWrapper]:
+    module_name, _, attribute = entry_point.rpartition(':')
+    source = importlib.import_module(module_name) if module_name else module
+    cls = getattr(source, attribute, None)
+    if not (isinstance(cls, type) and issubclass(cls, BaseModelWrapper)):
+        raise ValueError(f"The model_wrapper setting {entry_point} is not a subclass of BaseModelWrapper")
+    return cls
+
+
+def _scan_module(module: ModuleType) -> List[Type[BaseModelWrapper]]:
+    return [value for value in vars(module).values()
+            if isinstance(value, type) and issubclass(value, BaseModelWrapper) and value is not BaseModelWrapper
+            and value.__module__ == module.__name__ and not inspect.isabstract(value)]
+
+
+def find_model_wrapper(module: ModuleType, settings: Dict) -> Type[BaseModelWrapper]:
+    """
+    Find the model wrapper class of an inference module: the model_wrapper setting, else the class registered
+    with @register_model_wrapper, else the BaseModelWrapper subclass defined in the module.
+    @param module: The inference module
+    @type module: ModuleType
+    @param settings: The settings of the model
+    @type settings: Dict
+    @return: The model wrapper class
+    @rtype: Type[BaseModelWrapper]
+    """
+    entry_point = settings.get('model_wrapper')
+    if entry_point:
+        return _load_entry_point(module, entry_point)
+
+    wrappers = _registered_wrappers.get(module.__name__)
+    if wrappers:
+        if len(wrappers) > 1:
+            raise ValueError(f"Several model wrappers registered in the module {module.__name__}: "
+                             f"{[cls.__name__ for cls in wrappers]}. Set model_wrapper in settings.yml")
+        return wrappers[0]
+
+    # the first one, like the scan of the previous versions
+    wrappers = _scan_module(module)
+    if not wrappers:
+        raise ValueError(f"No model wrapper found in the module {module.__name__}. Decorate it with "
+                         f"@register_model_wrapper or set model_wrapper in settings.yml")
+    return wrappers[0]
@@ -0,0 +1,623 @@
+"""
+The runtime of a served model: the MOPInferenceWrapper running the model wrapper, and the dynamic batch model,
+startup profile and readiness around it.
+"""
+import asyncio
+import contextvars
+import functools
+import importlib.util
+import os
+import sys
+from threading import Lock
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from pyraisdk.dynbatch import BaseModel
+
+from .base_model_wrapper import BaseModelWrapper, MopBatchOutputItem, MopInferenceInput
+from .batch_controller import AdaptiveBatchController
+from .batching import BatchConfig, MopDynamicBatchModel, SharedBatchScheduler
+from .cache import MISSING, ResultCache, dedup_key, input_key, nested_dedup_key, same_item
+from .constant import CM_MODEL_WRAPPER_NAME, RUN_MODE_ACS_IMAGE, RUN_MODE_ACS_TEXT, RUN_MODE_MOP, RUN_MODE_RAW
+from .metrics import STAGE_CONVERT_INPUT, STAGE_CONVERT_OUTPUT, STAGE_INFERENCE, STAGE_REQUEST, StageMetrics, Trace, \
+    numeric_metrics
+from .preprocessing import ImagePreprocessor
+from .registry import find_model_wrapper
+from .serialization import to_native
+from .settings import load_settings
+from .startup import STARTUP_DISCOVERY, STARTUP_FIRST_INFERENCE, STARTUP_IMPORT, STARTUP_INIT, STARTUP_INSTANTIATE, \
+    STARTUP_WARMUP, StartupProfile
+from .util import ImageAnalysisInput, MopOutputSchema, TextAnalysisInput, use_output_schema
+from .warmup import WarmupConfig, run_warmup
+
+
+class BatchItem(NamedTuple):
+    """
+    An item queued in the dynamic batch model, carrying the run mode of the request it belongs to:
+    RUN_MODE_RAW, RUN_MODE_MOP, RUN_MODE_ACS_TEXT or RUN_MODE_ACS_IMAGE.
+    """
+    data: Any
+    mode: str
+    trace: Optional[Trace] = None
+
+
+async def run_in_thread(func: Callable, *args, **kwargs) -> Any:
+    """
+    Run a blocking function on the default executor of the running event loop, with the context variables of the
+    caller, e.g. the trace of the request, like asyncio.to_thread() of Python 3.9.
+    """
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(None, call)
+
+
+def get_run_mode(triggered_by_mop: bool) -> str:
+    return RUN_MODE_MOP if triggered_by_mop else RUN_MODE_RAW
+
+
+def get_acs_run_mode(req: Any) -> str:
+    if isinstance(req, TextAnalysisInput):
+        return RUN_MODE_ACS_TEXT
+    if isinstance(req, ImageAnalysisInput):
+        return RUN_MODE_ACS_IMAGE
+    raise TypeError(f"Expected TextAnalysisInput or ImageAnalysisInput, got {type(req).__name__}")
+
+
+# top-level helper module name -> the /src folder of the model it was claimed by
+_helper_module_dirs: Dict[str, str] = {}
+_helper_module_lock = Lock()
+
+
+def _helper_modules(src_dir: str) -> List[str]:
+    """
+    The top-level modules and packages next to the inference module of a model.
+    """
+    names = []
+    for entry in os.scandir(src_dir):
+        stem, ext = os.path.splitext(entry.name)
+        if entry.is_file() and ext == '.py' and stem != CM_MODEL_WRAPPER_NAME:
+            names.append(stem)
+        elif entry.is_dir() and os.path.isfile(os.path.join(entry.path, '__init__.py')):
+            names.append(entry.name)
+    return sorted(names)
+
+
+def _claim_helper_modules(name: str, src_dir: str) -> None:
+    """
+    Claim the helper modules of a model. Since they are imported by their plain name from sys.path, a helper module
+    named like a helper module of another model, or like a module already imported from elsewhere, would silently
+    be shared, so it is rejected.
+    """
+    module_names = _helper_modules(src_dir)
+    with _helper_module_lock:
+        conflicts = {}
+        for module_name in module_names:
+            owner = _helper_module_dirs.get(module_name)
+            if owner is None:
+                module_file = getattr(sys.modules.get(module_name), '__file__', None)
+                if module_file and os.path.commonpath([os.path.abspath(module_file), src_dir]) != src_dir:
+                    owner = module_file
+            if owner is not None and owner != src_dir:
+                conflicts[module_name] = owner
+        if conflicts:
+            raise ValueError(f"The helper modules of model {name} in {src_dir} clash with modules of the same name: "
+                             f"{conflicts}. Rename them, or move them into a package named after the model.")
+        for module_name in module_names:
+            _helper_module_dirs[module_name] = src_dir
+
+
+def _item_outputs(outputs: List[Any]) -> List[Any]:
+    """
+    Build the output dicts of the MopBatchOutputItem views, so that run_batch always returns plain dicts.
+    """
+    return [output.output if isinstance(output, MopBatchOutputItem) else output for output in outputs]
+
+
+class MOPInferenceWrapper:
+    # the monotonic counters of dedup_stats()
+    DEDUP_COUNTERS = ('batches', 'items', 'unique_items')
+
+    def __init__(self, base_model_wrapper: BaseModelWrapper, settings: Optional[Dict] = None) -> None:
+        self.model_wrapper = base_model_wrapper
+        self.settings = settings or {}
+        self.output_schema = MopOutputSchema.from_settings(self.settings)
+        self.result_cache = ResultCache.from_settings(self.settings)
+        self.batch_dedup = self.settings.get('batch_dedup', True)
+        self.image_preprocessor = ImagePreprocessor.from_settings(self.settings)
+        self.metrics = StageMetrics.from_settings(self.settings)
+        self.warmup_config = WarmupConfig.from_settings(self.settings)
+        self.warmup_timings: List[Dict] = []
+        self._dedup_lock = Lock()
+        self._dedup_counters = dict.fromkeys(self.DEDUP_COUNTERS, 0)
+
+    def init(self, model_root: str) -> None:
+        self.model_wrapper.init(model_root)
+
+    def warmup(self, src_dir: str, dynamic_batch_args: Optional[Dict] = None) -> List[Dict]:
+        """
+        Run the warmup inputs through the model at each warmup batch size, if warmup is enabled. The stage metrics
+        are reset afterwards, so that they only cover live traffic.
+        @param src_dir: The folder of settings.yml, the warmup dataset path is relative to
+        @type src_dir: str
+        @param dynamic_batch_args: The dynamic batch args, whose max_batch_size is warmed up by default
+        @type dynamic_batch_args: Dict
+        @return: Timings of each batch size, see run_warmup(), empty if the model accepts none of the synthetic inputs
+        @rtype: List[Dict]
+        """
+        if self.warmup_config.enable is False:
+            return []
+        hook_inputs = self.model_wrapper.get_warmup_inputs()
+        if not self.warmup_config.enable and not hook_inputs:
+            return []
+        inputs = self.warmup_config.load_inputs(hook_inputs, src_dir, self._accepts)
+        if not inputs:
+            return []
+        self.warmup_timings = run_warmup(self, inputs, self.warmup_config.resolve_batch_sizes(dynamic_batch_args),
+                                         self.warmup_config.iterations)
+        self.metrics.reset()
+        return self.warmup_timings
+
+    def _accepts(self, item: Dict) -> bool:
+        try:
+            self._run(item, True)
+        except Exception:
+            return False
+        return True
+
+    def prepare_item(self, item: Any, mode: str) -> Any:
+        """
+        Called when a request item is queued: with the image preprocessing stage enabled, a MOP item is parsed
+        and its images start decoding in the background while the batcher waits.
+        """
+        if self.image_preprocessor is None or mode != RUN_MODE_MOP or isinstance(item, MopInferenceInput):
+            return item
+        return self.image_preprocessor.submit(MopInferenceInput.create(item))
+
+    @staticmethod
+    def _to_mop_input(item: Any) -> MopInferenceInput:
+        return item if isinstance(item, MopInferenceInput) else MopInferenceInput.create(item)
+
+    def run(self, item: Dict, triggered_by_mop) -> Dict:
+        if self.result_cache is None:
+            return self._run(item, triggered_by_mop)
+
+        key = input_key(item, triggered_by_mop)
+        result = self.result_cache.get(key)
+        if result is MISSING:
+            # the native form of a hit, so that the response does not depend on the cache state
+            result = to_native(self._run(item, triggered_by_mop))
+            self.result_cache.put(key, result)
+        return result
+
+    def _run(self, item: Dict, triggered_by_mop) -> Dict:
+        if not triggered_by_mop:
+            with self.metrics.stage(STAGE_INFERENCE):
+                model_output = self.model_wrapper.inference(item)
+            return [model_output]
+        else:
+            with self.metrics.stage(STAGE_CONVERT_INPUT):
+                mop_input = MopInferenceInput.create(item)
+                model_input = self.model_wrapper.convert_mop_input_to_model_input(mop_input)
+            with self.metrics.stage(STAGE_INFERENCE):
+                model_output = self.model_wrapper.inference(model_input)
+            with self.metrics.stage(STAGE_CONVERT_OUTPUT), use_output_schema(self.output_schema):
+                mop_output = self.model_wrapper.convert_model_output_to_mop_output(model_output)
+
+            return mop_output.output
+
+    def run_batch(self, items: List[dict], triggered_by_mop: bool, batch_size: Optional[int] = None) -> List[dict]:
+        if self.result_cache is None:
+            return _item_outputs(self._run_unique_batch(items, triggered_by_mop))
+
+        # only the cache misses reach the model
+        keys = [input_key(item, triggered_by_mop) for item in items]
+        results = [self.result_cache.get(key) for key in keys]
+        miss_indexes = [i for i, result in enumerate(results) if result is MISSING]
+        if miss_indexes:
+            outputs = _item_outputs(self._run_unique_batch([items[i] for i in miss_indexes], triggered_by_mop))
+            if len(outputs) != len(miss_indexes):
+                raise ValueError(f"The batch output size is {len(outputs)} while input size is {len(miss_indexes)}")
+            for i, output in zip(miss_indexes, outputs):
+                results[i] = to_native(output)
+                self.result_cache.put(keys[i], results[i])
+        return results
+
+    def _run_unique_batch(self, items: List[dict], triggered_by_mop: bool) -> List[dict]:
+        """
+        Run the model once per unique item of the batch and fan the results back out in the original order.
+        """
+        if not self.batch_dedup or len(items) < 2:
+            return self._run_batch(items, triggered_by_mop)
+
+        unique_items = []
+        unique_positions = {}
+        positions = []
+        for item in items:
+            key = dedup_key(item, triggered_by_mop)
+            try:
+                position = unique_positions.get(key)
+            except TypeError:
+                key = nested_dedup_key(item)
+                position = unique_positions.get(key)
+            if position is None or not same_item(item, unique_items[position], triggered_by_mop):
+                position = len(unique_items)
+                unique_items.append(item)
+                if key is not None:
+                    unique_positions.setdefault(key, position)
+            positions.append(position)
+
+        with self._dedup_lock:
+            self._dedup_counters['batches'] += 1
+            self._dedup_counters['items'] += len(items)
+            self._dedup_counters['unique_items'] += len(unique_items)
+
+        if len(unique_items) == len(items):
+            return self._run_batch(items, triggered_by_mop)
+
+        outputs = self._run_batch(unique_items, triggered_by_mop)
+        if len(outputs) != len(unique_items):
+            raise ValueError(f"The batch output size is {len(outputs)} while input size is {len(unique_items)}")
+        return [outputs[position] for position in positions]
+
+    def dedup_stats(self) -> Dict:
+        """
+        In-batch deduplication counters. dedup_ratio is the share of items that did not reach the model.
+        """
+        with self._dedup_lock:
+            counters = dict(self._dedup_counters)
+        counters['dedup_ratio'] = 1 - counters['unique_items'] / counters['items'] if counters['items'] else 0.0
+        return counters
+
+    def _run_batch(self, items: List[dict], triggered_by_mop: bool) -> List[dict]:
+        self.metrics.observe_batch_size(len(items))
+        if not triggered_by_mop:
+            with self.metrics.stage(STAGE_INFERENCE):
+                model_outputs = self.model_wrapper.inference_batch(items)
+            return model_outputs
+        else:
+            with self.metrics.stage(STAGE_CONVERT_INPUT):
+                mop_inputs = [self._to_mop_input(item) for item in items]
+                if self.image_preprocessor is not None:
+                    self.image_preprocessor.prepare(mop_inputs)
+                model_inputs = [self.model_wrapper.convert_mop_input_to_model_input(mop_input)
+                                for mop_input in mop_inputs]
+
+            with self.metrics.stage(STAGE_INFERENCE):
+                model_outputs = self.model_wrapper.inference_batch(model_inputs)
+
+            with self.metrics.stage(STAGE_CONVERT_OUTPUT), use_output_schema(self.output_schema):
+                batch_output = self.model_wrapper.convert_model_output_batch_to_mop_output(model_outputs)
+                if batch_output is not None:
+                    if len(batch_output) != len(items):
+                        raise ValueError(f"The batch output size is {len(batch_output)} "
+                                         f"while input size is {len(items)}")
+                    return batch_output.items()
+
+                mop_outputs = [self.model_wrapper.convert_model_output_to_mop_output(model_output).output for
+                               model_output in model_outputs]
+            return mop_outputs
+
+    def run_acs_batch(self, reqs: List[Any], mode: str) -> List[Any]:
+        """
+        Run a batch of ACS requests of one modality through the batch ACS conversion hooks and inference_batch().
+        """
+        if mode == RUN_MODE_ACS_TEXT:
+            convert_requests = self.model_wrapper.convert_acs_text_request_batch_to_model_inference_input
+            convert_outputs = self.model_wrapper.convert_model_inference_output_batch_to_acs_text_response
+        elif mode == RUN_MODE_ACS_IMAGE:
+            convert_requests = self.model_wrapper.convert_acs_image_request_batch_to_model_inference_input
+            convert_outputs = self.model_wrapper.convert_model_inference_output_batch_to_acs_image_response
+        else:
+            raise ValueError(f"Invalid ACS run mode: {mode}")
+
+        self.metrics.observe_batch_size(len(reqs))
+        with self.metrics.stage(STAGE_CONVERT_INPUT):
+            model_inputs = convert_requests(reqs)
+        with self.metrics.stage(STAGE_INFERENCE):
+            model_outputs = self.model_wrapper.inference_batch(model_inputs)
+        with self.metrics.stage(STAGE_CONVERT_OUTPUT):
+            responses = convert_outputs(model_outputs)
+
+        if len(responses) != len(reqs):
+            raise ValueError(f"The batch output size is {len(responses)} while input size is {len(reqs)}")
+        return responses
+
+    def run_mode_batch(self, items: List[Any], mode: str, batch_size: Optional[int] = None) -> List[Any]:
+        if mode == RUN_MODE_MOP or mode == RUN_MODE_RAW:
+            return self.run_batch(items, triggered_by_mop=mode == RUN_MODE_MOP, batch_size=batch_size)
+        return self.run_acs_batch(items, mode)
+
+    def run_mixed_batch(self, items: List[BatchItem], batch_size: Optional[int] = None) -> List[Any]:
+        """
+        Run a batch whose items may come from requests of different run modes, e.g. MOP-triggered, raw and ACS.
+        The batch is split by mode, each sub-batch is run once, and the results are merged back in order.
+        """
+        mode_indexes: Dict[str, List[int]] = {}
+        for i, item in enumerate(items):
+            mode_indexes.setdefault(item.mode, []).append(i)
+        if len(mode_indexes) == 1:
+            return self.run_mode_batch([item.data for item in items], items[0].mode, batch_size=batch_size)
+
+        results = [None] * len(items)
+        for mode, indexes in mode_indexes.items():
+            outputs = self.run_mode_batch([items[i].data for i in indexes], mode, batch_size=batch_size)
+            if len(outputs) != len(indexes):
+                raise ValueError(f"The batch output size is {len(outputs)} while input size is {len(indexes)}")
+            for i, output in zip(indexes, outputs):
+                results[i] = output
+        return results
+
+
+class WrapModel(BaseModel):
+    """
+    The model of the dynamic batch model of a ModelRuntime: runs the queued batch items with run_mixed_batch().
+    """
+
+    def __init__(self, runtime: 'ModelRuntime') -> None:
+        self.runtime = runtime
+
+    def predict(self, items: List[BatchItem]) -> List[Any]:
+        inference_wrapper = self.runtime.inference_wrapper
+        with inference_wrapper.metrics.tracing(*(item.trace for item in items)):
+            return inference_wrapper.run_mixed_batch(items, batch_size=self.runtime.batch_size)
+
+
+class ModelRuntime:
+    """
+    A served model: its MOPInferenceWrapper, dynamic batch model, startup profile and readiness.
+    mop_utils.inference_wrapper serves the model of the inference module with one, and a ModelRegistry serves
+    several models by name with one each.
+    """
+
+    def __init__(self, name: str, model_wrapper: BaseModelWrapper, settings: Optional[Dict] = None,
+                 src_dir: Optional[str] = None, startup_profile: Optional[StartupProfile] = None) -> None:
+        self.name = name
+        self.src_dir = src_dir
+        self.startup_profile = startup_profile or StartupProfile()
+        self.inference_wrapper = MOPInferenceWrapper(model_wrapper, settings)
+        self.batch_model: Optional[MopDynamicBatchModel] = None
+        self.batch_size: Optional[int] = None
+        self.dynamic_batch_args: Optional[Dict] = None
+        self.ready = False
+
+    @classmethod
+    def load(cls, name: str, src_dir: str) -> 'ModelRuntime':
+        """
+        Import the inference module of a model from its /src folder and instantiate its model wrapper. The module is
+        imported under a name of its own, inference_<name>, so that the inference modules of several models do not
+        clash. The helper modules next to it keep their plain names, so a helper module named like one of another
+        model raises ValueError.
+        @param name: Model name
+        @type name: str
+        @param src_dir: The /src folder of the model, with inference.py and settings.yml
+        @type src_dir: str
+        @return: The runtime, to be initialized with init()
+        @rtype: ModelRuntime
+        """
+        src_dir = os.path.abspath(src_dir)
+        module_name = f"{CM_MODEL_WRAPPER_NAME}_{name}"
+        profile = StartupProfile()
+        with profile.phase(STARTUP_IMPORT):
+            spec = importlib.util.spec_from_file_location(module_name,
+                                                          os.path.join(src_dir, f"{CM_MODEL_WRAPPER_NAME}.py"))
+            if spec is None:
+                raise ValueError(f"No {CM_MODEL_WRAPPER_NAME}.py in {src_dir}")
+            _claim_helper_modules(name, src_dir)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[module_name] = module
+            # helper modules next to inference.py stay importable
+            if src_dir not in sys.path:
+                sys.path.append(src_dir)
+            spec.loader.exec_module(module)
+        settings = load_settings(src_dir)
+        with profile.phase(STARTUP_DISCOVERY):
+            wrapper_class = find_model_wrapper(module, settings)
+        with profile.phase(STARTUP_INSTANTIATE):
+            model_wrapper = wrapper_class()
+        return cls(name, model_wrapper, settings, src_dir, profile)
+
+    @property
+    def model_wrapper(self) -> BaseModelWrapper:
+        return self.inference_wrapper.model_wrapper
+
+    @property
+    def metrics(self) -> StageMetrics:
+        return self.inference_wrapper.metrics
+
+    def init(self, model_root: str, dynamic_batch_args: Optional[Dict] = None, warmup: bool = True,
+             scheduler: Optional[SharedBatchScheduler] = None) -> None:
+        """
+        Initialize the model, warm it up and enable dynamic batching, see mop_init().
+        """
+        self.ready = False
+        with self.startup_profile.phase(STARTUP_INIT):
+            self.inference_wrapper.init(model_root)
+        if warmup:
+            self.warmup(dynamic_batch_args)
+        if dynamic_batch_args is not None:
+            self.enable_dynamic_batch(dynamic_batch_args, scheduler)
+        self.ready = True
+
+    def warmup(self, dynamic_batch_args: Optional[Dict] = None) -> List[Dict]:
+        with self.startup_profile.phase(STARTUP_WARMUP):
+            return self.inference_wrapper.warmup(self.src_dir, dynamic_batch_args)
+
+    async def init_async(self, model_root: str, dynamic_batch_args: Optional[Dict] = None, warmup: bool = True,
+                         scheduler: Optional[SharedBatchScheduler] = None) -> None:
+        """
+        init() on a thread, so that the event loop keeps serving, e.g. health checks, while the model loads.
+        """
+        await run_in_thread(self.init, model_root, dynamic_batch_args, warmup, scheduler)
+
+    async def warmup_async(self, dynamic_batch_args: Optional[Dict] = None) -> List[Dict]:
+        return await run_in_thread(self.warmup, dynamic_batch_args)
+
+    def enable_dynamic_batch(self, dynamic_batch_args: Dict,
+                             scheduler: Optional[SharedBatchScheduler] = None) -> MopDynamicBatchModel:
+        """
+        Create the dynamic batch model, replacing the current one, without initializing the model again.
+        With a scheduler, its worker threads run the batches instead of a worker thread of the model.
+        """
+        if self.batch_model is not None:
+            self.batch_model.close()
+        adaptive_args = dynamic_batch_args.get('adaptive')
+        controller = AdaptiveBatchController.from_dict(adaptive_args) if adaptive_args else None
+        metrics = self.metrics if self.metrics.enabled else None
+        model_wrapper = self.model_wrapper
+        self.batch_model = MopDynamicBatchModel(WrapModel(self), BatchConfig.from_dict(dynamic_batch_args),
+                                                controller,
+                                                bucket_key=lambda item: model_wrapper.get_batch_bucket_key(item.data),
+                                                metrics=metrics, scheduler=scheduler)
+        self.batch_size = self.batch_model.max_batch_size
+        self.dynamic_batch_args = dynamic_batch_args
+        return self.batch_model
+
+    def update_batch_config(self, **changes) -> BatchConfig:
+        if self.batch_model is None:
+            raise ValueError("Dynamic batching is not enabled. Call mop_init() with dynamic_batch_args first.")
+        config = self.batch_model.update_config(**changes)
+        self.batch_size = config.max_batch_size
+        return config
+
+    def close(self) -> None:
+        if self.batch_model is not None:
+            self.batch_model.close()
+            self.batch_model = None
+        if self.inference_wrapper.image_preprocessor is not None:
+            self.inference_wrapper.image_preprocessor.close()
+
+    def _prepare_batch_item(self, batch_item: BatchItem) -> BatchItem:
+        return batch_item._replace(data=self.inference_wrapper.prepare_item(batch_item.data, batch_item.mode))
+
+    def _batch_item_preparer(self) -> Optional[Callable[[BatchItem], BatchItem]]:
+        # the images of an item start decoding once the dynamic batch model admits it
+        return self._prepare_batch_item if self.inference_wrapper.image_preprocessor is not None else None
+
+    def run(self, raw_data: Any, is_mop_triggered: bool = False) -> Any:
+        """
+        Run a request, see mop_run().
+        """
+        metrics = self.metrics
+        with self.startup_profile.once(STARTUP_FIRST_INFERENCE):
+            if not metrics.enabled:
+                return self._run(raw_data, is_mop_triggered)
+            trace = metrics.start_trace(mode=get_run_mode(is_mop_triggered))
+            try:
+                with metrics.tracing(trace), metrics.stage(STAGE_REQUEST):
+                    return self._run(raw_data, is_mop_triggered, trace)
+            finally:
+                metrics.finish_trace(trace)
+
+    def _run(self, raw_data: Any, is_mop_triggered: bool, trace: Optional[Trace] = None) -> Any:
+        if self.batch_model is not None:
+            raw_data = raw_data if isinstance(raw_data, list) else [raw_data]
+            mode = get_run_mode(is_mop_triggered)
+            batch_items = [BatchItem(item, mode, trace) for item in raw_data]
+            inference_result = self.batch_model.predict(batch_items, prepare=self._batch_item_preparer())
+            return inference_result
+        if isinstance(raw_data, dict):
+            inference_result = self.inference_wrapper.run(raw_data, is_mop_triggered)
+            return inference_result
+        if isinstance(raw_data, list):
+            inference_result = self.inference_wrapper.run_batch(raw_data, triggered_by_mop=is_mop_triggered)
+            return inference_result
+        raise Exception("Invalid input data format")
+
+    async def run_async(self, raw_data: Any, is_mop_triggered: bool = False) -> Any:
+        """
+        Run a request on the running event loop, see mop_run_async().
+        """
+        metrics = self.metrics
+        with self.startup_profile.once(STARTUP_FIRST_INFERENCE):
+            if not metrics.enabled:
+                return await self._run_async(raw_data, is_mop_triggered)
+            trace = metrics.start_trace(mode=get_run_mode(is_mop_triggered))
+            try:
+                with metrics.tracing(trace), metrics.stage(STAGE_REQUEST):
+                    return await self._run_async(raw_data, is_mop_triggered, trace)
+            finally:
+                metrics.finish_trace(trace)
+
+    async def _run_async(self, raw_data: Any, is_mop_triggered: bool, trace: Optional[Trace] = None) -> Any:
+        if self.batch_model is None:
+            # without dynamic batching the model runs on the calling thread, so it runs on the executor instead
+            return await run_in_thread(self._run, raw_data, is_mop_triggered, trace)
+        raw_data = raw_data if isinstance(raw_data, list) else [raw_data]
+        mode = get_run_mode(is_mop_triggered)
+        batch_items = [BatchItem(item, mode, trace) for item in raw_data]
+        return await self.batch_model.predict_async(batch_items, prepare=self._batch_item_preparer())
+
+    def run_acs(self, reqs: Any) -> Any:
+        """
+        Run an ACS request or a list of ACS requests, see mop_run_acs().
+        """
+        metrics = self.metrics
+        with self.startup_profile.once(STARTUP_FIRST_INFERENCE):
+            if not metrics.enabled:
+                return self._run_acs(reqs)
+            trace = metrics.start_trace(mode='acs')
+            try:
+                with metrics.tracing(trace), metrics.stage(STAGE_REQUEST):
+                    return self._run_acs(reqs, trace)
+            finally:
+                metrics.finish_trace(trace)
+
+    def _run_acs(self, reqs: Any, trace: Optional[Trace] = None) -> Any:
+        is_list = isinstance(reqs, list)
+        batch_items = [BatchItem(req, get_acs_run_mode(req), trace) for req in (reqs if is_list else [reqs])]
+        if self.batch_model is not None:
+            responses = self.batch_model.predict(batch_items)
+        else:
+            responses = self.inference_wrapper.run_mixed_batch(batch_items, batch_size=self.batch_size)
+        return responses if is_list else responses[0]
+
+    async def run_acs_async(self, reqs: Any) -> Any:
+        """
+        Run an ACS request or a list of ACS requests on the running event loop, see mop_run_acs_async().
+        """
+        metrics = self.metrics
+        with self.startup_profile.once(STARTUP_FIRST_INFERENCE):
+            if not metrics.enabled:
+                return await self._run_acs_async(reqs)
+            trace = metrics.start_trace(mode='acs')
+            try:
+                with metrics.tracing(trace), metrics.stage(STAGE_REQUEST):
+                    return await self._run_acs_async(reqs, trace)
+            finally:
+                metrics.finish_trace(trace)
+
+    async def _run_acs_async(self, reqs: Any, trace: Optional[Trace] = None) -> Any:
+        if self.batch_model is None:
+            return await run_in_thread(self._run_acs, reqs, trace)
+        is_list = isinstance(reqs, list)
+        batch_items = [BatchItem(req, get_acs_run_mode(req), trace) for req in (reqs if is_list else [reqs])]
+        responses = await self.batch_model.predict_async(batch_items)
+        return responses if is_list else responses[0]
+
+    def batch_stats(self) -> Optional[Dict]:
+        return self.batch_model.stats() if self.batch_model is not None else None
+
+    def cache_stats(self) -> Optional[Dict]:
+        result_cache = self.inference_wrapper.result_cache
+        return result_cache.stats() if result_cache is not None else None
+
+    def get_metrics(self) -> Dict:
+        return {
+            'metrics': self.metrics.snapshot(),
+            'batch': self.batch_stats(),
+            'dedup': self.inference_wrapper.dedup_stats(),
+            'cache': self.cache_stats(),
+            'startup': self.startup_profile.to_dict(),
+            'warmup': self.inference_wrapper.warmup_timings,
+        }
+
+    def get_metrics_text(self) -> str:
+        gauges = {}
+        counters = {}
+        for prefix, stats, counter_keys in (
+                ('batch', self.batch_stats(), MopDynamicBatchModel.COUNTERS),
+                ('dedup', self.inference_wrapper.dedup_stats(), MOPInferenceWrapper.DEDUP_COUNTERS),
+                ('cache', self.cache_stats(), ResultCache.COUNTERS),
+                ('startup', self.startup_profile.to_dict(), ())):
+            stats_gauges, stats_counters = numeric_metrics(prefix, stats, counter_keys)
+            gauges.update(stats_gauges)
+            counters.update(stats_counters)
+        return self.metrics.to_prometheus(gauges, counters)
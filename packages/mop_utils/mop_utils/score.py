@@ -0,0 +1,378 @@
+"""
+Offline batch scoring of a dataset file, streamed through the model in chunks.
+
+    python -m mop_utils.score --src-dir ./model/src --model-root ./model --dataset ./dataset.csv --output scores.jsonl
+
+The rows of a tab delimited (or --delimiter) dataset file, or of a JSONL file with the same column names, are mapped
+to MOP inputs (text, base64_image, image_width_pixels, image_height_pixels and image_0 to image_19) and run through
+run_batch() of the inference wrapper, batch_size rows at a time. Reading and decoding, inference and writing run on
+their own threads with bounded queues between them, so memory stays flat whatever the size of the dataset.
+
+The results are written as they come:
+    .jsonl      one {"row": ..., "output": ...} or {"row": ..., "error": ...} object per line
+    otherwise   a directory of Parquet files (requires pyarrow) with one column per flattened output value, a row
+                group per batch and rows_per_file rows per file
+
+With --resume, the rows already in the output are skipped and the new results are appended.
+"""
+import argparse
+import glob
+import itertools
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .base_model_wrapper import MopInferenceInput
+from .constant import RUN_MODE_MOP, RUN_MODE_RAW
+from .dataset import DEFAULT_DELIMITER, check_data_columns, read_records, row_to_mop_input
+from .serialization import dumps, to_native
+
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_PREFETCH = 4
+DEFAULT_ROWS_PER_FILE = 10000
+
+_END = object()
+
+
+class JsonlResultWriter:
+    """
+    Appends the results to a JSONL file, one line per row, flushed after every batch.
+    """
+
+    def __init__(self, path: str, resume: bool = False) -> None:
+        self.path = path
+        self._completed = self._truncate_partial_line() if resume and os.path.exists(path) else 0
+        self._file = open(path, 'ab' if resume else 'wb')
+
+    def _truncate_partial_line(self) -> int:
+        # a run killed while writing may leave a partial last line, which is dropped and scored again
+        with open(self.path, 'rb+') as f:
+            lines = 0
+            end = 0
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                lines += 1
+                end += len(line)
+            f.truncate(end)
+        return lines
+
+    def completed_rows(self) -> int:
+        return self._completed
+
+    def write(self, results: List[Dict]) -> None:
+        self._file.write(b''.join(dumps(result) + b'\n' for result in results))
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ParquetResultWriter:
+    """
+    Writes the results to a directory of Parquet files of up to rows_per_file rows, one row group per batch, so that
+    only the batch being written is held in memory. A file is renamed to its final name once complete or when the
+    writer is closed, e.g. on an interrupt, so a killed run leaves only complete files behind.
+
+    All the files share one schema, taken from the first batch with a successful row, or from the existing files
+    when resuming. A row without some output value gets a null, and an output value missing from the schema is
+    dropped.
+    """
+
+    def __init__(self, path: str, resume: bool = False, rows_per_file: int = DEFAULT_ROWS_PER_FILE) -> None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError("pyarrow is required to write Parquet: pip install mop_utils[parquet]") from e
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.path = path
+        self.rows_per_file = rows_per_file
+        os.makedirs(path, exist_ok=True)
+        for tmp_file in glob.glob(os.path.join(path, '*.parquet.tmp')):
+            os.remove(tmp_file)
+        files = sorted(glob.glob(os.path.join(path, 'part-*.parquet')))
+        if files and not resume:
+            raise ValueError(f"The output directory {path} already has results. Use --resume to continue the run")
+        self._completed = sum(self._pq.ParquetFile(file).metadata.num_rows for file in files)
+        self._file_index = len(files)
+        self._schema = self._pq.read_schema(files[0]) if files else None
+        # rows of the batches without any successful row, held until the schema is known
+        self._pending: List[Dict] = []
+        self._writer = None
+        self._file_rows = 0
+
+    def completed_rows(self) -> int:
+        return self._completed
+
+    def _infer_schema(self, rows: List[Dict]):
+        schema = self._pa.Table.from_pylist(rows).schema
+        # a column whose values are all null in the first batch, like the error column, is typed as string
+        return self._pa.schema([field.with_type(self._pa.string()) if self._pa.types.is_null(field.type) else field
+                                for field in schema])
+
+    def write(self, results: List[Dict]) -> None:
+        rows = []
+        for result in results:
+            row = _flatten(result)
+            row.setdefault('error', None)
+            rows.append(row)
+        if self._schema is None:
+            if not any('output' in result for result in results):
+                self._pending.extend(rows)
+                return
+            self._schema = self._infer_schema([row for row, result in zip(rows, results) if 'output' in result])
+        if self._pending:
+            rows = self._pending + rows
+            self._pending = []
+        self._write_rows(rows)
+
+    def _write_rows(self, rows: List[Dict]) -> None:
+        while rows:
+            if self._writer is None:
+                self._writer = self._pq.ParquetWriter(self._file_path() + '.tmp', self._schema)
+            count = min(len(rows), self.rows_per_file - self._file_rows)
+            self._writer.write_table(self._pa.Table.from_pylist(rows[:count], schema=self._schema))
+            self._file_rows += count
+            rows = rows[count:]
+            if self._file_rows >= self.rows_per_file:
+                self._finish_file()
+
+    def _file_path(self) -> str:
+        return os.path.join(self.path, f"part-{self._file_index:05d}.parquet")
+
+    def _finish_file(self) -> None:
+        self._writer.close()
+        os.replace(self._file_path() + '.tmp', self._file_path())
+        self._writer = None
+        self._file_rows = 0
+        self._file_index += 1
+
+    def close(self) -> None:
+        if self._pending:
+            # no row succeeded: the files only have the row, id and error columns
+            self._schema = self._infer_schema(self._pending)
+            rows, self._pending = self._pending, []
+            self._write_rows(rows)
+        if self._writer is not None:
+            self._finish_file()
+
+
+def _flatten(obj: Any, prefix: str = '') -> Dict:
+    if not isinstance(obj, dict):
+        return {prefix or 'output': json.dumps(obj) if isinstance(obj, list) else obj}
+    flat = {}
+    for key, value in obj.items():
+        name = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name))
+        else:
+            flat[name] = json.dumps(value) if isinstance(value, list) else value
+    return flat
+
+
+def _chunks(iterable: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _put(q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+class BatchScorer:
+    """
+    Streams dataset rows through run_batch() of a MOPInferenceWrapper, with reading and decoding, inference and
+    writing overlapped on their own threads.
+    """
+
+    def __init__(self, inference_wrapper, writer, batch_size: int = DEFAULT_BATCH_SIZE,
+                 prefetch: int = DEFAULT_PREFETCH, mop_triggered: bool = True, id_column: Optional[str] = None,
+                 verbose: bool = False) -> None:
+        self.inference_wrapper = inference_wrapper
+        self.writer = writer
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+        self.mode = RUN_MODE_MOP if mop_triggered else RUN_MODE_RAW
+        self.id_column = id_column
+        self.verbose = verbose
+
+    def _prepare(self, row: Dict) -> Any:
+        if self.mode == RUN_MODE_RAW:
+            return row
+        item = self.inference_wrapper.prepare_item(row_to_mop_input(row), self.mode)
+        return item if isinstance(item, MopInferenceInput) else MopInferenceInput.create(item)
+
+    def _read(self, rows: Iterable[Dict], start: int, out_q: queue.Queue, stop: threading.Event) -> None:
+        try:
+            index = start
+            for chunk in _chunks(rows, self.batch_size):
+                items = []
+                for row in chunk:
+                    try:
+                        items.append(self._prepare(row))
+                    except Exception as e:
+                        items.append(e)
+                ids = [row.get(self.id_column) for row in chunk] if self.id_column else None
+                if not _put(out_q, (index, items, ids), stop):
+                    return
+                index += len(chunk)
+            _put(out_q, _END, stop)
+        except Exception as e:
+            _put(out_q, e, stop)
+
+    def _write(self, in_q: queue.Queue, errors: List[Exception]) -> None:
+        while True:
+            results = in_q.get()
+            if results is _END:
+                return
+            if errors:
+                continue
+            try:
+                self.writer.write(results)
+            except Exception as e:
+                errors.append(e)
+
+    def _run_batch(self, items: List[Any]) -> List[Tuple[Any, Optional[str]]]:
+        valid = [i for i, item in enumerate(items) if not isinstance(item, Exception)]
+        outcomes: List[Tuple[Any, Optional[str]]] = [
+            (None, f"{type(item).__name__}: {item}") if isinstance(item, Exception) else (None, None)
+            for item in items]
+        try:
+            outputs = self.inference_wrapper.run_batch([items[i] for i in valid],
+                                                       triggered_by_mop=self.mode == RUN_MODE_MOP,
+                                                       batch_size=self.batch_size)
+            for i, output in zip(valid, outputs):
+                outcomes[i] = (output, None)
+        except Exception:
+            # find the failing rows: score the batch again one row at a time
+            for i in valid:
+                try:
+                    outcomes[i] = (self.inference_wrapper.run_batch(
+                        [items[i]], triggered_by_mop=self.mode == RUN_MODE_MOP, batch_size=1)[0], None)
+                except Exception as e:
+                    outcomes[i] = (None, f"{type(e).__name__}: {e}")
+        return outcomes
+
+    def score(self, rows: Iterable[Dict]) -> Dict:
+        """
+        Score the rows that are not in the output yet.
+        @param rows: Dataset rows, e.g. read_records(path)
+        @type rows: Iterable[Dict]
+        @return: Row counts of the run: skipped, scored and failed
+        @rtype: Dict
+        """
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is not None:
+            # a dataset that maps to no MOP input fails here rather than as an error on every row
+            if self.mode == RUN_MODE_MOP:
+                check_data_columns(list(first))
+            rows = itertools.chain((first,), rows)
+        start = self.writer.completed_rows()
+        rows = itertools.islice(rows, start, None)
+        stop = threading.Event()
+        read_q: queue.Queue = queue.Queue(maxsize=self.prefetch)
+        write_q: queue.Queue = queue.Queue(maxsize=self.prefetch)
+        write_errors: List[Exception] = []
+        reader = threading.Thread(target=self._read, args=(rows, start, read_q, stop), daemon=True)
+        writer = threading.Thread(target=self._write, args=(write_q, write_errors), daemon=True)
+        reader.start()
+        writer.start()
+
+        counts = {'skipped': start, 'scored': 0, 'failed': 0}
+        started = time.perf_counter()
+        try:
+            while not write_errors:
+                batch = read_q.get()
+                if batch is _END:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                index, items, ids = batch
+                results = []
+                for offset, (output, error) in enumerate(self._run_batch(items)):
+                    result = {'row': index + offset}
+                    if ids is not None:
+                        result[self.id_column] = ids[offset]
+                    if error is None:
+                        result['output'] = to_native(output)
+                    else:
+                        result['error'] = error
+                        counts['failed'] += 1
+                    results.append(result)
+                counts['scored'] += len(results)
+                write_q.put(results)
+                if self.verbose:
+                    elapsed = time.perf_counter() - started
+                    print(f"\rscored {counts['scored']} rows, {counts['scored'] / elapsed:.1f} rows/s, "
+                          f"{counts['failed']} failed", end='', file=sys.stderr, flush=True)
+        finally:
+            stop.set()
+            write_q.put(_END)
+            writer.join()
+            if self.verbose:
+                print(file=sys.stderr)
+        if write_errors:
+            raise write_errors[0]
+        return counts
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Score a dataset file with a MOP model.")
+    parser.add_argument('--model-root', required=True, help="Root where the model files exist")
+    parser.add_argument('--src-dir', help="Directory of the inference module of the model")
+    parser.add_argument('--dataset', required=True, help="Dataset file, delimited or .jsonl")
+    parser.add_argument('--delimiter', default=DEFAULT_DELIMITER, help="Column delimiter of the dataset")
+    parser.add_argument('--output', required=True,
+                        help="Output .jsonl file, or a directory of Parquet files for any other path")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Rows per inference batch")
+    parser.add_argument('--prefetch', type=int, default=DEFAULT_PREFETCH, help="Batches read ahead of inference")
+    parser.add_argument('--rows-per-file', type=int, default=DEFAULT_ROWS_PER_FILE, help="Rows per Parquet file")
+    parser.add_argument('--id-column', help="Dataset column copied to the results, e.g. file_name")
+    parser.add_argument('--raw', action='store_true', help="Pass the rows to the model as raw model inputs")
+    parser.add_argument('--resume', action='store_true', help="Skip the rows already in the output")
+    args = parser.parse_args(argv)
+
+    if not args.raw:
+        # checked before the model is loaded
+        records = read_records(args.dataset, args.delimiter)
+        first = next(records, None)
+        records.close()
+        if first is not None:
+            check_data_columns(list(first), args.dataset)
+
+    from .server import load_inference_wrapper
+    inference_wrapper = load_inference_wrapper(args.src_dir)
+    inference_wrapper.mop_init(args.model_root, None)
+
+    if args.output.lower().endswith('.jsonl'):
+        writer = JsonlResultWriter(args.output, args.resume)
+    else:
+        writer = ParquetResultWriter(args.output, args.resume, args.rows_per_file)
+    try:
+        scorer = BatchScorer(inference_wrapper.inference_wrapper, writer, args.batch_size, args.prefetch,
+                             not args.raw, args.id_column, verbose=True)
+        counts = scorer.score(read_records(args.dataset, args.delimiter))
+    finally:
+        writer.close()
+    print(json.dumps(counts))
+
+
+if __name__ == "__main__":
+    main()
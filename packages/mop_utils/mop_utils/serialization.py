@@ -0,0 +1,103 @@
+"""
+Response serialization for MOP inference results.
+"""
+import json
+from typing import Any
+
+import numpy as np
+
+from .base_model_wrapper import MopBatchOutputItem
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_NATIVE_TYPES = (str, int, float, bool, type(None))
+
+
+def to_native(obj: Any) -> Any:
+    """
+    Convert an inference result to native Python types in one recursive pass:
+    NumPy scalars and arrays become numbers and lists, batch output items, objects with a to_dict() method and
+    plain objects become dicts.
+    @param obj: Inference result
+    @type obj: Any
+    @return: Inference result made of dict, list, str, int, float, bool and None only
+    @rtype: Any
+    """
+    obj_type = type(obj)
+    if obj_type in _NATIVE_TYPES:
+        return obj
+    if obj_type is dict:
+        return {_native_key(k): to_native(v) for k, v in obj.items()}
+    if obj_type is list or obj_type is tuple:
+        return [to_native(item) for item in obj]
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, MopBatchOutputItem):
+        return obj.output
+    if isinstance(obj, dict):
+        return {_native_key(k): to_native(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_native(item) for item in obj]
+    if hasattr(obj, 'to_dict'):
+        return to_native(obj.to_dict())
+    if hasattr(obj, '__dict__'):
+        return to_native(vars(obj))
+    return obj
+
+
+def _native_key(key: Any) -> Any:
+    return key.item() if isinstance(key, np.generic) else key
+
+
+class NumpyJsonEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, np.integer):
+            return int(obj)
+        if isinstance(obj, np.floating):
+            return float(obj)
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.bool_):
+            return bool(obj)
+        if isinstance(obj, MopBatchOutputItem):
+            return obj.output
+        if hasattr(obj, 'to_dict'):
+            return obj.to_dict()
+        if hasattr(obj, '__dict__'):
+            return vars(obj)
+        return json.JSONEncoder.default(self, obj)
+
+
+def _orjson_default(obj: Any) -> Any:
+    native = to_native(obj)
+    if native is obj:
+        raise TypeError(f"Type is not JSON serializable: {type(obj)}")
+    return native
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Serialize an inference result to JSON bytes in a single pass.
+    orjson is used when it is installed, otherwise the standard json module with NumpyJsonEncoder.
+    @param obj: Inference result
+    @type obj: Any
+    @return: JSON bytes
+    @rtype: bytes
+    """
+    try:
+        return _dumps(obj)
+    except TypeError:
+        # Neither backend accepts NumPy scalars as dict keys, only to_native() converts them.
+        return _dumps(to_native(obj))
+
+
+def _dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_orjson_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, cls=NumpyJsonEncoder).encode('utf-8')
@@ -0,0 +1,437 @@
+"""
+Local HTTP server around mop_init() and mop_run(), to reproduce the single-machine serving of MOP before uploading.
+
+    python -m mop_utils.server --src-dir ./model/src --model-root ./model
+
+The model is initialized once. With more than one worker, the worker processes are forked after the init, so the
+model weights are shared copy-on-write, and every worker starts its own dynamic batch model.
+
+Endpoints:
+    POST /score     The JSON body is passed to mop_run(). Add ?mop=0 to run the raw model input, ?model=<name> to run
+                    a model of the model registry. Invalid inputs get 400, requests shed by a full queue 429.
+    GET  /health    200 once the model is initialized, 503 before.
+    GET  /metrics   Server counters and get_metrics() of the worker as JSON, or with ?format=prometheus, in the
+                    Prometheus text format.
+
+The server is configured in the settings.yml of the model, e.g.
+
+    server:
+      host: 127.0.0.1
+      port: 8080
+      workers: 2
+      threads: 16
+      frontend: asyncio   # or sync
+      dynamic_batch:
+        max_batch_size: 16
+        idle_batch_size: 4
+        max_batch_interval: 0.01
+"""
+import argparse
+import asyncio
+import gc
+import importlib
+import json
+import os
+import signal
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, fields, replace
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Lock
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from pyraisdk.dynbatch import PredictTimeoutError
+
+from .base_model_wrapper import MopInferenceInput
+from .batching import OverloadedError
+from .metrics import numeric_metrics, prometheus_lines
+
+FRONTEND_SYNC = "sync"
+FRONTEND_ASYNCIO = "asyncio"
+
+_JSON_CONTENT_TYPE = "application/json"
+_PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+@dataclass(frozen=True)
+class ServerConfig:
+    """
+    Config of the local server.
+
+    host: Host to listen on.
+    port: Port to listen on.
+    workers: Number of worker processes. More than one worker requires os.fork().
+    threads: Number of threads of each worker serving requests.
+    frontend: 'sync' to serve every connection on a thread, 'asyncio' to serve the connections on an event loop
+        with mop_run_async(), the threads running the model only when dynamic batching is disabled.
+    dynamic_batch: Dynamic batch args of mop_init(), None to disable dynamic batching.
+    """
+    host: str = "127.0.0.1"
+    port: int = 8080
+    workers: int = 1
+    threads: int = 8
+    frontend: str = FRONTEND_SYNC
+    dynamic_batch: Optional[Dict] = None
+
+    def __post_init__(self):
+        if self.workers <= 0:
+            raise ValueError(f"Invalid workers value {self.workers}")
+        if self.threads <= 0:
+            raise ValueError(f"Invalid threads value {self.threads}")
+        if self.frontend not in (FRONTEND_SYNC, FRONTEND_ASYNCIO):
+            raise ValueError(f"The frontend should be {FRONTEND_SYNC} or {FRONTEND_ASYNCIO}. "
+                             f"Current value: {self.frontend}")
+        if self.workers > 1 and not hasattr(os, 'fork'):
+            raise ValueError("More than one worker requires os.fork(), which is not available on this platform")
+
+    @classmethod
+    def from_dict(cls, args: Dict) -> 'ServerConfig':
+        names = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in args.items() if k in names and v is not None})
+
+    @classmethod
+    def from_settings(cls, settings: Dict) -> 'ServerConfig':
+        return cls.from_dict(settings.get('server') or {})
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+class _ServerState:
+    def __init__(self, inference_wrapper) -> None:
+        self.inference_wrapper = inference_wrapper
+        self.ready = False
+        self.started = time.time()
+        self._lock = Lock()
+        self._counters = {'requests': 0, 'errors': 0, 'overloaded': 0, 'timeouts': 0}
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def server_stats(self) -> Dict:
+        with self._lock:
+            counters = dict(self._counters)
+        return {'pid': os.getpid(), 'uptime': time.time() - self.started, **counters}
+
+    def metrics(self, query: str) -> Tuple[int, bytes, str]:
+        if parse_qs(query).get('format', [''])[-1] == 'prometheus':
+            gauges, counters = numeric_metrics('server', self.server_stats(), tuple(self._counters))
+            lines = prometheus_lines('mop', gauges, counters)
+            return HTTPStatus.OK, (self.inference_wrapper.get_metrics_text() + '\n'.join(lines) + '\n').encode(), \
+                _PROMETHEUS_CONTENT_TYPE
+        metrics = {'server': self.server_stats(), **self.inference_wrapper.get_metrics()}
+        return HTTPStatus.OK, self.inference_wrapper.build_response_bytes(metrics), _JSON_CONTENT_TYPE
+
+    def _parse_score(self, query: str, body: bytes) -> Tuple[Optional[Tuple[int, bytes, str]], Any, bool,
+                                                             Optional[str]]:
+        """
+        The error response of an invalid /score request, or None and the request data, MOP flag and model name.
+        """
+        self.count('requests')
+        try:
+            raw_data = json.loads(body)
+        except ValueError as ex:
+            self.count('errors')
+            return _error(HTTPStatus.BAD_REQUEST, f"Invalid JSON body: {ex}"), None, False, None
+        params = parse_qs(query)
+        mop_triggered = params.get('mop', ['1'])[-1].lower() not in ('0', 'false')
+        model_name = params.get('model', [None])[-1]
+        if model_name is not None and model_name != self.inference_wrapper.runtime.name and \
+                model_name not in self.inference_wrapper.model_registry.names():
+            self.count('errors')
+            return _error(HTTPStatus.NOT_FOUND, f"Unknown model {model_name}"), None, False, None
+        return None, raw_data, mop_triggered, model_name
+
+    def _score_error(self, ex: Exception, raw_data: Any, mop_triggered: bool) -> Tuple[int, bytes, str]:
+        status = error_status(ex, raw_data, mop_triggered)
+        if status == HTTPStatus.TOO_MANY_REQUESTS:
+            self.count('overloaded')
+            return _error(status, str(ex))
+        if status == HTTPStatus.GATEWAY_TIMEOUT:
+            self.count('timeouts')
+            return _error(status, str(ex))
+        self.count('errors')
+        return _error(status, f"{type(ex).__name__}: {ex}")
+
+    def score(self, query: str, body: bytes) -> Tuple[int, bytes, str]:
+        error, raw_data, mop_triggered, model_name = self._parse_score(query, body)
+        if error is not None:
+            return error
+        try:
+            result = self.inference_wrapper.mop_run(raw_data, mop_triggered, model_name)
+            return HTTPStatus.OK, self.inference_wrapper.build_response_bytes(result), _JSON_CONTENT_TYPE
+        except Exception as ex:
+            return self._score_error(ex, raw_data, mop_triggered)
+
+    async def score_async(self, query: str, body: bytes) -> Tuple[int, bytes, str]:
+        error, raw_data, mop_triggered, model_name = self._parse_score(query, body)
+        if error is not None:
+            return error
+        try:
+            result = await self.inference_wrapper.mop_run_async(raw_data, mop_triggered, model_name)
+            return HTTPStatus.OK, self.inference_wrapper.build_response_bytes(result), _JSON_CONTENT_TYPE
+        except Exception as ex:
+            return self._score_error(ex, raw_data, mop_triggered)
+
+    def _check_score(self, method: str) -> Optional[Tuple[int, bytes, str]]:
+        if method != 'POST':
+            return _error(HTTPStatus.METHOD_NOT_ALLOWED, "Use POST for /score")
+        if not self.ready:
+            return _error(HTTPStatus.SERVICE_UNAVAILABLE, "The model is not initialized")
+        return None
+
+    def route(self, method: str, target: str, body: bytes) -> Tuple[int, bytes, str]:
+        url = urlsplit(target)
+        if url.path == '/score':
+            return self._check_score(method) or self.score(url.query, body)
+        if url.path == '/health':
+            if not self.ready:
+                return _error(HTTPStatus.SERVICE_UNAVAILABLE, "The model is not initialized")
+            return HTTPStatus.OK, json.dumps({'status': 'ok', 'pid': os.getpid()}).encode(), _JSON_CONTENT_TYPE
+        if url.path == '/metrics':
+            return self.metrics(url.query)
+        return _error(HTTPStatus.NOT_FOUND, f"Unknown path {url.path}")
+
+
+def _is_invalid_input(raw_data: Any, mop_triggered: bool) -> bool:
+    if not isinstance(raw_data, (dict, list)):
+        return True
+    if not mop_triggered:
+        return False
+    try:
+        for item in raw_data if isinstance(raw_data, list) else [raw_data]:
+            MopInferenceInput.create(item)
+    except (AttributeError, TypeError, ValueError):
+        return True
+    return False
+
+
+def error_status(ex: Exception, raw_data: Any, mop_triggered: bool) -> HTTPStatus:
+    """
+    The HTTP status of a request that mop_run() failed on: 429 when the dynamic batch queue is full, 504 when the
+    request timed out, 400 when the request data is not a valid input and 500 otherwise. The request data is only
+    checked after a failure, so valid requests are not parsed twice.
+    """
+    if isinstance(ex, OverloadedError):
+        return HTTPStatus.TOO_MANY_REQUESTS
+    if isinstance(ex, PredictTimeoutError):
+        return HTTPStatus.GATEWAY_TIMEOUT
+    if _is_invalid_input(raw_data, mop_triggered):
+        return HTTPStatus.BAD_REQUEST
+    return HTTPStatus.INTERNAL_SERVER_ERROR
+
+
+def _error(status: HTTPStatus, message: str) -> Tuple[int, bytes, str]:
+    return status, json.dumps({'error': message}).encode(), _JSON_CONTENT_TYPE
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state: _ServerState = None
+
+    def _handle(self) -> None:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status, payload, content_type = self.state.route(self.command, self.path, body)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class _PooledHTTPServer(HTTPServer):
+    """
+    HTTP server serving each connection on a fixed size thread pool, instead of a new thread per connection.
+    """
+
+    def __init__(self, sock: socket.socket, handler_class, threads: int) -> None:
+        super().__init__(sock.getsockname()[:2], handler_class, bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix='mop-server')
+
+    def process_request(self, request, client_address) -> None:
+        self._executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def _format_response(status: int, payload: bytes, content_type: str, keep_alive: bool) -> bytes:
+    head = (f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode('latin-1') + payload
+
+
+async def _handle_connection(state: _ServerState, reader: asyncio.StreamReader,
+                             writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, target, version = request_line.decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length') or 0)
+            body = await reader.readexactly(length) if length else b''
+
+            url = urlsplit(target)
+            if url.path == '/score':
+                # mop_run_async() awaits the batch of the request on the event loop, without holding a thread,
+                # and runs the model on the thread pool when dynamic batching is disabled.
+                status, payload, content_type = state._check_score(method) or \
+                    await state.score_async(url.query, body)
+            else:
+                status, payload, content_type = state.route(method, target, body)
+
+            keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+            writer.write(_format_response(status, payload, content_type, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _serve_asyncio(state: _ServerState, sock: socket.socket, threads: int) -> None:
+    # the default executor runs the blocking calls of mop_run_async(), e.g. the model without dynamic batching
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(threads, thread_name_prefix='mop-server'))
+    server = await asyncio.start_server(lambda r, w: _handle_connection(state, r, w), sock=sock)
+    async with server:
+        await server.serve_forever()
+
+
+def _run_worker(state: _ServerState, sock: socket.socket, config: ServerConfig) -> None:
+    if config.dynamic_batch is not None:
+        state.inference_wrapper.enable_dynamic_batch(config.dynamic_batch)
+    # the shared batch worker threads of the model registry do not survive the fork either
+    state.inference_wrapper.model_registry.enable_dynamic_batch()
+    state.ready = True
+
+    if config.frontend == FRONTEND_ASYNCIO:
+        asyncio.run(_serve_asyncio(state, sock, config.threads))
+    else:
+        handler_class = type('RequestHandler', (_RequestHandler,), {'state': state})
+        _PooledHTTPServer(sock, handler_class, config.threads).serve_forever()
+
+
+def _bind(config: ServerConfig) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((config.host, config.port))
+    sock.listen(socket.SOMAXCONN)
+    return sock
+
+
+def load_inference_wrapper(src_dir: Optional[str] = None):
+    """
+    Import mop_utils.inference_wrapper, which imports the inference module of the model from src_dir.
+    """
+    if src_dir is not None:
+        sys.path.insert(0, os.path.abspath(src_dir))
+    return importlib.import_module('mop_utils.inference_wrapper')
+
+
+def serve(model_root: str, config: Optional[ServerConfig] = None, src_dir: Optional[str] = None) -> None:
+    """
+    Initialize the model once and serve it until interrupted.
+    @param model_root: Root where the model files exist, passed to mop_init()
+    @type model_root: str
+    @param config: Server config, read from the server section of settings.yml if None
+    @type config: ServerConfig
+    @param src_dir: Directory of the inference module of the model, if it is not importable yet
+    @type src_dir: str
+    """
+    inference_wrapper = load_inference_wrapper(src_dir)
+    if config is None:
+        config = ServerConfig.from_settings(inference_wrapper.inference_wrapper.settings)
+
+    inference_wrapper.mop_init(model_root, None, warmup=False)
+    inference_wrapper.warmup_model(config.dynamic_batch)
+    state = _ServerState(inference_wrapper)
+    sock = _bind(config)
+    print(f"Serving on http://{config.host}:{sock.getsockname()[1]} with {config.workers} worker(s), "
+          f"{config.threads} thread(s) each, {config.frontend} frontend", flush=True)
+
+    if config.workers == 1:
+        try:
+            _run_worker(state, sock, config)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    # Objects created by the init are moved out of the tracked generations, so the garbage collector of the workers
+    # does not touch, and copy, their pages.
+    gc.freeze()
+    pids = []
+    for _ in range(config.workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                _run_worker(state, sock, config)
+            finally:
+                os._exit(0)
+        pids.append(pid)
+
+    def stop_workers(signum, frame):
+        for worker_pid in pids:
+            try:
+                os.kill(worker_pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop_workers)
+    signal.signal(signal.SIGINT, stop_workers)
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Serve a MOP model locally.")
+    parser.add_argument('--model-root', required=True, help="Root where the model files exist")
+    parser.add_argument('--src-dir', help="Directory of the inference module of the model")
+    parser.add_argument('--host', help="Overrides server.host of settings.yml")
+    parser.add_argument('--port', type=int, help="Overrides server.port of settings.yml")
+    parser.add_argument('--workers', type=int, help="Overrides server.workers of settings.yml")
+    parser.add_argument('--threads', type=int, help="Overrides server.threads of settings.yml")
+    parser.add_argument('--frontend', choices=(FRONTEND_SYNC, FRONTEND_ASYNCIO),
+                        help="Overrides server.frontend of settings.yml")
+    args = parser.parse_args(argv)
+
+    inference_wrapper = load_inference_wrapper(args.src_dir)
+    config = ServerConfig.from_settings(inference_wrapper.inference_wrapper.settings)
+    overrides = {k: getattr(args, k) for k in ('host', 'port', 'workers', 'threads', 'frontend')
+                 if getattr(args, k) is not None}
+    serve(args.model_root, replace(config, **overrides))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""
+Settings of the model, read from the settings.yml file in the /src folder.
+"""
+import os
+from typing import Dict
+
+import yaml
+
+from .constant import SETTINGS_FILE_NAME
+
+
+def load_settings(src_dir: str) -> Dict:
+    """
+    Load settings.yml from the given /src folder.
+    @param src_dir: The folder of settings.yml, usually the folder of inference.py
+    @type src_dir: str
+    @return: The settings, or an empty dict if there is no settings.yml
+    @rtype: Dict
+    """
+    settings_path = os.path.join(src_dir, SETTINGS_FILE_NAME)
+    if not os.path.isfile(settings_path):
+        return {}
+
+    with open(settings_path, 'r') as f:
+        settings = yaml.safe_load(f) or {}
+
+    if not isinstance(settings, dict):
+        raise ValueError(f"Invalid {SETTINGS_FILE_NAME}: it should be a mapping. Current value: {settings}")
+    return settings
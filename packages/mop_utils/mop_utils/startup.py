@@ -0,0 +1,124 @@
+"""
+Cold start profiling: how long importing the inference module, finding the model wrapper, init(), the warmup and the
+first inference take.
+
+    python -m mop_utils.startup --src-dir ./model/src --model-root ./model --payload payload.json
+
+The profile of a running model is also in get_metrics() of mop_utils.inference_wrapper.
+"""
+import argparse
+import json
+import threading
+import time
+from typing import Dict, Optional
+
+STARTUP_IMPORT = "import_module"
+STARTUP_DISCOVERY = "discover_wrapper"
+STARTUP_INSTANTIATE = "instantiate_wrapper"
+STARTUP_INIT = "init"
+STARTUP_WARMUP = "warmup"
+STARTUP_FIRST_INFERENCE = "first_inference"
+
+
+class _NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase:
+    __slots__ = ('profile', 'name', 'start')
+
+    def __init__(self, profile: 'StartupProfile', name: str) -> None:
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # a failed phase is not recorded, e.g. a first inference with a bad request
+        if exc_type is None:
+            self.profile.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class StartupProfile:
+    """
+    Durations of the startup phases of a model, in seconds, in the order they ran.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.phases: Dict[str, float] = {}
+
+    def phase(self, name: str) -> _Phase:
+        """
+        Context manager timing a phase. Running a phase again overwrites its duration.
+        """
+        return _Phase(self, name)
+
+    def once(self, name: str):
+        """
+        Context manager timing a phase only until it is recorded once, e.g. the first inference. Afterwards it is a
+        shared no-op.
+        """
+        if name in self.phases:
+            return _NULL_PHASE
+        return _Phase(self, name)
+
+    def record(self, name: str, duration: float) -> None:
+        with self._lock:
+            self.phases[name] = duration
+
+    def reset(self, name: Optional[str] = None) -> None:
+        with self._lock:
+            if name is None:
+                self.phases.clear()
+            else:
+                self.phases.pop(name, None)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            phases = dict(self.phases)
+        return {'phases': phases, 'total': sum(phases.values())}
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Profile the cold start of a MOP model.")
+    parser.add_argument('--model-root', required=True, help="Root where the model files exist")
+    parser.add_argument('--src-dir', help="Directory of the inference module of the model")
+    parser.add_argument('--payload', help="JSON file of the request of the first inference. No inference if not set")
+    parser.add_argument('--raw', action='store_true', help="Send the payload as a raw model input")
+    args = parser.parse_args(argv)
+
+    from .server import load_inference_wrapper
+    start = time.perf_counter()
+    inference_wrapper = load_inference_wrapper(args.src_dir)
+    load_duration = time.perf_counter() - start
+    inference_wrapper.mop_init(args.model_root, None)
+    if args.payload:
+        with open(args.payload, encoding='utf-8') as f:
+            payload = json.load(f)
+        inference_wrapper.mop_run(payload, not args.raw)
+
+    report = inference_wrapper.startup_profile.to_dict()
+    # what importing mop_utils.inference_wrapper took besides the inference module and its model wrapper
+    report['phases'] = {'import_mop_utils': max(0.0, load_duration - sum(
+        report['phases'].get(name, 0.0) for name in (STARTUP_IMPORT, STARTUP_DISCOVERY, STARTUP_INSTANTIATE))),
+                        **report['phases']}
+    report['total'] = sum(report['phases'].values())
+    report['warmup'] = inference_wrapper.get_warmup_timings()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,277 @@
 """
 Utilities for Mop-utils.
 """
+from contextlib import contextmanager
+from contextvars import ContextVar
+from math import isnan
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+LABEL_TYPE_CATEGORICAL = "categorical"
+LABEL_TYPE_ORDINAL = "ordinal"
+
+_BINARY_VALUES = frozenset((0, 1))
+_INT_TYPES = frozenset((int, bool, np.bool_, np.int8, np.int16, np.int32, np.int64,
+                        np.uint8, np.uint16, np.uint32, np.uint64))
+_NUMBER_TYPES = _INT_TYPES | frozenset((float, np.float16, np.float32, np.float64))
+_INT_CLASSES = (int, np.integer, np.bool_)
+_NUMBER_CLASSES = (int, float, np.number, np.bool_)
 
 
 class ImageAnalysisInput:
-    data: bytes = b''
+    __slots__ = ('data',)
+
+    def __init__(self, data: bytes = b'') -> None:
+        self.data = data
+
+    @classmethod
+    def from_dict(cls, input_dict: Dict) -> 'ImageAnalysisInput':
+        return cls(input_dict.get('data', b''))
+
+    def to_dict(self) -> Dict:
+        return {'data': self.data}
 
 
 class TextAnalysisInput:
-    text: str = ""
+    __slots__ = ('text',)
+
+    def __init__(self, text: str = "") -> None:
+        self.text = text
+
+    @classmethod
+    def from_dict(cls, input_dict: Dict) -> 'TextAnalysisInput':
+        return cls(input_dict.get('text', ""))
+
+    def to_dict(self) -> Dict:
+        return {'text': self.text}
 
 
 class AnalysisResult:
-    harmful_score: float = 0.0
-    severity_level: int = 0
+    __slots__ = ('harmful_score', 'severity_level')
+
+    def __init__(self, harmful_score: float = 0.0, severity_level: int = 0) -> None:
+        self.harmful_score = harmful_score
+        self.severity_level = severity_level
+
+    @classmethod
+    def from_dict(cls, result_dict: Dict) -> 'AnalysisResult':
+        return cls(result_dict.get('harmful_score', 0.0), result_dict.get('severity_level', 0))
 
+    def to_dict(self) -> Dict:
+        return {'harmful_score': self.harmful_score, 'severity_level': self.severity_level}
 
-class AcsImageResponse:
+
+class _AcsResponse:
+    """
+    Base of the ACS responses. Each instance owns its own AnalysisResult defaults.
+    """
+    __slots__ = ('hate', 'self_harm', 'sexual', 'violence')
+
+    def __init__(self, hate: Optional[AnalysisResult] = None, self_harm: Optional[AnalysisResult] = None,
+                 sexual: Optional[AnalysisResult] = None, violence: Optional[AnalysisResult] = None) -> None:
+        self.hate = hate if hate is not None else AnalysisResult()
+        self.self_harm = self_harm if self_harm is not None else AnalysisResult()
+        self.sexual = sexual if sexual is not None else AnalysisResult()
+        self.violence = violence if violence is not None else AnalysisResult()
+
+    @classmethod
+    def from_dict(cls, response_dict: Dict) -> '_AcsResponse':
+        return cls(*(AnalysisResult.from_dict(response_dict[key]) if key in response_dict else None
+                     for key in _AcsResponse.__slots__))
+
+    def to_dict(self) -> Dict:
+        return {'hate': self.hate.to_dict(), 'self_harm': self.self_harm.to_dict(),
+                'sexual': self.sexual.to_dict(), 'violence': self.violence.to_dict()}
+
+
+class AcsImageResponse(_AcsResponse):
     """
     All four fields "hate", "self_harm", "sexual" and "violence" are required.
     """
-    hate = AnalysisResult()
-    self_harm = AnalysisResult()
-    sexual = AnalysisResult()
-    violence = AnalysisResult()
+    __slots__ = ()
 
 
-class AcsTextResponse:
+class AcsTextResponse(_AcsResponse):
     """
     All four fields "hate", "self_harm", "sexual" and "violence" are required.
     """
-    hate = AnalysisResult()
-    self_harm = AnalysisResult()
-    sexual = AnalysisResult()
-    violence = AnalysisResult()
+    __slots__ = ()
+
+
+class MopOutputSchema:
+    """
+    Compiled label schema of a deployed model: the taxonomies, their label names and, optionally, their label types.
+    Once compiled, an output is checked by comparing its keys and by flat range checks over all its values
+    (vectorized over the arrays of a batch output), instead of re-validating every label. The keys of an output
+    may come in any order; the values are checked in the label order of the schema.
+
+    The schema is either declared in settings.yml or compiled from the first output that passes the full validation:
+    output_schema:
+      compile: true
+      taxonomies:
+        hate:
+          label_type: categorical
+          labels: [sev-0, sev-1]
+    """
+
+    def __init__(self, label_names: Optional[Dict[str, Sequence[str]]] = None,
+                 label_types: Optional[Dict[str, str]] = None) -> None:
+        self.label_types = dict(label_types or {})
+        self.taxonomies = None
+        self.label_names = None
+        self._entries = []
+        if label_names:
+            self.compile(label_names)
+
+    @classmethod
+    def from_settings(cls, settings: Dict) -> Optional['MopOutputSchema']:
+        """
+        Build the schema from the 'output_schema' section of settings.yml.
+        @return: None if the compiled-schema mode is not enabled.
+        """
+        schema_settings = settings.get('output_schema') or {}
+        taxonomies = schema_settings.get('taxonomies') or {}
+        if not schema_settings.get('compile', bool(taxonomies)):
+            return None
+
+        label_names = {taxonomy: value.get('labels') for taxonomy, value in taxonomies.items()}
+        label_types = {taxonomy: value.get('label_type') for taxonomy, value in taxonomies.items()
+                       if value.get('label_type')}
+        if any(labels is None for labels in label_names.values()):
+            return cls(label_types=label_types)
+        return cls(label_names, label_types)
+
+    @property
+    def compiled(self) -> bool:
+        return self.taxonomies is not None
+
+    def compile(self, label_names: Dict[str, Sequence[str]]) -> None:
+        """
+        Fix the taxonomies and their labels, and check the label count required by each label type.
+        """
+        entries = []
+        offset = 0
+        for taxonomy, labels in label_names.items():
+            labels = tuple(labels)
+            label_type = self.label_types.get(taxonomy)
+            if not labels:
+                raise ValueError(f"There must be at least one label. Current taxonomy: {taxonomy}")
+            if label_type not in (None, LABEL_TYPE_CATEGORICAL, LABEL_TYPE_ORDINAL):
+                raise ValueError(f"The label type should be {LABEL_TYPE_CATEGORICAL} or {LABEL_TYPE_ORDINAL}. "
+                                 f"Current taxonomy: {taxonomy}, label type: {label_type}")
+            if label_type == LABEL_TYPE_CATEGORICAL and len(labels) < 2:
+                raise ValueError(f"There must be at least 2 labels for a categorical taxonomy. "
+                                 f"Current taxonomy: {taxonomy}, labels: {labels}")
+            if label_type == LABEL_TYPE_ORDINAL and len(labels) < 3:
+                raise ValueError(f"There must be at least 3 labels for an ordinal taxonomy. "
+                                 f"Current taxonomy: {taxonomy}, labels: {labels}")
+            entries.append((taxonomy, labels, label_type, offset, offset + len(labels)))
+            offset += len(labels)
+
+        self._entries = entries
+        self.label_names = {taxonomy: labels for taxonomy, labels, _, _, _ in entries}
+        self.taxonomies = tuple(self.label_names)
+
+    def _check_label_types(self, predicted_labels: Dict) -> None:
+        """
+        Check the categorical (exactly one 1) and ordinal (1s then 0s) rules on the (batch, labels) arrays.
+        """
+        for taxonomy, _, label_type, _, _ in self._entries:
+            if label_type is None:
+                continue
+            rows = predicted_labels[taxonomy]
+            if label_type == LABEL_TYPE_CATEGORICAL and not np.all(rows.sum(axis=1) == 1):
+                raise ValueError(f"There should be one and only one label that has 1 as its predicted label "
+                                 f"for a categorical taxonomy. Current taxonomy: {taxonomy}")
+            if label_type == LABEL_TYPE_ORDINAL and not np.all(np.diff(rows, axis=1) <= 0):
+                raise ValueError(f"The predicted labels of an ordinal taxonomy should be 1 up to a label and 0 "
+                                 f"after it. Current taxonomy: {taxonomy}")
+
+    def check_output(self, predicted_labels: Dict, confidence_scores: Dict) -> None:
+        """
+        Check one MopInferenceOutput against the compiled schema.
+        """
+        if not isinstance(predicted_labels, dict) or not isinstance(confidence_scores, dict) \
+                or predicted_labels.keys() != self.label_names.keys() \
+                or confidence_scores.keys() != self.label_names.keys():
+            raise ValueError(f"The taxonomies of the output should be {self.taxonomies}. "
+                             f"Current: {predicted_labels}, {confidence_scores}")
+
+        predicted_values = []
+        confidence_values = []
+        for taxonomy, labels, _, _, _ in self._entries:
+            predicted = predicted_labels[taxonomy]
+            confidence = confidence_scores[taxonomy]
+            if not isinstance(predicted, dict) or not isinstance(confidence, dict):
+                raise ValueError(f"The labels of taxonomy {taxonomy} should be {labels}. "
+                                 f"Current: {predicted}, {confidence}")
+            predicted_values.extend(_label_values(predicted, labels, taxonomy))
+            confidence_values.extend(_label_values(confidence, labels, taxonomy))
+
+        # exact types first, subclasses such as IntEnum only when a value is not one of them
+        if (not _INT_TYPES.issuperset(map(type, predicted_values))
+                and not all(isinstance(v, _INT_CLASSES) for v in predicted_values)) \
+                or not _BINARY_VALUES.issuperset(predicted_values):
+            raise TypeError(f"The predicted labels should be int ( 1 or 0 ). Current value: {predicted_labels}")
+
+        if (not _NUMBER_TYPES.issuperset(map(type, confidence_values))
+                and not all(isinstance(v, _NUMBER_CLASSES) for v in confidence_values)) \
+                or min(confidence_values) < 0 or max(confidence_values) > 1 or isnan(sum(confidence_values)):
+            raise ValueError(f"The confidence scores should be numbers between 0 and 1. "
+                             f"Current value: {confidence_scores}")
+
+        for taxonomy, _, label_type, start, end in self._entries:
+            if label_type is None:
+                continue
+            values = predicted_values[start:end]
+            if label_type == LABEL_TYPE_CATEGORICAL and sum(values) != 1:
+                raise ValueError(f"There should be one and only one label that has 1 as its predicted label "
+                                 f"for a categorical taxonomy. Current taxonomy: {taxonomy}")
+            if label_type == LABEL_TYPE_ORDINAL and values != sorted(values, reverse=True):
+                raise ValueError(f"The predicted labels of an ordinal taxonomy should be 1 up to a label and 0 "
+                                 f"after it. Current taxonomy: {taxonomy}")
+
+    def check_batch(self, label_names: Dict, predicted_labels: Dict, confidence_scores: Dict) -> None:
+        """
+        Check the (batch, labels) arrays of a MopBatchInferenceOutput against the compiled schema.
+        """
+        if label_names.keys() != self.label_names.keys() or any(label_names[taxonomy] != labels for taxonomy, labels
+                                                                 in self.label_names.items()):
+            raise ValueError(f"The label names of the batch output should be {self.label_names}. "
+                             f"Current: {label_names}")
+        for taxonomy in self.taxonomies:
+            confidence = confidence_scores[taxonomy]
+            if not np.all((confidence >= 0) & (confidence <= 1)):
+                raise ValueError(f"The confidence scores should be numbers between 0 and 1. "
+                                 f"Current taxonomy: {taxonomy}")
+        self._check_label_types(predicted_labels)
+
+
+def _label_values(values: Dict, labels: tuple, taxonomy: str) -> Sequence:
+    """
+    The values of a taxonomy in the label order of the schema.
+    """
+    if tuple(values) == labels:
+        return values.values()
+    if values.keys() != set(labels):
+        raise ValueError(f"The labels of taxonomy {taxonomy} should be {labels}. Current: {values}")
+    return [values[label] for label in labels]
+
+
+_active_output_schema: ContextVar[Optional[MopOutputSchema]] = ContextVar('mop_output_schema', default=None)
+
+
+@contextmanager
+def use_output_schema(schema: Optional[MopOutputSchema]):
+    """
+    Validate the outputs built inside this context against the given schema.
+    """
+    token = _active_output_schema.set(schema)
+    try:
+        yield schema
+    finally:
+        _active_output_schema.reset(token)
 
 
 class MopInferenceOutputValidator:
@@ -68,7 +306,7 @@ class MopInferenceOutputValidator:
                         raise TypeError(f"The key should be type str and not empty. "
                                         f"Current value: {k}, type: {type(k)}")
                 
-                    if v is None or not isinstance(v, int) or v not in (1, 0):
+                    if not isinstance(v, _INT_CLASSES) or v not in _BINARY_VALUES:
                         raise TypeError(f"The value should be int ( 1 or 0 ): "
                                         f"Current key: {k}, value: {v}, type: {type(v)}")
             
@@ -94,7 +332,7 @@ class MopInferenceOutputValidator:
                         raise TypeError(f"The confidence score key name must be str and also not empty. "
                                         f"Current value: {k}, type: {type(k)}")
                 
-                    if v is None or not isinstance(v, (float, int)):
+                    if not isinstance(v, _NUMBER_CLASSES):
                         raise TypeError(f"The confidence score value must be float or int and not empty. "
                                         f"Current key: {k}, value: {v}, type: {type(v)}")
             
@@ -133,8 +371,13 @@ class MopInferenceOutputValidator:
     def validate(self):
         """
         Validate if label name, type, the numbers of label match between confidence score and predicted labels.
+        If an output schema is active and compiled, the output is checked against it instead.
         """
-        
+        schema = _active_output_schema.get()
+        if schema is not None and schema.compiled:
+            schema.check_output(self.predicted_labels, self.confidence_scores)
+            return
+
         self._check_predicted_labels()
         self._check_confidence_scores()
         
@@ -145,3 +388,89 @@ class MopInferenceOutputValidator:
         if not self._check_value_keys_match():
             raise ValueError(f"The keys of predicted labels values should match the keys of confidence score values. "
                              f"Current: {self.confidence_scores}, {self.predicted_labels}")
+
+        if schema is not None:
+            schema.compile({key: tuple(value) for key, value in self.confidence_scores.items()})
+            schema.check_output(self.predicted_labels, self.confidence_scores)
+
+
+
+class MopBatchInferenceOutputValidator:
+    """
+    MOP batch inference output validator. It validates the arrays of the whole batch at once.
+    """
+
+    def __init__(self, mop_batch_inference_output):
+        self.label_names = mop_batch_inference_output.label_names
+        self.predicted_labels = mop_batch_inference_output.predicted_labels
+        self.confidence_scores = mop_batch_inference_output.confidence_scores
+        if not self.label_names or not self.predicted_labels or not self.confidence_scores:
+            raise ValueError(f"Invalid label_names, predicted_labels and confidence_scores. "
+                             f"Current value: {self.label_names}, {self.confidence_scores}, {self.predicted_labels}")
+
+    def _check_label_names(self):
+        """
+        Validate taxonomy names and their label names.
+        """
+        for key, labels in self.label_names.items():
+            if not key or not isinstance(key, str):
+                raise TypeError(f"The label name must be type str and its value must be not empty. "
+                                f"Current value: {key}, type: {type(key)}")
+
+            if len(labels) == 0:
+                raise ValueError(f"There must be at least one label name. Current taxonomy: {key}")
+
+            for k in labels:
+                if not k or not isinstance(k, str):
+                    raise TypeError(f"The key should be type str and not empty. "
+                                    f"Current value: {k}, type: {type(k)}")
+
+            if len(set(labels)) != len(labels):
+                raise ValueError(f"The label names should be unique. Current taxonomy: {key}, labels: {labels}")
+
+    def _check_shape(self, key, value, batch_size) -> int:
+        """
+        Validate that the array of a taxonomy is shaped (batch, labels) and return its batch size.
+        """
+        shape = (batch_size if batch_size is not None else value.shape[0], len(self.label_names[key]))
+        if value.ndim != 2 or value.shape != shape:
+            raise ValueError(f"The array of taxonomy {key} should be shaped (batch, labels) = {shape}. "
+                             f"Current shape: {value.shape}")
+        return value.shape[0]
+
+    def validate(self) -> int:
+        """
+        Validate taxonomies, array shapes and value ranges of the batch.
+        @return: batch size
+        @rtype: int
+        """
+        self._check_label_names()
+
+        taxonomies = set(self.label_names.keys())
+        if set(self.predicted_labels.keys()) != taxonomies or set(self.confidence_scores.keys()) != taxonomies:
+            raise ValueError(f"The keys of predicted labels and confidence scores should match the keys of label "
+                             f"names. Current: {self.label_names.keys()}, {self.predicted_labels.keys()}, "
+                             f"{self.confidence_scores.keys()}")
+
+        batch_size = None
+        for key in self.label_names:
+            predicted = self.predicted_labels[key]
+            confidence = self.confidence_scores[key]
+            batch_size = self._check_shape(key, predicted, batch_size)
+            batch_size = self._check_shape(key, confidence, batch_size)
+
+            if predicted.dtype.kind not in 'biu' or not np.all((predicted == 0) | (predicted == 1)):
+                raise TypeError(f"The predicted labels should be int ( 1 or 0 ). "
+                                f"Current taxonomy: {key}, dtype: {predicted.dtype}")
+
+            if confidence.dtype.kind not in 'biuf' or not np.all(np.isfinite(confidence)):
+                raise TypeError(f"The confidence scores must be finite float or int. "
+                                f"Current taxonomy: {key}, dtype: {confidence.dtype}")
+
+        schema = _active_output_schema.get()
+        if schema is not None:
+            if not schema.compiled:
+                schema.compile(self.label_names)
+            schema.check_batch(self.label_names, self.predicted_labels, self.confidence_scores)
+
+        return batch_size
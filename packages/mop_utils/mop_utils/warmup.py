@@ -0,0 +1,153 @@
+"""
+Warmup of a model before it serves: mop_init() runs warmup payloads through inference() and inference_batch() at each
+batch size, so that lazy framework initialization, allocator growth and caches do not land on the first requests.
+"""
+import itertools
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .dataset import DEFAULT_DELIMITER, read_records, row_to_mop_input
+
+DEFAULT_ITERATIONS = 2
+DEFAULT_MAX_SAMPLES = 64
+
+SYNTHETIC_TEXT = "text"
+SYNTHETIC_IMAGE = "image"
+SYNTHETIC_IMAGE_TEXT = "image_text"
+
+# the 23x13 PNG of the sample image model
+SAMPLE_PNG_BASE64 = ("iVBORw0KGgoAAAANSUhEUgAAABcAAAANCAIAAADNBWIKAAAAGklEQVR4nGNkYPjPQDFgotyIUVNGTRnxpgAAuWYBGVUz"
+                     "Bh4AAAAASUVORK5CYII=")
+_SAMPLE_TEXT = "This is a sentence run through the model to warm it up before it serves requests ."
+
+SYNTHETIC_INPUTS = {
+    SYNTHETIC_TEXT: {'text': _SAMPLE_TEXT},
+    SYNTHETIC_IMAGE: {'image': SAMPLE_PNG_BASE64, 'width': 23, 'height': 13},
+    SYNTHETIC_IMAGE_TEXT: {'text': f"{_SAMPLE_TEXT} ##{{image_0}}", 'images': [SAMPLE_PNG_BASE64]},
+}
+
+
+@dataclass(frozen=True)
+class WarmupConfig:
+    """
+    Warmup settings, read from the warmup section of settings.yml:
+
+        warmup:
+          enable: true
+          batch_sizes: [1, 8, 32]   # optional, 1 and the max batch size of the dynamic batch args by default
+          iterations: 2             # optional, runs of each batch size
+          dataset: warmup.tsv       # optional, sample dataset file, relative to the folder of settings.yml
+          max_samples: 64           # optional, rows read from the dataset
+          synthetic: text           # optional, text, image or image_text synthetic inputs
+
+    The inputs returned by get_warmup_inputs() of the model wrapper come first, then the dataset, then the synthetic
+    inputs. Warmup runs if it is enabled, or if get_warmup_inputs() returns inputs and enable is not false.
+    Without a synthetic setting, the first synthetic input the model accepts is used, and warmup is skipped if it
+    accepts none.
+    """
+    enable: Optional[bool] = None
+    batch_sizes: Tuple[int, ...] = ()
+    iterations: int = DEFAULT_ITERATIONS
+    dataset: Optional[str] = None
+    max_samples: int = DEFAULT_MAX_SAMPLES
+    synthetic: Optional[str] = None
+
+    def __post_init__(self) -> None:
+        if any(size <= 0 for size in self.batch_sizes):
+            raise ValueError(f"The warmup batch sizes should be positive. Current value: {self.batch_sizes}")
+        if self.iterations <= 0:
+            raise ValueError(f"The warmup iterations should be positive. Current value: {self.iterations}")
+        if self.synthetic is not None and self.synthetic not in SYNTHETIC_INPUTS:
+            raise ValueError(f"The synthetic warmup inputs should be one of {list(SYNTHETIC_INPUTS)}. "
+                             f"Current value: {self.synthetic}")
+
+    @classmethod
+    def from_dict(cls, config: Dict) -> 'WarmupConfig':
+        return cls(enable=config.get('enable'),
+                   batch_sizes=tuple(config.get('batch_sizes') or ()),
+                   iterations=config.get('iterations', DEFAULT_ITERATIONS),
+                   dataset=config.get('dataset'),
+                   max_samples=config.get('max_samples', DEFAULT_MAX_SAMPLES),
+                   synthetic=config.get('synthetic'))
+
+    @classmethod
+    def from_settings(cls, settings: Dict) -> 'WarmupConfig':
+        return cls.from_dict(settings.get('warmup') or {})
+
+    def resolve_batch_sizes(self, dynamic_batch_args: Optional[Dict] = None) -> List[int]:
+        if self.batch_sizes:
+            return sorted(set(self.batch_sizes))
+        max_batch_size = (dynamic_batch_args or {}).get('max_batch_size')
+        return sorted({1, max_batch_size} if max_batch_size else {1})
+
+    def load_inputs(self, hook_inputs: Optional[Sequence], src_dir: str,
+                    accepts: Optional[Callable[[Any], bool]] = None) -> List:
+        """
+        The warmup inputs: the inputs of get_warmup_inputs(), else the dataset rows, else the synthetic inputs.
+        @param accepts: Tells whether the model accepts a synthetic input, when the synthetic setting is not set
+        @type accepts: Callable[[Any], bool]
+        @return: The inputs, empty if the model accepts none of the synthetic inputs
+        @rtype: List
+        """
+        if hook_inputs:
+            return list(hook_inputs)
+        if self.dataset:
+            path = self.dataset if os.path.isabs(self.dataset) else os.path.join(src_dir, self.dataset)
+            rows = itertools.islice(read_records(path, DEFAULT_DELIMITER), self.max_samples)
+            inputs = [row_to_mop_input(row) for row in rows]
+            if not inputs:
+                raise ValueError(f"The warmup dataset {path} has no rows")
+            return inputs
+        if self.synthetic is not None or accepts is None:
+            return [SYNTHETIC_INPUTS[self.synthetic or SYNTHETIC_TEXT]]
+        return [synthetic for synthetic in SYNTHETIC_INPUTS.values() if accepts(synthetic)][:1]
+
+
+def _batch(inputs: Sequence, size: int, offset: int) -> List:
+    return [inputs[(offset + i) % len(inputs)] for i in range(size)]
+
+
+def _timing(batch_size: int, path: str, durations: List[float]) -> Dict:
+    # the first run pays the lazy initializations, the later ones tell the warm latency
+    warm = durations[1:] or durations
+    mean = sum(warm) / len(warm)
+    return {'batch_size': batch_size, 'path': path, 'first': durations[0], 'mean': mean, 'per_item': mean / batch_size}
+
+
+def run_warmup(inference_wrapper, inputs: Sequence, batch_sizes: Sequence[int],
+               iterations: int = DEFAULT_ITERATIONS) -> List[Dict]:
+    """
+    Run the warmup inputs through a MOPInferenceWrapper, bypassing its result cache and in-batch deduplication:
+    inference() for the batch size 1, and inference_batch() for every batch size.
+    @param inference_wrapper: The MOPInferenceWrapper of the model
+    @type inference_wrapper: MOPInferenceWrapper
+    @param inputs: MOP inputs, repeated to fill the batches
+    @type inputs: Sequence
+    @param batch_sizes: Batch sizes to warm up
+    @type batch_sizes: Sequence[int]
+    @param iterations: Runs of each batch size
+    @type iterations: int
+    @return: Timings of each batch size and path: the duration of the first run, and the mean duration and per item
+    duration of the later runs, in seconds
+    @rtype: List[Dict]
+    """
+    timings = []
+    for batch_size in batch_sizes:
+        if batch_size == 1:
+            durations = []
+            for i in range(iterations):
+                start = time.perf_counter()
+                inference_wrapper._run(inputs[i % len(inputs)], True)
+                durations.append(time.perf_counter() - start)
+            timings.append(_timing(batch_size, 'inference', durations))
+
+        durations = []
+        for i in range(iterations):
+            batch = _batch(inputs, batch_size, i * batch_size)
+            start = time.perf_counter()
+            inference_wrapper._run_batch(batch, True)
+            durations.append(time.perf_counter() - start)
+        timings.append(_timing(batch_size, 'inference_batch', durations))
+    return timings
@@ -11,5 +11,9 @@ setup(
         'pyraisdk ~= 0.4.2',
         'PyYAML >= 6.0',
         'numpy >= 1.22.0',
-    ]
+    ],
+    extras_require={
+        'fast-json': ['orjson >= 3.6.0'],
+        'parquet': ['pyarrow >= 8.0.0'],
+    }
 )
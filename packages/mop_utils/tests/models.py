@@ -0,0 +1,88 @@
+"""
+Model wrappers and batch models of the tests.
+"""
+import threading
+from typing import Any, Dict, List
+
+import numpy as np
+from pyraisdk.dynbatch import BaseModel
+
+from mop_utils.base_model_wrapper import BaseModelWrapper, MopBatchInferenceOutput, MopInferenceInput, \
+    MopInferenceOutput
+
+
+def mop_output(score: float) -> MopInferenceOutput:
+    return MopInferenceOutput({
+        'predicted_labels': {'hate': {'a': int(score > 0.5), 'b': int(score <= 0.5)}},
+        'confidence_scores': {'hate': {'a': score, 'b': 1 - score}},
+    })
+
+
+class EchoModelWrapper(BaseModelWrapper):
+    """
+    Echoes raw items, and scores MOP items by the length of their text. Counts the items run by the model.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.items: List = []
+
+    def init(self, model_root: str, **kwargs):
+        pass
+
+    def inference(self, item: Dict, **kwargs) -> Dict:
+        self.items.append(item)
+        return {'echo': item}
+
+    def inference_batch(self, items: List[Dict], **kwargs) -> List[Dict]:
+        self.items.extend(items)
+        return [{'echo': item} for item in items]
+
+    def convert_mop_input_to_model_input(self, mop_input: MopInferenceInput, **kwargs) -> Dict:
+        return {'text': mop_input.text, 'image': mop_input.image, 'width': mop_input.width}
+
+    def convert_model_output_to_mop_output(self, customized_output: Dict, **kwargs) -> MopInferenceOutput:
+        return mop_output(min(len(customized_output['echo']['text'] or ''), 10) / 10)
+
+
+class FailingModelWrapper(EchoModelWrapper):
+    """
+    Fails on the items whose text is 'fail'.
+    """
+
+    def inference_batch(self, items: List[Dict], **kwargs) -> List[Dict]:
+        if any(item.get('text') == 'fail' for item in items):
+            raise ValueError("Failed item")
+        return super().inference_batch(items)
+
+
+class BatchOutputModelWrapper(EchoModelWrapper):
+    """
+    Scores MOP batches at once through a MopBatchInferenceOutput.
+    """
+
+    def convert_model_output_batch_to_mop_output(self, customized_outputs: List[Dict],
+                                                 **kwargs) -> MopBatchInferenceOutput:
+        scores = np.array([min(len(output['echo']['text'] or ''), 10) / 10 for output in customized_outputs])
+        return MopBatchInferenceOutput(
+            confidence_scores={'hate': np.stack([scores, 1 - scores], axis=1)},
+            predicted_labels={'hate': np.stack([scores > 0.5, scores <= 0.5], axis=1).astype(np.int64)},
+            label_names={'hate': ['a', 'b']}
+        )
+
+
+class GatedModel(BaseModel):
+    """
+    Echoes the items of a batch once the gate is open.
+    """
+
+    def __init__(self) -> None:
+        self.gate = threading.Event()
+        self.started = threading.Event()
+        self.batches: List[List[Any]] = []
+
+    def predict(self, items: List[Any]) -> List[Any]:
+        self.started.set()
+        self.gate.wait(10)
+        self.batches.append(list(items))
+        return list(items)
@@ -0,0 +1,56 @@
+from typing import List
+
+import pytest
+
+from mop_utils.runtime import ModelRuntime
+from mop_utils.util import AcsImageResponse, AcsTextResponse, AnalysisResult, ImageAnalysisInput, TextAnalysisInput
+
+from models import EchoModelWrapper
+
+
+class AcsModelWrapper(EchoModelWrapper):
+    """
+    Scores ACS text requests by their length and image requests by their size, one batch at a time.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.batches: List[int] = []
+
+    def inference_batch(self, items, **kwargs):
+        self.batches.append(len(items))
+        return super().inference_batch(items)
+
+    def convert_acs_text_request_to_model_inference_input(self, req: TextAnalysisInput) -> object:
+        return {'length': len(req.text)}
+
+    def convert_model_inference_output_to_acs_text_response(self, out: object) -> AcsTextResponse:
+        return AcsTextResponse(hate=AnalysisResult(out['echo']['length'] / 10, 0))
+
+    def convert_acs_image_request_batch_to_model_inference_input(self, reqs: List[ImageAnalysisInput]) -> List[object]:
+        return [{'length': len(req.data)} for req in reqs]
+
+    def convert_model_inference_output_batch_to_acs_image_response(self, outs: List[object]) -> List[AcsImageResponse]:
+        return [AcsImageResponse(violence=AnalysisResult(out['echo']['length'] / 10, 1)) for out in outs]
+
+
+def test_acs_requests_are_run_in_one_batch_per_modality():
+    model_wrapper = AcsModelWrapper()
+    runtime = ModelRuntime('model', model_wrapper)
+    responses = runtime.run_acs([TextAnalysisInput('abc'), ImageAnalysisInput(b'abcd'), TextAnalysisInput('a')])
+    assert [type(response) for response in responses] == [AcsTextResponse, AcsImageResponse, AcsTextResponse]
+    assert responses[0].hate.harmful_score == pytest.approx(0.3)
+    assert responses[1].violence.to_dict() == {'harmful_score': pytest.approx(0.4), 'severity_level': 1}
+    assert responses[2].hate.harmful_score == pytest.approx(0.1)
+    assert sorted(model_wrapper.batches) == [1, 2]
+
+
+def test_single_acs_request():
+    runtime = ModelRuntime('model', AcsModelWrapper())
+    response = runtime.run_acs(TextAnalysisInput('ab'))
+    assert isinstance(response, AcsTextResponse) and response.hate.harmful_score == pytest.approx(0.2)
+
+
+def test_acs_request_type_is_checked():
+    with pytest.raises(TypeError):
+        ModelRuntime('model', AcsModelWrapper()).run_acs({'text': 'a'})
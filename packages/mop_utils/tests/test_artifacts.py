@@ -0,0 +1,74 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from mop_utils.artifacts import ArtifactCache, load_arrays, load_shared_arrays, save_arrays
+
+
+def test_fetch_downloads_once(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    calls = []
+
+    def download(path):
+        calls.append(path)
+        with open(path, 'w') as f:
+            f.write('weights')
+
+    threads = [threading.Thread(target=cache.fetch, args=('model/weights.bin', download)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    path = cache.fetch('model/weights.bin', download)
+    assert len(calls) == 1
+    assert open(path).read() == 'weights'
+    assert not [name for name in os.listdir(os.path.dirname(path)) if '.tmp-' in name]
+
+
+def test_failed_download_leaves_nothing(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+
+    def download(path):
+        open(path, 'w').close()
+        raise IOError("connection reset")
+
+    with pytest.raises(IOError):
+        cache.fetch('weights.bin', download)
+    assert not cache.contains('weights.bin')
+    assert not [name for name in os.listdir(tmp_path) if '.tmp-' in name]
+
+
+def test_name_outside_of_the_cache(tmp_path):
+    with pytest.raises(ValueError):
+        ArtifactCache(str(tmp_path)).path('../weights.bin')
+
+
+def test_npz_members_are_memory_mapped(tmp_path):
+    path = str(tmp_path / 'weights.npz')
+    arrays = {'w': np.arange(12, dtype=np.float32).reshape(3, 4), 'b': np.ones(4, dtype=np.int64),
+              'f': np.asfortranarray(np.arange(6).reshape(2, 3))}
+    save_arrays(path, arrays)
+    loaded = load_arrays(path)
+    assert set(loaded) == set(arrays)
+    for name, array in arrays.items():
+        assert isinstance(loaded[name], np.memmap)
+        np.testing.assert_array_equal(loaded[name], array)
+        assert not loaded[name].flags.writeable
+
+
+def test_compressed_npz_is_loaded_in_memory(tmp_path):
+    path = str(tmp_path / 'weights.npz')
+    np.savez_compressed(path, w=np.arange(5))
+    loaded = load_arrays(path)
+    assert not isinstance(loaded['w'], np.memmap)
+    np.testing.assert_array_equal(loaded['w'], np.arange(5))
+
+
+def test_shared_arrays_are_loaded_once(tmp_path):
+    path = str(tmp_path / 'weights.npy')
+    save_arrays(path, np.arange(10))
+    assert load_shared_arrays(path) is load_shared_arrays(str(tmp_path / '.' / 'weights.npy'))
+    with pytest.raises(ValueError):
+        save_arrays(str(tmp_path / 'weights.bin'), np.arange(3))
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+
+import pytest
+from pyraisdk.dynbatch import PredictTimeoutError
+
+from mop_utils.batching import BatchConfig, MopDynamicBatchModel
+from mop_utils.runtime import ModelRuntime
+
+from models import EchoModelWrapper, GatedModel
+
+BATCH_ARGS = {'max_batch_size': 8, 'idle_batch_size': 1, 'max_batch_interval': 0.005}
+
+
+@pytest.mark.parametrize('dynamic_batch_args', [None, BATCH_ARGS])
+def test_run_async(dynamic_batch_args):
+    runtime = ModelRuntime('model', EchoModelWrapper())
+    if dynamic_batch_args is not None:
+        runtime.enable_dynamic_batch(dynamic_batch_args)
+
+    async def run():
+        return await asyncio.gather(*(runtime.run_async({'x': i}) for i in range(20)))
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        runtime.close()
+    assert results == [[{'echo': {'x': i}}] for i in range(20)]
+
+
+def test_requests_do_not_block_the_event_loop():
+    model = GatedModel()
+    batch_model = MopDynamicBatchModel(model, BatchConfig.from_dict(BATCH_ARGS))
+
+    async def run():
+        request = asyncio.ensure_future(batch_model.predict_async([1, 2]))
+        # the loop keeps running while the batch waits for the gate
+        await asyncio.get_running_loop().run_in_executor(None, model.started.wait, 5)
+        assert not request.done()
+        model.gate.set()
+        return await request
+
+    try:
+        assert asyncio.run(run()) == [1, 2]
+    finally:
+        model.gate.set()
+        batch_model.close()
+
+
+def test_timeout_and_cancellation():
+    model = GatedModel()
+    batch_model = MopDynamicBatchModel(model, BatchConfig.from_dict({**BATCH_ARGS, 'max_batch_size': 1}))
+
+    async def run():
+        running = asyncio.ensure_future(batch_model.predict_async([1]))
+        await asyncio.get_running_loop().run_in_executor(None, model.started.wait, 5)
+        with pytest.raises(PredictTimeoutError):
+            await batch_model.predict_async([2], timeout=0.05)
+        cancelled = asyncio.ensure_future(batch_model.predict_async([3]))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        model.gate.set()
+        assert await running == [1]
+        assert await batch_model.predict_async([4]) == [4]
+
+    try:
+        asyncio.run(run())
+    finally:
+        model.gate.set()
+        batch_model.close()
+    # the timed out and cancelled items never reached the model
+    assert model.batches == [[1], [4]]
+    assert batch_model.stats()['timeouts'] == 1
+
+
+def test_init_async_keeps_the_loop_running():
+    runtime = ModelRuntime('model', EchoModelWrapper())
+    started = threading.Event()
+    release = threading.Event()
+
+    def init(model_root, **kwargs):
+        started.set()
+        release.wait(5)
+
+    runtime.model_wrapper.init = init
+
+    async def run():
+        task = asyncio.ensure_future(runtime.init_async('.', BATCH_ARGS, warmup=False))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        assert not runtime.ready
+        release.set()
+        await task
+        return await runtime.run_async({'text': 'abc'}, True)
+
+    try:
+        assert asyncio.run(run())[0]['predicted_labels'] == {'hate': {'a': 0, 'b': 1}}
+        assert runtime.ready
+    finally:
+        runtime.close()
@@ -0,0 +1,60 @@
+import time
+from typing import Any, List
+
+import pytest
+from pyraisdk.dynbatch import BaseModel
+from pyraisdk.dynbatch.batch import ItemFuture, ItemMessage
+
+from mop_utils.batch_controller import AdaptiveBatchController
+from mop_utils.batching import BatchConfig, MopDynamicBatchModel
+
+
+class FlakyModel(BaseModel):
+    """
+    Fails the batches that hold the item 'fail'.
+    """
+
+    def predict(self, items: List[Any]) -> List[Any]:
+        if 'fail' in items:
+            raise ValueError("Failed batch")
+        return list(items)
+
+
+def test_from_dict_ignores_unknown_keys():
+    controller = AdaptiveBatchController.from_dict({'enable': True, 'target_p95_latency': 0.1, 'window': 5,
+                                                    'comment': 'x', 'max_batch_size': None})
+    assert controller.target_p95_latency == 0.1
+    assert controller.window == 5
+    assert controller.max_batch_size == 64
+
+
+def test_from_dict_disabled():
+    assert AdaptiveBatchController.from_dict({'enable': False, 'target_p95_latency': 0.1}) is None
+
+
+def test_from_dict_checks_values():
+    with pytest.raises(ValueError):
+        AdaptiveBatchController.from_dict({'enable': True, 'target_p95_latency': 0})
+
+
+def _run_batch(batch_model: MopDynamicBatchModel, item: Any) -> ItemFuture:
+    future = ItemFuture()
+    batch_model._worker_run_batch([ItemMessage(future, item, time.perf_counter())])
+    return future
+
+
+def test_failed_batches_are_not_observed():
+    controller = AdaptiveBatchController(target_p95_latency=10, window=1)
+    config = BatchConfig.from_dict({'max_batch_size': 1, 'idle_batch_size': 1, 'max_batch_interval': 0.005})
+    batch_model = MopDynamicBatchModel(FlakyModel(), config, controller)
+    try:
+        with pytest.raises(ValueError):
+            _run_batch(batch_model, 'fail').get_result(1)
+        assert controller.stats()['batch_duration_by_batch_size'] == {}
+        assert controller.stats()['throughput'] is None
+
+        assert _run_batch(batch_model, 'ok').get_result(1) == 'ok'
+        assert list(controller.stats()['batch_duration_by_batch_size']) == [1]
+        assert controller.stats()['throughput'] is not None
+    finally:
+        batch_model.close()
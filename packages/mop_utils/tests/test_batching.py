@@ -0,0 +1,164 @@
+import threading
+import time
+from typing import Any, List
+
+import pytest
+from pyraisdk.dynbatch.batch import ItemFuture, ItemMessage
+
+from mop_utils.base_model_wrapper import MopInferenceInput
+from mop_utils.batching import BatchConfig, MopDynamicBatchModel, OverloadedError, SharedBatchScheduler
+
+from models import EchoModelWrapper, GatedModel
+
+
+def _config(**changes) -> BatchConfig:
+    return BatchConfig.from_dict({'max_batch_size': 4, 'idle_batch_size': 1, 'max_batch_interval': 0.005, **changes})
+
+
+def test_config_from_dict():
+    config = BatchConfig.from_dict({'enable': True, 'max_batch_size': 8, 'idle_batch_size': 2,
+                                    'max_batch_interval': 0.01, 'request_timeout': None,
+                                    'bucket_boundaries': [1024, 256]})
+    assert config.max_batch_size == 8 and config.idle_batch_size == 2
+    assert config.request_timeout is not None
+    assert config.bucket_boundaries == (256, 1024)
+    assert BatchConfig.from_dict(config.to_dict()) == config
+
+
+@pytest.mark.parametrize('changes', [
+    {'max_batch_size': 0},
+    {'idle_batch_size': 8},
+    {'max_batch_interval': -1},
+    {'shed_policy': 'drop_newest'},
+    {'max_queue_depth': 0},
+])
+def test_invalid_config(changes):
+    with pytest.raises(ValueError):
+        _config(**changes)
+
+
+def test_batches_hold_one_bucket():
+    model = GatedModel()
+    model.gate.set()
+    config = _config(idle_batch_size=4, max_batch_interval=0.05, bucket_boundaries=[2])
+    batch_model = MopDynamicBatchModel(model, config, bucket_key=len)
+    try:
+        assert batch_model.predict(['a', 'bbb', 'c', 'ddd']) == ['a', 'bbb', 'c', 'ddd']
+    finally:
+        batch_model.close()
+    assert sorted(model.batches) == [['a', 'c'], ['bbb', 'ddd']]
+
+
+def test_bucket_key_of_prepared_items():
+    model_wrapper = EchoModelWrapper()
+    item = {'text': 'a' * 100, 'image': 'b' * 5000, 'width': 10, 'height': 20}
+    key = model_wrapper.get_batch_bucket_key(item)
+    assert key == 5100
+    assert model_wrapper.get_batch_bucket_key(MopInferenceInput.create(item)) == key
+    assert model_wrapper.get_batch_bucket_key(MopInferenceInput(text='abc', images=['de', 'f'])) == 6
+
+
+def test_shed_request_is_not_prepared():
+    model = GatedModel()
+    batch_model = MopDynamicBatchModel(model, _config(max_queue_depth=1, max_batch_size=1))
+    prepared = []
+
+    def prepare(item):
+        prepared.append(item)
+        return item
+
+    try:
+        first = threading.Thread(target=batch_model.predict, args=([1],), kwargs={'prepare': prepare})
+        first.start()
+        assert model.started.wait(5)
+        second = threading.Thread(target=batch_model.predict, args=([2],), kwargs={'prepare': prepare})
+        second.start()
+        while batch_model.queue_depth < 1:
+            time.sleep(0.001)
+        with pytest.raises(OverloadedError):
+            batch_model.predict([3], prepare=prepare)
+        assert prepared == [1, 2]
+        model.gate.set()
+        first.join(5)
+        second.join(5)
+    finally:
+        model.gate.set()
+        batch_model.close()
+
+
+def _wait_depth(batch_model: MopDynamicBatchModel, depth: int) -> None:
+    ts_start = time.perf_counter()
+    while batch_model.queue_depth < depth and time.perf_counter() - ts_start < 5:
+        time.sleep(0.001)
+    assert batch_model.queue_depth == depth
+
+
+def _predict_in_thread(batch_model: MopDynamicBatchModel, items: List[Any],
+                       errors: List[Exception]) -> threading.Thread:
+    def run():
+        try:
+            batch_model.predict(items)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+@pytest.mark.parametrize('shed_policy', ['reject', 'drop_oldest'])
+def test_shed_counts_scheduler_pending_items(shed_policy):
+    scheduler = SharedBatchScheduler()
+    config = _config(max_queue_depth=2, idle_batch_size=4, max_batch_interval=5, shed_policy=shed_policy)
+    batch_model = MopDynamicBatchModel(GatedModel(), config, scheduler=scheduler)
+    errors = []
+    try:
+        first = _predict_in_thread(batch_model, [1, 2], errors)
+        _wait_depth(batch_model, 2)
+        while batch_model.q.qsize():
+            time.sleep(0.001)
+        if shed_policy == 'reject':
+            with pytest.raises(OverloadedError):
+                batch_model.predict([3], timeout=0.1)
+        else:
+            batch_model.predict([3], timeout=0.1, raise_timeout=False)
+            first.join(5)
+            assert len(errors) == 1 and isinstance(errors[0], OverloadedError)
+        assert batch_model.queue_depth <= 2
+    finally:
+        batch_model.close()
+        scheduler.close()
+        first.join(5)
+
+
+def test_scheduler_deadline_starts_at_item_creation():
+    scheduler = SharedBatchScheduler()
+    scheduler.close()
+    batch_model = MopDynamicBatchModel(GatedModel(), _config(idle_batch_size=4, max_batch_interval=0.5),
+                                       scheduler=scheduler)
+    now = time.perf_counter()
+    batch_model.q.put_nowait(ItemMessage(ItemFuture(), 1, now - 1))
+    batch, deadline = batch_model.take_batch(now)
+    assert [msg.item for msg in batch] == [1] and deadline is None
+    batch_model.q.put_nowait(ItemMessage(ItemFuture(), 2, now))
+    batch, deadline = batch_model.take_batch(now)
+    assert batch is None and deadline == now + 0.5
+    batch_model.close()
+
+
+@pytest.mark.parametrize('bucketed', [False, True])
+def test_close_fails_waiting_items(bucketed):
+    scheduler = None if bucketed else SharedBatchScheduler()
+    config = _config(idle_batch_size=4, max_batch_interval=5, bucket_boundaries=[10] if bucketed else None)
+    batch_model = MopDynamicBatchModel(GatedModel(), config, bucket_key=len, scheduler=scheduler)
+    errors = []
+    thread = _predict_in_thread(batch_model, ['a', 'b'], errors)
+    _wait_depth(batch_model, 2)
+    batch_model.close()
+    thread.join(1)
+    assert not thread.is_alive()
+    assert len(errors) == 1 and isinstance(errors[0], OverloadedError)
+    with pytest.raises(OverloadedError):
+        batch_model.predict(['c'])
+    if scheduler is not None:
+        scheduler.close()
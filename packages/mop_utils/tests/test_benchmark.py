@@ -0,0 +1,31 @@
+import pytest
+
+from mop_utils.benchmark import build_payloads, compare, run_benchmarks
+
+
+def test_run_benchmarks():
+    results = run_benchmarks(['text'], repeat=1)
+    stages = results['results']['text']
+    assert set(stages) == {'from_dict', 'convert_input', 'output', 'build_response', 'build_response_bytes',
+                           'batch_round_trip'}
+    assert all(timing['best_us'] > 0 for timing in stages.values())
+    assert results['meta']['repeat'] == 1
+
+
+def test_unknown_scenario():
+    with pytest.raises(ValueError):
+        run_benchmarks(['audio'])
+
+
+def test_compare():
+    baseline = {'results': {'text': {'output': {'best_us': 10.0}, 'gone': {'best_us': 1.0}}}}
+    results = {'results': {'text': {'output': {'best_us': 13.0}, 'new': {'best_us': 1.0}}}}
+    rows = compare(results, baseline, threshold=0.2)
+    assert rows == [{'scenario': 'text', 'stage': 'output', 'baseline_us': 10.0, 'current_us': 13.0,
+                     'ratio': pytest.approx(1.3), 'regression': True}]
+    assert not compare(results, baseline, threshold=0.5)[0]['regression']
+
+
+def test_payloads_are_valid_mop_inputs():
+    assert all(payload.get('text') or payload.get('image') or payload.get('images')
+               for payload in build_payloads().values())
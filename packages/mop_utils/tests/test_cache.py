@@ -0,0 +1,80 @@
+import numpy as np
+
+from mop_utils.cache import MISSING, ResultCache, input_key
+from mop_utils.runtime import MOPInferenceWrapper
+
+from models import EchoModelWrapper
+
+
+def test_input_key_tells_types_apart():
+    assert input_key({'text': 'None', 'image': 'abc'}, True) != input_key({'image': 'abc'}, True)
+    assert input_key({'text': 'a', 'width': 5}, True) != input_key({'text': 'a', 'width': '5'}, True)
+    assert input_key({'a': 1}, False) != input_key({'a': True}, False)
+    assert input_key({'a': 1}, False) != input_key({'a': 1.0}, False)
+    assert input_key({'a': 'x', 'b': 'y'}, False) == input_key({'b': 'y', 'a': 'x'}, False)
+
+
+def test_input_key_of_unsupported_values():
+    assert input_key({'a': object()}, False) is None
+    assert input_key(['not', 'a', 'dict'], False) is None
+
+
+def test_cache_does_not_mix_inputs_up():
+    wrapper = MOPInferenceWrapper(EchoModelWrapper(), {'result_cache': {'enable': True}})
+    first = wrapper.run({'text': 'None', 'image': 'abc'}, True)
+    second = wrapper.run({'image': 'abc'}, True)
+    assert first != second
+    assert wrapper.result_cache.stats()['hits'] == 0
+    assert wrapper.run({'text': 'None', 'image': 'abc'}, True) == first
+    assert wrapper.result_cache.stats()['hits'] == 1
+
+
+def test_cache_hits_are_copies():
+    cache = ResultCache()
+    result = {'scores': {'a': 0.5}, 'labels': [1, 0]}
+    cache.put(b'key', result)
+    result['scores']['a'] = 0.9
+    hit = cache.get(b'key')
+    assert hit == {'scores': {'a': 0.5}, 'labels': [1, 0]}
+    hit['labels'].append(1)
+    assert cache.get(b'key') == {'scores': {'a': 0.5}, 'labels': [1, 0]}
+
+
+def test_cache_bounds():
+    cache = ResultCache(max_entries=2)
+    for key in (b'a', b'b', b'c'):
+        cache.put(key, {'key': key.decode()})
+    assert cache.get(b'a') is MISSING
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['bytes'] == 0
+
+    cache = ResultCache(max_bytes=30)
+    cache.put(b'big', {'text': 'x' * 100})
+    assert cache.get(b'big') is MISSING
+    cache.put(b'small', {'a': 1})
+    assert cache.get(b'small') == {'a': 1}
+    assert cache.stats()['bytes'] > 0
+
+
+class ArrayModelWrapper(EchoModelWrapper):
+    """
+    Returns the raw outputs as NumPy arrays.
+    """
+
+    def inference(self, item, **kwargs):
+        return np.array([item['x']])
+
+    def inference_batch(self, items, **kwargs):
+        return [np.array([item['x']]) for item in items]
+
+
+def test_hits_and_misses_have_the_same_form():
+    wrapper = MOPInferenceWrapper(ArrayModelWrapper(), {'result_cache': {'enable': True}})
+    miss = wrapper.run({'x': 1}, False)
+    hit = wrapper.run({'x': 1}, False)
+    assert miss == hit == [[1]]
+    assert type(miss[0]) is type(hit[0]) is list
+    batch_miss = wrapper.run_batch([{'x': 2}, {'x': 3}], False)
+    batch_hit = wrapper.run_batch([{'x': 2}, {'x': 3}], False)
+    assert batch_miss == batch_hit == [[2], [3]]
+    assert [type(result) for result in batch_miss] == [type(result) for result in batch_hit] == [list, list]
@@ -0,0 +1,33 @@
+import pytest
+
+from mop_utils.dataset import check_data_columns, read_dataset, row_to_mop_input
+from mop_utils.loadtest import load_payloads
+
+
+def _write(tmp_path, content: str) -> str:
+    path = tmp_path / 'dataset.csv'
+    path.write_text(content, encoding='utf-8')
+    return str(path)
+
+
+def test_row_to_mop_input():
+    assert row_to_mop_input({'text': 'abc', 'hate': '1'}) == {'text': 'abc'}
+    assert row_to_mop_input({'base64_image': 'xyz', 'image_width_pixels': '4', 'image_height_pixels': ''}) == \
+        {'image': 'xyz', 'width': 4, 'height': None}
+    assert row_to_mop_input({'text': 'a ##{image_0}', 'image_0': 'p', 'image_1': 'q', 'image_2': ''}) == \
+        {'text': 'a ##{image_0}', 'images': ['p', 'q']}
+
+
+def test_space_aligned_dataset_is_rejected(tmp_path):
+    path = _write(tmp_path, "text    hate   violent\nsome text here    1 0\n")
+    row = next(read_dataset(path))
+    with pytest.raises(ValueError, match="delimiter"):
+        row_to_mop_input(row)
+    with pytest.raises(ValueError, match="no text, base64_image or image_N column"):
+        load_payloads(path)
+
+
+def test_tab_delimited_dataset(tmp_path):
+    path = _write(tmp_path, "text\thate\nsome text\t1\nother text\t0\n")
+    assert load_payloads(path) == [{'text': 'some text'}, {'text': 'other text'}]
+    check_data_columns(['image_0', 'hate'])
@@ -0,0 +1,46 @@
+from mop_utils.base_model_wrapper import MopInferenceInput
+from mop_utils.cache import dedup_key, same_item
+from mop_utils.runtime import MOPInferenceWrapper
+
+from models import EchoModelWrapper
+
+
+def test_equal_values_of_other_types_are_not_collapsed():
+    model_wrapper = EchoModelWrapper()
+    wrapper = MOPInferenceWrapper(model_wrapper)
+    outputs = wrapper.run_batch([{'a': 1}, {'a': True}, {'a': 1.0}, {'a': 1}], False)
+    assert [output['echo'] for output in outputs] == [{'a': 1}, {'a': True}, {'a': 1.0}, {'a': 1}]
+    assert [type(output['echo']['a']) for output in outputs] == [int, bool, float, int]
+    assert len(model_wrapper.items) == 3
+
+
+def test_identical_items_run_once():
+    model_wrapper = EchoModelWrapper()
+    wrapper = MOPInferenceWrapper(model_wrapper)
+    items = [{'text': 'abc'}, {'text': 'abcdef'}, {'text': 'abc'}, MopInferenceInput(text='abc')]
+    outputs = wrapper.run_batch(items, True)
+    assert outputs[0] == outputs[2] == outputs[3] != outputs[1]
+    assert len(model_wrapper.items) == 2
+    assert wrapper.dedup_stats()['unique_items'] == 2
+
+
+def test_nested_raw_items():
+    model_wrapper = EchoModelWrapper()
+    wrapper = MOPInferenceWrapper(model_wrapper)
+    items = [{'a': [1, 2]}, {'a': [1, 2]}, {'a': [1, True]}]
+    outputs = wrapper.run_batch(items, False)
+    assert [output['echo'] for output in outputs] == items
+    assert len(model_wrapper.items) == 2
+
+
+def test_mop_fields_types():
+    assert dedup_key({'text': 'a', 'width': 5}, True) == dedup_key({'text': 'a', 'width': 5.0}, True)
+    assert not same_item({'text': 'a', 'width': 5}, {'text': 'a', 'width': 5.0}, True)
+    assert same_item({'text': 'a', 'other': 1}, {'text': 'a'}, True)
+
+
+def test_dedup_disabled():
+    model_wrapper = EchoModelWrapper()
+    wrapper = MOPInferenceWrapper(model_wrapper, {'batch_dedup': False})
+    wrapper.run_batch([{'a': 1}, {'a': 1}], False)
+    assert len(model_wrapper.items) == 2
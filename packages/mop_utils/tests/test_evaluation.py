@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from mop_utils.evaluation import classification_report, evaluate, precision_recall_curve, threshold_sweep
+
+
+def test_classification_report():
+    report = classification_report(np.array([0, 0, 1, 1, 2]), np.array([0, 1, 1, 1, 0]), ['a', 'b', 'c'])
+    assert report['labels']['a'] == {'precision': 0.5, 'recall': 0.5, 'f1': 0.5, 'support': 2}
+    assert report['labels']['b']['precision'] == pytest.approx(2 / 3)
+    assert report['labels']['c'] == {'precision': 0.0, 'recall': 0.0, 'f1': 0.0, 'support': 1}
+    assert report['accuracy'] == pytest.approx(0.6)
+    assert report['micro']['f1'] == pytest.approx(0.6)
+    assert report['macro']['recall'] == pytest.approx(0.5)
+    assert report['confusion_matrix']['matrix'] == [[1, 1, 0], [0, 2, 0], [1, 0, 0]]
+
+
+def test_threshold_sweep_matches_brute_force():
+    rng = np.random.default_rng(0)
+    scores = rng.random(200).round(2)
+    y_true = rng.random(200) < scores
+    sweep = threshold_sweep(y_true, scores)
+    for threshold, precision, recall in zip(sweep['thresholds'][::10], sweep['precision'][::10],
+                                            sweep['recall'][::10]):
+        predicted = scores >= threshold
+        tp = np.sum(predicted & y_true)
+        assert precision == pytest.approx(tp / predicted.sum() if predicted.any() else 0.0)
+        assert recall == pytest.approx(tp / y_true.sum())
+
+
+def test_precision_recall_curve_with_ties():
+    curve = precision_recall_curve(np.array([1, 0, 1, 0]), np.array([0.9, 0.9, 0.5, 0.1]))
+    assert curve['thresholds'] == [0.9, 0.5, 0.1]
+    assert curve['precision'] == [0.5, pytest.approx(2 / 3), 0.5]
+    assert curve['recall'] == [0.5, 1.0, 1.0]
+    assert curve['average_precision'] == pytest.approx(0.5 * 0.5 + 0.5 * 2 / 3)
+
+
+def test_binary_dataset_of_a_categorical_task():
+    report = evaluate([0, 1, 1], np.array([[1, 0], [0, 1], [1, 0]]), np.array([[0.9, 0.1], [0.2, 0.8], [0.6, 0.4]]),
+                      ['safe', 'hate'])
+    assert report['accuracy'] == pytest.approx(2 / 3)
+    assert report['labels']['hate']['recall'] == 0.5
+
+
+def test_ordinal_partitions():
+    predicted = np.array([[1, 0, 0], [1, 1, 0], [1, 1, 1], [1, 1, 0]])
+    scores = np.array([[1, 0.2, 0.1], [1, 0.7, 0.2], [1, 0.9, 0.8], [1, 0.6, 0.3]])
+    report = evaluate(['0', '1', '1', '0'], predicted, scores, ['low', 'mid', 'high'], 'ordinal')
+    first, second = report['partitions']
+    assert first['negative'] == ['low'] and first['positive'] == ['mid', 'high']
+    assert (first['precision'], first['recall']) == (pytest.approx(2 / 3), 1.0)
+    assert (second['precision'], second['recall']) == (1.0, 0.5)
+    assert report['best_partition'] == 0
+
+
+def test_unknown_labels():
+    with pytest.raises(ValueError):
+        evaluate(['x'], np.array([[1, 0]]), np.array([[1.0, 0.0]]), ['a', 'b'])
@@ -0,0 +1,44 @@
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+from mop_utils.base_model_wrapper import MopInferenceInput
+from mop_utils.image import ImageInfo, read_image_info_from_base64
+
+
+def _encode(image_format: str, size=(31, 17)) -> str:
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (255, 0, 0)).save(buffer, format=image_format)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+PNG_BASE64 = _encode('PNG', (23, 13))
+
+
+@pytest.mark.parametrize('image_format', ['PNG', 'JPEG', 'GIF', 'BMP', 'WEBP'])
+def test_image_info_from_the_header(image_format):
+    assert read_image_info_from_base64(_encode(image_format)) == ImageInfo(image_format, 31, 17)
+
+
+def test_data_uri_prefix():
+    mop_input = MopInferenceInput(image=f"data:image/png;base64,{PNG_BASE64}")
+    assert mop_input.get_image_info() == ImageInfo('PNG', 23, 13)
+    assert bytes(mop_input.get_image_bytes()) == base64.b64decode(PNG_BASE64)
+
+
+def test_images_are_decoded_once():
+    mop_input = MopInferenceInput(text='a', images=[PNG_BASE64, _encode('JPEG')])
+    buffer = mop_input.get_image_bytes(1)
+    assert mop_input.get_image_bytes(1) is buffer
+    assert buffer.readonly
+    array = mop_input.get_image_array(1, 'L')
+    assert array.shape == (17, 31)
+    assert mop_input.get_image_array(1, 'L') is array
+    assert mop_input.get_image_array(0, 'RGB', (8, 4)).shape == (4, 8, 3)
+
+
+def test_no_image():
+    with pytest.raises(ValueError):
+        MopInferenceInput(text='a').get_image_bytes()
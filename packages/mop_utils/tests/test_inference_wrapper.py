@@ -0,0 +1,43 @@
+import importlib
+import sys
+
+import pytest
+
+import mop_utils
+
+INFERENCE = '''
+from models import BatchOutputModelWrapper
+
+
+class ModelWrapper(BatchOutputModelWrapper):
+    pass
+'''
+
+
+@pytest.fixture
+def inference_wrapper(tmp_path, monkeypatch):
+    (tmp_path / 'inference.py').write_text(INFERENCE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    for name in ('inference', 'mop_utils.inference_wrapper'):
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    module = importlib.import_module('mop_utils.inference_wrapper')
+    yield module
+    module.runtime.close()
+    sys.modules.pop('mop_utils.inference_wrapper', None)
+    sys.modules.pop('inference', None)
+
+
+def test_public_names(inference_wrapper):
+    assert all(hasattr(inference_wrapper, name) for name in inference_wrapper.__all__)
+    assert all(hasattr(mop_utils, name) for name in mop_utils.__all__)
+    assert mop_utils.__version__ == '2.5'
+
+
+@pytest.mark.parametrize('dynamic_batch_args', [None, {'max_batch_size': 4, 'idle_batch_size': 1,
+                                                       'max_batch_interval': 0.005}])
+def test_mop_run_returns_dicts(inference_wrapper, dynamic_batch_args):
+    inference_wrapper.mop_init('.', dynamic_batch_args)
+    outputs = inference_wrapper.mop_run([{'text': 'abcdefgh'}, {'text': 'ab'}], True)
+    assert all(type(output) is dict for output in outputs)
+    assert outputs[0]['predicted_labels'] == {'hate': {'a': 1, 'b': 0}}
+    assert inference_wrapper.build_response(outputs) == outputs
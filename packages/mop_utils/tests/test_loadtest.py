@@ -0,0 +1,87 @@
+import asyncio
+import csv
+import json
+
+import pytest
+
+from mop_utils.batching import OverloadedError
+from mop_utils.loadtest import (MODE_CONCURRENCY, OUTCOME_SUCCESS, OUTCOME_SYSTEM_FAILURE, OUTCOME_USER_FAILURE,
+                                InProcessTarget, run_step, run_sweep, sweep_levels, write_report)
+
+
+class FakeTarget:
+    """
+    Fails every request whose payload index is in failing, and counts the sent requests.
+    """
+
+    def __init__(self, failing=()) -> None:
+        self.failing = set(failing)
+        self.sent = []
+
+    async def send(self, index: int) -> str:
+        self.sent.append(index)
+        await asyncio.sleep(0.001)
+        return OUTCOME_SYSTEM_FAILURE if index in self.failing else OUTCOME_SUCCESS
+
+
+class FakeInferenceWrapper:
+    """
+    Raises the error of the payload, like mop_run() of an inference_wrapper module.
+    """
+
+    @staticmethod
+    def mop_run(raw_data, mop_triggered):
+        if 'error' in raw_data:
+            raise raw_data['error']
+        if 'text' not in raw_data:
+            raise ValueError('Either text or image must be provided')
+        return raw_data
+
+    @staticmethod
+    def build_response_bytes(result):
+        return b'{}'
+
+
+def test_in_process_outcomes():
+    payloads = [{'text': 'hello'}, {'x': 1}, {'text': 'hello', 'error': OverloadedError("The queue is full")},
+                {'text': 'hello', 'error': RuntimeError("The model failed")}]
+    target = InProcessTarget(FakeInferenceWrapper(), payloads, 1)
+    try:
+        outcomes = [asyncio.run(target.send(index)) for index in range(len(payloads))]
+    finally:
+        asyncio.run(target.close())
+    assert outcomes == [OUTCOME_SUCCESS, OUTCOME_USER_FAILURE, OUTCOME_USER_FAILURE, OUTCOME_SYSTEM_FAILURE]
+
+
+def test_sweep_levels():
+    assert sweep_levels(30) == [1, 10, 20, 30]
+    assert sweep_levels(5, 2) == [1, 2, 4]
+
+
+def test_run_step():
+    target = FakeTarget(failing={0})
+    step = asyncio.run(run_step(target, MODE_CONCURRENCY, 2, duration=0.2))
+    assert step['requests'] == len(target.sent) > 1
+    assert step['successes'] == step['requests'] - 1 and step['system_failures'] == 1
+    assert step['failure_rate'] == pytest.approx(1 / step['requests'])
+    assert step['latency_p50_ms'] is not None and step['cpu_percent'] is None
+    with pytest.raises(ValueError):
+        asyncio.run(run_step(target, 'qps', 1))
+
+
+def test_sweep_stops_above_max_failure_rate():
+    target = FakeTarget(failing=range(10 ** 6))
+    steps = asyncio.run(run_sweep(target, MODE_CONCURRENCY, [1, 2, 3], step_duration=0.01))
+    assert [step['level'] for step in steps] == [1]
+
+
+@pytest.mark.parametrize('name', ['report.csv', 'report.json'])
+def test_write_report(tmp_path, name):
+    steps = [{'mode': 'rps', 'level': 1, 'actual_rps': 1.0}, {'mode': 'rps', 'level': 10, 'actual_rps': 9.5}]
+    path = str(tmp_path / name)
+    write_report(path, steps, {'dataset': 'data.csv'})
+    with open(path) as f:
+        if name.endswith('.csv'):
+            assert [row['level'] for row in csv.DictReader(f)] == ['1', '10']
+        else:
+            assert json.load(f) == {'config': {'dataset': 'data.csv'}, 'steps': steps}
@@ -0,0 +1,34 @@
+from mop_utils.runtime import ModelRuntime
+from mop_utils.server import _ServerState
+
+from models import EchoModelWrapper
+
+
+def _types(text):
+    return dict(line.split()[2:4] for line in text.splitlines() if line.startswith('# TYPE'))
+
+
+def test_counters_are_exported_as_counters():
+    runtime = ModelRuntime('model', EchoModelWrapper(), {'result_cache': {'enable': True}})
+    runtime.run([{'text': 'a'}, {'text': 'a'}, {'text': 'b'}], True)
+    text = runtime.get_metrics_text()
+    types = _types(text)
+    for name in ('mop_dedup_items_total', 'mop_dedup_unique_items_total', 'mop_cache_hits_total',
+                 'mop_cache_misses_total'):
+        assert types[name] == 'counter'
+    assert 'mop_cache_misses_total 3' in text.splitlines()
+    assert types['mop_dedup_dedup_ratio'] == 'gauge'
+    assert types['mop_cache_entries'] == 'gauge'
+    assert 'mop_dedup_items' not in types
+
+
+def test_server_counters():
+    state = _ServerState(ModelRuntime('model', EchoModelWrapper()))
+    state.count('requests')
+    _, body, _ = state.metrics('format=prometheus')
+    text = body.decode()
+    types = _types(text)
+    assert types['mop_server_requests_total'] == 'counter'
+    assert 'mop_server_requests_total 1' in text.splitlines()
+    assert types['mop_server_uptime'] == 'gauge'
+    assert 'mop_server_requests' not in types
@@ -0,0 +1,144 @@
+from enum import IntEnum
+
+import numpy as np
+import pytest
+
+from mop_utils.base_model_wrapper import MopBatchInferenceOutput, MopInferenceOutput
+from mop_utils.cache import ResultCache
+from mop_utils.runtime import MOPInferenceWrapper
+from mop_utils.util import MopOutputSchema, use_output_schema
+
+from models import BatchOutputModelWrapper, EchoModelWrapper
+
+
+def _output(label_a, score_a=0.75):
+    return {
+        'predicted_labels': {'hate': {'a': label_a, 'b': 0}},
+        'confidence_scores': {'hate': {'a': score_a, 'b': 0.25}},
+    }
+
+
+class Label(IntEnum):
+    NO = 0
+    YES = 1
+
+
+class Score(float):
+    pass
+
+
+def test_batch_output_is_returned_as_dicts():
+    wrapper = MOPInferenceWrapper(BatchOutputModelWrapper())
+    outputs = wrapper.run_batch([{'text': 'abcdefgh'}, {'text': 'ab'}, {'text': 'abcdefgh'}], True)
+    assert all(type(output) is dict for output in outputs)
+    assert outputs == [wrapper.run_batch([item], True)[0] for item in
+                       [{'text': 'abcdefgh'}, {'text': 'ab'}, {'text': 'abcdefgh'}]]
+    assert outputs[0]['predicted_labels'] == {'hate': {'a': 1, 'b': 0}}
+    assert outputs[0] is not outputs[2]
+
+
+def test_batch_output_matches_item_output():
+    items = [{'text': 'abcdefgh'}, {'text': 'ab'}]
+    batch_outputs = MOPInferenceWrapper(BatchOutputModelWrapper()).run_batch(items, True)
+    item_outputs = MOPInferenceWrapper(EchoModelWrapper()).run_batch(items, True)
+    assert batch_outputs == item_outputs
+
+
+def test_cached_batch_output_is_a_dict():
+    wrapper = MOPInferenceWrapper(BatchOutputModelWrapper())
+    wrapper.result_cache = ResultCache(16)
+    first = wrapper.run_batch([{'text': 'abc'}], True)
+    second = wrapper.run_batch([{'text': 'abc'}], True)
+    assert type(first[0]) is dict and first == second
+
+
+@pytest.mark.parametrize('compiled', [False, True])
+@pytest.mark.parametrize('label', [1, True, np.int64(1), np.uint8(1), np.bool_(True), np.longlong(1), Label.YES])
+def test_integer_labels_are_accepted(compiled, label):
+    schema = MopOutputSchema({'hate': ['a', 'b']}) if compiled else None
+    with use_output_schema(schema):
+        MopInferenceOutput(_output(label, np.float32(0.75)))
+
+
+@pytest.mark.parametrize('compiled', [False, True])
+@pytest.mark.parametrize('label', [2, 1.0, '1', None, np.float64(1)])
+def test_other_labels_are_rejected(compiled, label):
+    schema = MopOutputSchema({'hate': ['a', 'b']}) if compiled else None
+    with use_output_schema(schema), pytest.raises(TypeError):
+        MopInferenceOutput(_output(label))
+
+
+@pytest.mark.parametrize('compiled', [False, True])
+@pytest.mark.parametrize('score', ['0.75', None])
+def test_non_number_scores_are_rejected(compiled, score):
+    schema = MopOutputSchema({'hate': ['a', 'b']}) if compiled else None
+    with use_output_schema(schema), pytest.raises((TypeError, ValueError)):
+        MopInferenceOutput(_output(1, score))
+
+
+@pytest.mark.parametrize('compiled', [False, True])
+@pytest.mark.parametrize('score', [Score(0.75), np.longdouble(0.75), np.int32(1)])
+def test_number_subclass_scores_are_accepted(compiled, score):
+    schema = MopOutputSchema({'hate': ['a', 'b']}) if compiled else None
+    with use_output_schema(schema):
+        MopInferenceOutput(_output(Label.YES, score))
+
+
+def _schema() -> MopOutputSchema:
+    return MopOutputSchema({'hate': ['a', 'b'], 'violence': ['low', 'medium', 'high']},
+                           {'hate': 'categorical', 'violence': 'ordinal'})
+
+
+def _typed_output(hate, violence):
+    return {
+        'predicted_labels': {'hate': hate, 'violence': violence},
+        'confidence_scores': {'hate': {label: 0.5 for label in hate},
+                              'violence': {label: 0.5 for label in violence}},
+    }
+
+
+def test_taxonomies_need_labels():
+    with pytest.raises(ValueError, match='at least one label'):
+        MopOutputSchema({'hate': []})
+    with pytest.raises(ValueError, match='at least one label'):
+        MopOutputSchema.from_settings({'output_schema': {'taxonomies': {'hate': {'labels': []}}}})
+    with pytest.raises(ValueError):
+        MopOutputSchema({'hate': ['a']}, {'hate': 'categorical'})
+    with pytest.raises(ValueError):
+        MopOutputSchema({'violence': ['low', 'high']}, {'violence': 'ordinal'})
+
+
+def test_keys_may_come_in_any_order():
+    output = _typed_output({'b': 0, 'a': 1}, {'high': 0, 'low': 1, 'medium': 1})
+    output['predicted_labels'] = dict(reversed(list(output['predicted_labels'].items())))
+    with use_output_schema(_schema()):
+        MopInferenceOutput(output)
+        with pytest.raises(ValueError):
+            MopInferenceOutput(_typed_output({'a': 1, 'c': 0}, {'low': 1, 'medium': 0, 'high': 0}))
+        with pytest.raises(ValueError):
+            MopInferenceOutput(_typed_output({'a': 1, 'b': 0}, {'low': 1, 'medium': 0}))
+
+
+@pytest.mark.parametrize('hate, violence', [
+    ({'a': 1, 'b': 1}, {'low': 1, 'medium': 0, 'high': 0}),
+    ({'a': 0, 'b': 0}, {'low': 1, 'medium': 0, 'high': 0}),
+    ({'a': 1, 'b': 0}, {'low': 0, 'medium': 1, 'high': 0}),
+    ({'a': 1, 'b': 0}, {'high': 1, 'medium': 1, 'low': 0}),
+])
+def test_label_type_rules(hate, violence):
+    with use_output_schema(_schema()), pytest.raises(ValueError):
+        MopInferenceOutput(_typed_output(hate, violence))
+
+
+def test_label_type_rules_of_batch_outputs():
+    label_names = {'hate': ['a', 'b'], 'violence': ['low', 'medium', 'high']}
+    confidence_scores = {'hate': np.full((2, 2), 0.5), 'violence': np.full((2, 3), 0.5)}
+    with use_output_schema(_schema()):
+        MopBatchInferenceOutput(confidence_scores, {'hate': np.array([[1, 0], [0, 1]]),
+                                                    'violence': np.array([[1, 1, 0], [0, 0, 0]])}, label_names)
+        with pytest.raises(ValueError):
+            MopBatchInferenceOutput(confidence_scores, {'hate': np.array([[1, 1], [0, 1]]),
+                                                        'violence': np.array([[1, 1, 0], [0, 0, 0]])}, label_names)
+        with pytest.raises(ValueError):
+            MopBatchInferenceOutput(confidence_scores, {'hate': np.array([[1, 0], [0, 1]]),
+                                                        'violence': np.array([[1, 0, 1], [0, 0, 0]])}, label_names)
@@ -0,0 +1,58 @@
+import base64
+import io
+import os
+import time
+
+import pytest
+from PIL import Image
+
+from mop_utils.base_model_wrapper import MopInferenceInput
+from mop_utils.preprocessing import ImagePreprocessor
+
+
+def _png(size=(23, 13)) -> str:
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (255, 0, 0)).save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def _decode(preprocessor: ImagePreprocessor) -> tuple:
+    mop_input = MopInferenceInput.create({'image': _png(), 'width': 23, 'height': 13})
+    preprocessor.prepare([mop_input])
+    return mop_input.get_image_array().shape
+
+
+def test_prepare_decodes_images():
+    preprocessor = ImagePreprocessor(workers=2, mode='RGB')
+    try:
+        assert _decode(preprocessor) == (13, 23, 3)
+    finally:
+        preprocessor.close()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="requires os.fork()")
+def test_pool_works_after_fork():
+    preprocessor = ImagePreprocessor(workers=2, mode='RGB')
+    _decode(preprocessor)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            # the pool of the parent has no threads here: a task submitted to it would never run
+            preprocessor.executor.submit(int).result(timeout=10)
+            code = 0 if _decode(preprocessor) == (13, 23, 3) else 1
+        except BaseException:
+            code = 1
+        os._exit(code)
+
+    deadline = time.monotonic() + 20
+    while True:
+        done, status = os.waitpid(pid, os.WNOHANG)
+        if done:
+            break
+        if time.monotonic() > deadline:
+            os.kill(pid, 9)
+            os.waitpid(pid, 0)
+            pytest.fail("The forked worker hung on the image preprocessing pool")
+        time.sleep(0.05)
+    preprocessor.close()
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
@@ -0,0 +1,71 @@
+import types
+
+import pytest
+
+from mop_utils import register_model_wrapper
+from mop_utils.registry import find_model_wrapper
+from mop_utils.runtime import ModelRuntime
+from mop_utils.startup import STARTUP_FIRST_INFERENCE, StartupProfile
+
+from models import EchoModelWrapper
+
+
+def _module(name, *classes):
+    module = types.ModuleType(name)
+    for cls in classes:
+        cls.__module__ = name
+        setattr(module, cls.__name__, cls)
+    return module
+
+
+def test_scan_finds_the_wrapper_of_the_module():
+    wrapper = type('ScannedWrapper', (EchoModelWrapper,), {})
+    module = _module('inference_scan', wrapper)
+    module.EchoModelWrapper = EchoModelWrapper
+    assert find_model_wrapper(module, {}) is wrapper
+
+
+def test_registered_wrapper_comes_before_the_scan():
+    first = type('First', (EchoModelWrapper,), {'__module__': 'inference_registered'})
+    second = register_model_wrapper(type('Second', (EchoModelWrapper,), {'__module__': 'inference_registered'}))
+    assert find_model_wrapper(_module('inference_registered', first, second), {}) is second
+
+
+def test_settings_entry_point_comes_first():
+    registered = register_model_wrapper(type('Registered', (EchoModelWrapper,), {'__module__': 'inference_settings'}))
+    module = _module('inference_settings', registered)
+    assert find_model_wrapper(module, {'model_wrapper': 'models:EchoModelWrapper'}) is EchoModelWrapper
+    with pytest.raises(ValueError):
+        find_model_wrapper(module, {'model_wrapper': 'models:mop_output'})
+
+
+def test_register_checks_the_class():
+    with pytest.raises(TypeError):
+        register_model_wrapper(object)
+
+
+def test_no_wrapper():
+    with pytest.raises(ValueError):
+        find_model_wrapper(_module('inference_empty'), {})
+
+
+def test_startup_profile():
+    profile = StartupProfile()
+    with profile.phase('init'):
+        pass
+    with pytest.raises(ValueError), profile.once(STARTUP_FIRST_INFERENCE):
+        raise ValueError("bad request")
+    assert list(profile.phases) == ['init']
+    with profile.once(STARTUP_FIRST_INFERENCE):
+        pass
+    duration = profile.phases[STARTUP_FIRST_INFERENCE]
+    with profile.once(STARTUP_FIRST_INFERENCE):
+        pass
+    assert profile.phases[STARTUP_FIRST_INFERENCE] == duration
+    assert profile.to_dict()['total'] == pytest.approx(sum(profile.phases.values()))
+
+
+def test_runtime_records_the_first_inference():
+    runtime = ModelRuntime('model', EchoModelWrapper())
+    runtime.run({'text': 'a'}, True)
+    assert STARTUP_FIRST_INFERENCE in runtime.startup_profile.phases
@@ -0,0 +1,32 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from mop_utils.constant import RUN_MODE_MOP, RUN_MODE_RAW
+from mop_utils.runtime import BatchItem, MOPInferenceWrapper, ModelRuntime
+
+from models import EchoModelWrapper
+
+
+def test_mixed_batch_runs_each_mode_once():
+    model_wrapper = EchoModelWrapper()
+    wrapper = MOPInferenceWrapper(model_wrapper, {'batch_dedup': False})
+    items = [BatchItem({'text': 'abc'}, RUN_MODE_MOP), BatchItem({'x': 1}, RUN_MODE_RAW),
+             BatchItem({'text': 'abcdefgh'}, RUN_MODE_MOP)]
+    outputs = wrapper.run_mixed_batch(items)
+    assert outputs[1] == {'echo': {'x': 1}}
+    assert outputs[0]['confidence_scores'] == {'hate': {'a': 0.3, 'b': 0.7}}
+    assert outputs[2]['predicted_labels'] == {'hate': {'a': 1, 'b': 0}}
+    assert len(model_wrapper.items) == 3
+
+
+def test_modes_of_concurrent_requests_in_one_batch():
+    model_wrapper = EchoModelWrapper()
+    runtime = ModelRuntime('model', model_wrapper)
+    runtime.enable_dynamic_batch({'max_batch_size': 2, 'idle_batch_size': 2, 'max_batch_interval': 1})
+    try:
+        with ThreadPoolExecutor(2) as executor:
+            raw = executor.submit(runtime.run, {'x': 1}, False)
+            mop = executor.submit(runtime.run, {'text': 'abc'}, True)
+            assert raw.result(5) == [{'echo': {'x': 1}}]
+            assert mop.result(5)[0]['predicted_labels'] == {'hate': {'a': 0, 'b': 1}}
+    finally:
+        runtime.close()
@@ -0,0 +1,66 @@
+import sys
+import uuid
+
+import pytest
+
+from mop_utils.runtime import ModelRuntime
+
+INFERENCE = '''
+from mop_utils.base_model_wrapper import BaseModelWrapper
+from {helper} import VALUE
+
+
+class ModelWrapper(BaseModelWrapper):
+    def init(self, model_root, **kwargs):
+        pass
+
+    def inference(self, item, **kwargs):
+        return {{'value': VALUE}}
+
+    def inference_batch(self, items, **kwargs):
+        return [self.inference(item) for item in items]
+
+    def convert_mop_input_to_model_input(self, mop_input, **kwargs):
+        return {{}}
+
+    def convert_model_output_to_mop_output(self, customized_output, **kwargs):
+        raise NotImplementedError
+'''
+
+
+def _model(root, name, helper, value):
+    src_dir = root / name
+    src_dir.mkdir()
+    (src_dir / 'inference.py').write_text(INFERENCE.format(helper=helper))
+    (src_dir / f'{helper}.py').write_text(f'VALUE = {value!r}\n')
+    (src_dir / 'settings.yml').write_text('image_preprocessing:\n  workers: 1\n')
+    return str(src_dir)
+
+
+def test_helper_module_clash_raises(tmp_path):
+    helper = f'helper_{uuid.uuid4().hex}'
+    first = ModelRuntime.load('first', _model(tmp_path, 'first', helper, 1))
+    assert first.model_wrapper.inference({}) == {'value': 1}
+    with pytest.raises(ValueError, match=helper):
+        ModelRuntime.load('second', _model(tmp_path, 'second', helper, 2))
+    assert sys.modules[helper].VALUE == 1
+
+
+def test_helper_modules_of_another_name(tmp_path):
+    first = ModelRuntime.load('first', _model(tmp_path, 'first', f'helper_{uuid.uuid4().hex}', 1))
+    second = ModelRuntime.load('second', _model(tmp_path, 'second', f'helper_{uuid.uuid4().hex}', 2))
+    assert first.model_wrapper.inference({}) == {'value': 1}
+    assert second.model_wrapper.inference({}) == {'value': 2}
+    # the same model can be loaded again
+    ModelRuntime.load('first', first.src_dir)
+
+
+def test_close_shuts_the_image_preprocessor_down(tmp_path):
+    runtime = ModelRuntime.load('model', _model(tmp_path, 'model', f'helper_{uuid.uuid4().hex}', 1))
+    preprocessor = runtime.inference_wrapper.image_preprocessor
+    assert preprocessor is not None
+    executor = preprocessor.executor
+    runtime.close()
+    assert preprocessor._executor is None
+    with pytest.raises(RuntimeError):
+        executor.submit(print)
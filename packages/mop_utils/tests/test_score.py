@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from mop_utils.dataset import read_records
+from mop_utils.runtime import MOPInferenceWrapper
+from mop_utils.score import BatchScorer, JsonlResultWriter, ParquetResultWriter
+
+from models import EchoModelWrapper, FailingModelWrapper
+
+
+def _dataset(tmp_path, texts, header='text\thate\n'):
+    path = tmp_path / 'dataset.tsv'
+    path.write_text(header + ''.join(f"{text}\t0\n" for text in texts), encoding='utf-8')
+    return str(path)
+
+
+def test_score_jsonl(tmp_path):
+    output = str(tmp_path / 'scores.jsonl')
+    writer = JsonlResultWriter(output)
+    scorer = BatchScorer(MOPInferenceWrapper(FailingModelWrapper()), writer, batch_size=2)
+    counts = scorer.score(read_records(_dataset(tmp_path, ['a', 'fail', 'abc'])))
+    writer.close()
+    assert counts == {'skipped': 0, 'scored': 3, 'failed': 1}
+    results = [json.loads(line) for line in open(output)]
+    assert [result['row'] for result in results] == [0, 1, 2]
+    assert 'error' in results[1] and 'output' in results[2]
+
+
+def test_dataset_without_input_columns_fails_before_scoring(tmp_path):
+    writer = JsonlResultWriter(str(tmp_path / 'scores.jsonl'))
+    scorer = BatchScorer(MOPInferenceWrapper(EchoModelWrapper()), writer)
+    with pytest.raises(ValueError, match="delimiter"):
+        scorer.score(read_records(_dataset(tmp_path, ['a b    0'], header='text    hate\n')))
+    writer.close()
+
+
+def test_parquet_files_share_one_schema(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    output = str(tmp_path / 'scores')
+    dataset = _dataset(tmp_path, ['fail', 'fail', 'ab', 'fail', 'abc', 'abcd', 'a'])
+    writer = ParquetResultWriter(output, rows_per_file=3)
+    BatchScorer(MOPInferenceWrapper(FailingModelWrapper()), writer, batch_size=2).score(read_records(dataset))
+    writer.close()
+
+    files = sorted((tmp_path / 'scores').glob('part-*.parquet'))
+    assert len(files) == 3
+    schemas = {pq.read_schema(str(file)) for file in files}
+    assert len(schemas) == 1
+    table = pq.read_table(output)
+    assert sorted(table.column('row').to_pylist()) == list(range(7))
+    assert 'output.confidence_scores.hate.a' in table.column_names
+    assert table.column('error').to_pylist().count(None) == 4
+
+
+def test_parquet_close_keeps_partial_file_for_resume(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    output = str(tmp_path / 'scores')
+    dataset = _dataset(tmp_path, ['a', 'ab', 'abc', 'abcd', 'abcde'])
+    writer = ParquetResultWriter(output, rows_per_file=100)
+    rows = read_records(dataset)
+    # an interrupted run: the writer is closed after the first 2 rows
+    BatchScorer(MOPInferenceWrapper(EchoModelWrapper()), writer, batch_size=2).score(
+        row for i, row in zip(range(2), rows))
+    writer.close()
+    assert pq.read_table(output).num_rows == 2
+
+    writer = ParquetResultWriter(output, resume=True, rows_per_file=100)
+    counts = BatchScorer(MOPInferenceWrapper(EchoModelWrapper()), writer, batch_size=2).score(read_records(dataset))
+    writer.close()
+    assert counts['skipped'] == 2 and counts['scored'] == 3
+    assert sorted(pq.read_table(output).column('row').to_pylist()) == [0, 1, 2, 3, 4]
@@ -0,0 +1,37 @@
+import json
+
+import numpy as np
+import pytest
+
+from mop_utils import serialization
+from mop_utils.base_model_wrapper import MopBatchInferenceOutput
+from mop_utils.serialization import dumps, to_native
+
+
+def _result():
+    batch_output = MopBatchInferenceOutput(
+        confidence_scores={'hate': np.array([[0.25, 0.75]], dtype=np.float32)},
+        predicted_labels={'hate': np.array([[0, 1]])},
+        label_names={'hate': ['a', 'b']})
+    return {'item': batch_output[0], 'scores': np.arange(3), np.int64(7): np.float64(0.5), 'flag': np.bool_(True)}
+
+
+EXPECTED = {
+    'item': {'confidence_scores': {'hate': {'a': 0.25, 'b': 0.75}}, 'predicted_labels': {'hate': {'a': 0, 'b': 1}}},
+    'scores': [0, 1, 2], '7': 0.5, 'flag': True,
+}
+
+
+def test_to_native():
+    native = to_native(_result())
+    assert native == {**{k: v for k, v in EXPECTED.items() if k != '7'}, 7: 0.5}
+    assert type(native[7]) is float and type(native['flag']) is bool
+
+
+@pytest.mark.parametrize('use_orjson', [False, True])
+def test_dumps(monkeypatch, use_orjson):
+    if use_orjson:
+        pytest.importorskip('orjson')
+    else:
+        monkeypatch.setattr(serialization, 'orjson', None)
+    assert json.loads(dumps(_result())) == EXPECTED
@@ -0,0 +1,97 @@
+import http.client
+import importlib
+import json
+import socket
+import sys
+import threading
+
+import pytest
+
+from mop_utils.batching import OverloadedError
+from mop_utils.server import ServerConfig, _PooledHTTPServer, _RequestHandler, _ServerState, error_status
+
+INFERENCE = '''
+from models import EchoModelWrapper
+
+
+class ModelWrapper(EchoModelWrapper):
+    pass
+'''
+
+
+@pytest.fixture
+def state(tmp_path, monkeypatch):
+    (tmp_path / 'inference.py').write_text(INFERENCE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    for name in ('inference', 'mop_utils.inference_wrapper'):
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    module = importlib.import_module('mop_utils.inference_wrapper')
+    module.mop_init('.', None)
+    yield _ServerState(module)
+    module.runtime.close()
+    sys.modules.pop('mop_utils.inference_wrapper', None)
+    sys.modules.pop('inference', None)
+
+
+def test_config_from_settings():
+    config = ServerConfig.from_settings({'server': {'port': 9000, 'workers': None, 'unknown': 1}})
+    assert config.port == 9000 and config.workers == 1
+    assert ServerConfig.from_settings({}) == ServerConfig()
+    for args in ({'workers': 0}, {'threads': 0}, {'frontend': 'gevent'}):
+        with pytest.raises(ValueError):
+            ServerConfig.from_dict(args)
+
+
+def test_route(state):
+    assert state.route('GET', '/health', b'')[0] == 503
+    assert state.route('POST', '/score', b'{"x": 1}')[0] == 503
+    state.ready = True
+    assert state.route('GET', '/health', b'')[0] == 200
+    assert state.route('GET', '/score', b'')[0] == 405
+    assert state.route('GET', '/other', b'')[0] == 404
+
+    status, body, _ = state.route('POST', '/score?mop=0', b'{"x": 1}')
+    assert status == 200 and json.loads(body) == [{'echo': {'x': 1}}]
+    assert state.route('POST', '/score', b'{x')[0] == 400
+    assert state.route('POST', '/score?model=unknown', b'{"x": 1}')[0] == 404
+    assert state.server_stats()['requests'] == 3
+    assert state.server_stats()['errors'] == 2
+
+
+def test_overloaded_requests_get_429(state, monkeypatch):
+    def mop_run(*args):
+        raise OverloadedError("The dynamic batch queue is full")
+
+    monkeypatch.setattr(state.inference_wrapper, 'mop_run', mop_run)
+    state.ready = True
+    assert state.route('POST', '/score', b'{"x": 1}')[0] == 429
+    assert state.server_stats()['overloaded'] == 1
+
+
+def test_invalid_inputs_get_400(state):
+    state.ready = True
+    assert state.route('POST', '/score', b'{"x": 1}')[0] == 400
+    assert state.route('POST', '/score', b'"text"')[0] == 400
+    assert state.route('POST', '/score?mop=0', b'"text"')[0] == 400
+    assert error_status(RuntimeError(), {'text': 'hello'}, True) == 500
+    assert error_status(ValueError(), {'x': 1}, False) == 500
+
+
+def test_http_round_trip(state):
+    sock = socket.create_server(('127.0.0.1', 0))
+    handler_class = type('RequestHandler', (_RequestHandler,), {'state': state})
+    server = _PooledHTTPServer(sock, handler_class, 2)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    state.ready = True
+    try:
+        connection = http.client.HTTPConnection('127.0.0.1', sock.getsockname()[1], timeout=5)
+        connection.request('POST', '/score?mop=0', body=b'{"x": 1}')
+        response = connection.getresponse()
+        assert response.status == 200
+        assert json.loads(response.read()) == [{'echo': {'x': 1}}]
+        connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join(5)
@@ -0,0 +1,36 @@
+import pytest
+
+from mop_utils.base_model_wrapper import MopInferenceInput
+from mop_utils.util import AcsImageResponse, AcsTextResponse, AnalysisResult, ImageAnalysisInput, TextAnalysisInput
+
+
+@pytest.mark.parametrize('obj', [MopInferenceInput(text='a'), TextAnalysisInput('a'), ImageAnalysisInput(b'a'),
+                                 AnalysisResult(0.5, 2), AcsTextResponse(), AcsImageResponse()])
+def test_no_instance_dict(obj):
+    assert not hasattr(obj, '__dict__')
+    with pytest.raises(AttributeError):
+        obj.other = 1
+
+
+def test_acs_response_defaults_are_not_shared():
+    first, second = AcsTextResponse(), AcsTextResponse()
+    first.hate.severity_level = 4
+    assert second.hate.severity_level == 0
+    assert first.self_harm is not first.hate
+
+
+@pytest.mark.parametrize('cls', [AcsTextResponse, AcsImageResponse])
+def test_acs_response_round_trip(cls):
+    response = cls(hate=AnalysisResult(0.75, 2))
+    restored = cls.from_dict(response.to_dict())
+    assert type(restored) is cls
+    assert restored.to_dict() == response.to_dict()
+    assert restored.to_dict()['hate'] == {'harmful_score': 0.75, 'severity_level': 2}
+
+
+def test_mop_input_round_trip():
+    item = {'text': 'a', 'image': None, 'width': 3, 'height': None, 'images': ['b']}
+    assert MopInferenceInput.create(item).to_dict() == item
+    assert MopInferenceInput().from_dict(item).to_dict() == item
+    with pytest.raises(ValueError):
+        MopInferenceInput.create({'width': 3})
@@ -0,0 +1,55 @@
+import pytest
+
+from mop_utils.runtime import MOPInferenceWrapper
+from mop_utils.warmup import SYNTHETIC_IMAGE, SYNTHETIC_INPUTS, WarmupConfig
+
+from models import EchoModelWrapper, mop_output
+
+
+class ImageModelWrapper(EchoModelWrapper):
+    """
+    Rejects the inputs without an image.
+    """
+
+    def convert_mop_input_to_model_input(self, mop_input, **kwargs):
+        if not mop_input.image:
+            raise ValueError("An image is required")
+        return super().convert_mop_input_to_model_input(mop_input)
+
+    def convert_model_output_to_mop_output(self, customized_output, **kwargs):
+        return mop_output(0.5)
+
+
+class RejectingModelWrapper(EchoModelWrapper):
+
+    def convert_mop_input_to_model_input(self, mop_input, **kwargs):
+        raise ValueError("Unsupported input")
+
+
+def _wrapper(model_wrapper, **warmup):
+    return MOPInferenceWrapper(model_wrapper, {'warmup': {'enable': True, 'batch_sizes': [1, 2], **warmup}})
+
+
+def test_synthetic_modality_is_picked_from_the_model():
+    model_wrapper = ImageModelWrapper()
+    timings = _wrapper(model_wrapper).warmup('.')
+    assert [(timing['batch_size'], timing['path']) for timing in timings] == \
+        [(1, 'inference'), (1, 'inference_batch'), (2, 'inference_batch')]
+    assert all(item['image'] == SYNTHETIC_INPUTS[SYNTHETIC_IMAGE]['image'] for item in model_wrapper.items)
+
+
+def test_warmup_is_skipped_when_no_synthetic_input_is_accepted():
+    model_wrapper = RejectingModelWrapper()
+    assert _wrapper(model_wrapper).warmup('.') == []
+    assert model_wrapper.items == []
+
+
+def test_configured_synthetic_modality_is_used():
+    model_wrapper = ImageModelWrapper()
+    with pytest.raises(ValueError):
+        _wrapper(model_wrapper, synthetic='text').warmup('.')
+
+
+def test_unknown_synthetic_modality():
+    with pytest.raises(ValueError):
+        WarmupConfig.from_dict({'synthetic': 'audio'})